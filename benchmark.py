@@ -0,0 +1,475 @@
+"""
+性能基准测试
+
+用法:
+    python benchmark.py [行数]
+        端点提取、CSV 解析和合并的新旧实现对比
+    python benchmark.py --scale [--sizes 10000 100000 1000000] [--endpoint-url URL] [--json 结果文件]
+        在本地 S3（默认 moto，也可以通过 --endpoint-url 使用 minio）中生成模拟的 CTR 和录音数据，
+        测试列出、解析、合并和下载的耗时、吞吐量和峰值内存
+"""
+import io
+import os
+import gzip
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import resource
+import uuid
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ctr_search import (
+    extract_contacts_frame, compact_result_frame, merge_contacts_and_recordings, read_csv_contacts,
+    get_contact_files_list, get_call_recordings_list, download_recordings_to_directories
+)
+
+HOTLINES = ['+18005550100', '+18005550101', '+18005550102', '+18005550103']
+
+# 完整流程测试的默认数据规模（联系记录数）
+SCALE_SIZES = [10000, 100000, 1000000]
+
+# moto 每次列出都会扫描整个存储桶，超过该规模时需要使用 --endpoint-url 指定的 S3 兼容服务
+MOTO_MAX_CONTACTS = 100000
+
+# 模拟数据的存放位置和文件布局
+BENCH_CTR_PREFIX = 'ctr-base'
+BENCH_RECORDING_PREFIX = 'connect/bench/CallRecordings'
+BENCH_ROWS_PER_FILE = 5000
+BENCH_START = datetime(2025, 5, 1)
+
+# CSV 解析测试中模拟 CTR 导出的其他列数
+BENCH_CSV_EXTRA_COLUMNS = 30
+
+# 8 kHz、16 位单声道，1 秒的 WAV 文件大小（含 44 字节文件头）
+BENCH_RECORDING_BYTES = 44 + 16000
+
+
+def extract_contacts_rowwise(df, key):
+    """原有的逐行提取实现，作为对比基准"""
+    contact_files = []
+    if 'contactid' in df.columns:
+        for _, row in df.iterrows():
+            contact_info = {
+                'ContactId': row.get('contactid', ''),
+                '热线号码': '',
+                '客户号码': '',
+                '文件路径': key
+            }
+
+            if 'systemendpoint' in df.columns:
+                if isinstance(row.get('systemendpoint'), dict):
+                    contact_info['热线号码'] = row['systemendpoint'].get('address', '')
+                elif isinstance(row.get('systemendpoint'), str):
+                    try:
+                        system_endpoint = json.loads(row['systemendpoint'])
+                        contact_info['热线号码'] = system_endpoint.get('address', '')
+                    except:
+                        pass
+
+            if not contact_info['客户号码'] and 'customerendpoint' in df.columns:
+                if isinstance(row.get('customerendpoint'), dict):
+                    contact_info['客户号码'] = row['customerendpoint'].get('address', '')
+                elif isinstance(row.get('customerendpoint'), str):
+                    try:
+                        customer_endpoint = json.loads(row['customerendpoint'])
+                        contact_info['客户号码'] = customer_endpoint.get('address', '')
+                    except:
+                        pass
+
+            contact_files.append(contact_info)
+    return contact_files
+
+
+def merge_contacts_and_recordings_dicts(contact_files, recordings, selected_numbers=None):
+    """原有的合并实现：列表 -> DataFrame -> merge -> 列表，界面显示时再转换为 DataFrame"""
+    df_contacts = pd.DataFrame(contact_files)
+    df_recordings = pd.DataFrame(recordings)
+    merged_df = pd.merge(df_contacts, df_recordings, on='ContactId', how='left', suffixes=('', '_recording'))
+    if selected_numbers:
+        merged_df = merged_df[merged_df['热线号码'].isin(selected_numbers)]
+    merged_df['有录音'] = merged_df['录音S3地址'].notna()
+    merged_records = merged_df.to_dict('records')
+    return pd.DataFrame(merged_records)
+
+
+def make_ctr_frame(rows, as_json=False, seed=0):
+    """
+    生成模拟的 CTR 数据
+
+    :param rows: 行数
+    :param as_json: True 时 endpoint 为 JSON 字符串（CSV），否则为 dict（Parquet 结构体）
+    :param seed: 随机种子
+    """
+    rnd = random.Random(seed)
+    records = []
+    for _ in range(rows):
+        system_endpoint = {'address': rnd.choice(HOTLINES), 'type': 'TELEPHONE_NUMBER'}
+        customer_endpoint = {'address': '+86138%08d' % rnd.randrange(10 ** 8), 'type': 'TELEPHONE_NUMBER'}
+        records.append({
+            'contactid': str(uuid.UUID(int=rnd.getrandbits(128))),
+            'systemendpoint': json.dumps(system_endpoint) if as_json else system_endpoint,
+            'customerendpoint': json.dumps(customer_endpoint) if as_json else customer_endpoint,
+        })
+    return pd.DataFrame(records)
+
+
+def make_merge_inputs(rows, recorded_ratio=0.6, seed=0):
+    """生成模拟的联系记录和录音记录 DataFrame"""
+    contacts = extract_contacts_frame(make_ctr_frame(rows, seed=seed), 'ctr-base/bench.parquet')
+    recorded = contacts.sample(frac=recorded_ratio, random_state=seed)
+    recordings = pd.DataFrame({
+        'ContactId': recorded['ContactId'].to_numpy(),
+        '录音S3地址': 's3://bench-recordings/connect/CallRecordings/2025/05/01/' + recorded['ContactId'] + '_20250501T00:00_UTC.wav',
+        '热线号码': recorded['热线号码'].to_numpy(),
+    })
+    return contacts, recordings
+
+
+def _current_rss():
+    """当前进程的常驻内存（字节）"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def _run_and_report_peak(func, args, queue):
+    start_rss = _current_rss()
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    queue.put((elapsed, max(peak_rss - start_rss, 0)))
+
+
+def measure_peak(func, *args):
+    """
+    在子进程中执行函数，返回 (耗时秒数, 峰值内存增量字节数)
+
+    pyarrow 的内存不经过 Python 分配器，tracemalloc 统计不到，因此使用子进程的峰值 RSS
+    """
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_run_and_report_peak, args=(func, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def timed(func, *args):
+    """执行函数并返回 (结果, 耗时秒数)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_endpoint_extraction(rows):
+    """对比逐行提取与按列提取的耗时，并校验两者结果一致"""
+    for label, as_json in (('Parquet 结构体', False), ('CSV JSON 字符串', True)):
+        df = make_ctr_frame(rows, as_json=as_json)
+        key = 'ctr-base/bench.parquet'
+
+        rowwise, rowwise_seconds = timed(extract_contacts_rowwise, df, key)
+        columnar, columnar_seconds = timed(extract_contacts_frame, df, key)
+
+        if columnar.to_dict('records') != rowwise:
+            raise AssertionError(f"{label}: 按列提取结果与逐行提取不一致")
+
+        print(f"[端点提取 / {label}] {rows} 行: 逐行 {rowwise_seconds:.3f}s, "
+              f"按列 {columnar_seconds:.3f}s, 加速 {rowwise_seconds / columnar_seconds:.1f}x")
+
+
+def read_csv_contacts_pandas(data, key, phone_numbers):
+    """原有的 CSV 解析方式：整个文件读入内存，pandas 默认引擎解析全部列后再筛选"""
+    df = extract_contacts_frame(pd.read_csv(io.BytesIO(data)), key)
+    return df[df['热线号码'].isin(phone_numbers)].reset_index(drop=True)
+
+
+def bench_csv_ingestion(rows):
+    """对比 pandas 整体解析与按块只读取所需列的 CSV 解析的耗时和峰值内存，并校验两者结果一致"""
+    df = make_ctr_frame(rows, as_json=True)
+    for i in range(BENCH_CSV_EXTRA_COLUMNS):
+        df[f'attribute{i}'] = 'value-%d' % i
+    data = df.to_csv(index=False).encode()
+    key = 'ctr-base/bench.csv'
+    selected_numbers = HOTLINES[:1]
+
+    expected = read_csv_contacts_pandas(data, key, selected_numbers).astype(object)
+    for label, body in (('CSV', data), ('CSV gzip', gzip.compress(data))):
+        streamed = read_csv_contacts(io.BytesIO(body), key, selected_numbers)
+        if not streamed.astype(object).equals(expected):
+            raise AssertionError(f"{label}: 按块解析结果与 pandas 解析结果不一致")
+
+        if label == 'CSV':
+            legacy_seconds, legacy_peak = measure_peak(read_csv_contacts_pandas, data, key, selected_numbers)
+        streamed_seconds, streamed_peak = measure_peak(read_csv_contacts, io.BytesIO(body), key, selected_numbers)
+        print(f"[CSV 解析 / {label}] {rows} 行 {len(body) / 1024 ** 2:.1f} MB: "
+              f"pandas {legacy_seconds:.3f}s / 峰值 {legacy_peak / 1024 ** 2:.1f} MB, "
+              f"按块 {streamed_seconds:.3f}s / 峰值 {streamed_peak / 1024 ** 2:.1f} MB, "
+              f"加速 {legacy_seconds / streamed_seconds:.1f}x")
+
+
+def bench_merge(rows):
+    """对比原有的 dict 往返合并与按列合并的耗时和峰值内存，并校验两者结果一致"""
+    contacts, recordings = make_merge_inputs(rows)
+    selected_numbers = HOTLINES[:2]
+
+    # 原实现的输入是 dict 列表，新实现的输入是紧凑类型的 DataFrame
+    contact_dicts = contacts.to_dict('records')
+    recording_dicts = recordings.to_dict('records')
+    compact_contacts = compact_result_frame(contacts)
+    compact_recordings = compact_result_frame(recordings)
+
+    legacy = merge_contacts_and_recordings_dicts(contact_dicts, recording_dicts, selected_numbers)
+    columnar = merge_contacts_and_recordings(compact_contacts, compact_recordings, selected_numbers)
+    columns = ['ContactId', '热线号码', '客户号码', '录音S3地址', '有录音']
+    if not legacy[columns].astype(object).fillna('').reset_index(drop=True).equals(
+            columnar[columns].astype(object).fillna('')):
+        raise AssertionError("按列合并结果与原有合并结果不一致")
+
+    legacy_seconds, legacy_peak = measure_peak(
+        merge_contacts_and_recordings_dicts, contact_dicts, recording_dicts, selected_numbers)
+    columnar_seconds, columnar_peak = measure_peak(
+        merge_contacts_and_recordings, compact_contacts, compact_recordings, selected_numbers)
+
+    print(f"[合并] {rows} 行: dict 往返 {legacy_seconds:.3f}s / 峰值 {legacy_peak / 1024 ** 2:.1f} MB, "
+          f"按列 {columnar_seconds:.3f}s / 峰值 {columnar_peak / 1024 ** 2:.1f} MB")
+
+
+def wav_bytes(size=BENCH_RECORDING_BYTES):
+    """生成指定大小的静音 WAV 文件（8 kHz、16 位单声道）"""
+    data_size = max(size - 44, 0)
+    header = b''.join([
+        b'RIFF', (36 + data_size).to_bytes(4, 'little'), b'WAVE',
+        b'fmt ', (16).to_bytes(4, 'little'), (1).to_bytes(2, 'little'), (1).to_bytes(2, 'little'),
+        (8000).to_bytes(4, 'little'), (16000).to_bytes(4, 'little'), (2).to_bytes(2, 'little'), (16).to_bytes(2, 'little'),
+        b'data', data_size.to_bytes(4, 'little'),
+    ])
+    return header + bytes(data_size)
+
+
+class BenchS3Writer:
+    """
+    向本地 S3 写入模拟数据
+    
+    使用 moto 时直接写入 moto 的内存后端，跳过 HTTP 层（比 put_object 快约两个数量级）；
+    使用 --endpoint-url 时通过 put_object 并发写入
+    """
+    
+    def __init__(self, s3_client, use_moto_backend, max_workers=32):
+        self.s3_client = s3_client
+        self._backend = None
+        self._executor = None
+        if use_moto_backend:
+            from moto.core import DEFAULT_ACCOUNT_ID
+            from moto.s3.models import s3_backends
+            self._backend = s3_backends[DEFAULT_ACCOUNT_ID]['aws']
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+    
+    def create_bucket(self, bucket_name):
+        self.s3_client.create_bucket(Bucket=bucket_name)
+    
+    def put(self, bucket_name, key, body):
+        if self._backend is not None:
+            self._backend.put_object(bucket_name, key, body)
+        else:
+            self._futures.append(self._executor.submit(self.s3_client.put_object, Bucket=bucket_name, Key=key, Body=body))
+    
+    def flush(self):
+        for future in self._futures:
+            future.result()
+        self._futures = []
+
+
+def generate_s3_dataset(writer, contacts, ctr_bucket, recording_bucket, recorded_ratio=0.6, full_recordings=1000,
+                        rows_per_file=BENCH_ROWS_PER_FILE, seed=0):
+    """
+    在 S3 中生成模拟的 Connect CTR 导出和录音文件
+    
+    CTR 文件按 year=/month=/day=/hour= 分区存放，Parquet（endpoint 为结构体）和 CSV（endpoint 为 JSON 字符串）交替出现；
+    录音按 年/月/日 目录存放，文件名为 {ContactId}_{时间}_UTC.wav。
+    按联系记录顺序，前 full_recordings 条录音为完整大小的 WAV，其余只有文件头，用于控制内存占用
+    
+    :param writer: BenchS3Writer 实例
+    :param contacts: 联系记录总数
+    :param ctr_bucket: 存放 CTR 的存储桶
+    :param recording_bucket: 存放录音的存储桶
+    :param recorded_ratio: 有录音的联系记录比例
+    :param full_recordings: 完整大小的录音数量
+    :param rows_per_file: 每个 CTR 文件的记录数
+    :param seed: 随机种子
+    :return: 数据集信息
+    """
+    rnd = random.Random(seed)
+    writer.create_bucket(ctr_bucket)
+    writer.create_bucket(recording_bucket)
+    full_body = wav_bytes()
+    header_body = wav_bytes(44)
+    
+    files = 0
+    recordings = 0
+    for file_index, start in enumerate(range(0, contacts, rows_per_file)):
+        rows = min(rows_per_file, contacts - start)
+        moment = BENCH_START + timedelta(hours=file_index)
+        as_json = file_index % 2 == 1
+        df = make_ctr_frame(rows, as_json=as_json, seed=seed + file_index)
+        df['initiationtimestamp'] = moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+        df['channel'] = 'VOICE'
+        
+        partition = f"{BENCH_CTR_PREFIX}/year={moment:%Y}/month={moment:%m}/day={moment:%d}/hour={moment:%H}"
+        if as_json:
+            writer.put(ctr_bucket, f"{partition}/ctr-{file_index:05d}.csv", df.to_csv(index=False).encode())
+        else:
+            buffer = io.BytesIO()
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buffer)
+            writer.put(ctr_bucket, f"{partition}/ctr-{file_index:05d}.parquet", buffer.getvalue())
+        files += 1
+        
+        for contact_id in df['contactid']:
+            if rnd.random() < recorded_ratio:
+                key = f"{BENCH_RECORDING_PREFIX}/{moment:%Y/%m/%d}/{contact_id}_{moment:%Y%m%dT%H:%M}_UTC.wav"
+                writer.put(recording_bucket, key, full_body if recordings < full_recordings else header_body)
+                recordings += 1
+    
+    writer.flush()
+    return {'contacts': contacts, 'ctr_files': files, 'recordings': recordings}
+
+
+def track_peak(func, *args, interval=0.01):
+    """
+    在当前进程中执行函数，后台线程定期采样 RSS
+    
+    :return: (结果, 耗时秒数, 峰值内存增量字节数)
+    """
+    start_rss = _current_rss()
+    peak = [start_rss]
+    stop = threading.Event()
+    
+    def sample():
+        while not stop.wait(interval):
+            peak[0] = max(peak[0], _current_rss())
+    
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        result = func(*args)
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        sampler.join()
+    peak[0] = max(peak[0], _current_rss())
+    return result, elapsed, peak[0] - start_rss
+
+
+def bench_scale(s3_client, size, writer, download_limit=1000):
+    """
+    在指定规模的模拟数据上测试完整流程
+    
+    :return: 各阶段的测试结果列表
+    """
+    ctr_bucket = f"bench-ctr-{size}"
+    recording_bucket = f"bench-recordings-{size}"
+    dataset, generate_seconds = timed(generate_s3_dataset, writer, size, ctr_bucket, recording_bucket, 0.6, download_limit)
+    print(f"[数据生成] {size} 条联系记录: {dataset['ctr_files']} 个 CTR 文件, {dataset['recordings']} 个录音, {generate_seconds:.1f}s")
+    
+    selected_numbers = HOTLINES[:2]
+    results = []
+    
+    def report(stage, items, unit, seconds, peak, extra=None):
+        result = {
+            'size': size, 'stage': stage, 'items': items, 'seconds': round(seconds, 4),
+            'throughput': round(items / max(seconds, 1e-9), 1), 'unit': unit, 'peak_rss_mb': round(peak / 1024 ** 2, 1),
+            **(extra or {})
+        }
+        results.append(result)
+        print(f"[{stage}] {size} 条联系记录: {items} {unit}, {seconds:.3f}s, "
+              f"{result['throughput']:.0f} {unit}/s, 峰值内存 +{result['peak_rss_mb']:.1f} MB")
+    
+    contacts, seconds, peak = track_peak(get_contact_files_list, s3_client, f"s3://{ctr_bucket}/{BENCH_CTR_PREFIX}", selected_numbers)
+    report('get_contact_files_list', len(contacts), '条', seconds, peak)
+    
+    recordings, seconds, peak = track_peak(
+        get_call_recordings_list, s3_client, f"s3://{recording_bucket}/{BENCH_RECORDING_PREFIX}", selected_numbers)
+    report('get_call_recordings_list', len(recordings), '条', seconds, peak)
+    
+    merged, seconds, peak = track_peak(merge_contacts_and_recordings, contacts, recordings, selected_numbers)
+    report('merge_contacts_and_recordings', len(merged), '条', seconds, peak)
+    
+    # 下载只取前 download_limit 个录音（即生成的完整大小录音）
+    sample = merged[merged['有录音']].head(download_limit)
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as target_dir:
+        os.chdir(target_dir)
+        try:
+            stats, seconds, peak = track_peak(download_recordings_to_directories, s3_client, sample, 'recordings')
+        finally:
+            os.chdir(working_dir)
+    if stats is None:
+        # 下载函数出错时返回 None，错误已经通过 ctr_search 的日志输出
+        results.append({'size': size, 'stage': 'download_recordings_to_directories', 'error': '下载失败'})
+        print(f"[download_recordings_to_directories] {size} 条联系记录: 下载失败，错误见上面的日志")
+    else:
+        report('download_recordings_to_directories', stats['downloaded'], '个文件', seconds, peak,
+               {'mb_per_second': round(stats['bytes'] / 1024 ** 2 / max(seconds, 1e-9), 2), 'failed': stats['failed']})
+    
+    return results
+
+
+def run_scale_benchmarks(sizes, endpoint_url=None, download_limit=1000):
+    """按各个规模生成数据并测试完整流程，未指定 endpoint_url 时使用 moto"""
+    results = []
+    for size in sizes:
+        if endpoint_url:
+            s3_client = boto3.client('s3', endpoint_url=endpoint_url)
+            results.extend(bench_scale(s3_client, size, BenchS3Writer(s3_client, False), download_limit))
+            continue
+        
+        if size > MOTO_MAX_CONTACTS:
+            print(f"[跳过] {size} 条联系记录: moto 的列出操作随存储桶大小线性变慢，请使用 --endpoint-url 指定 minio 等 S3 兼容服务")
+            continue
+        
+        try:
+            from moto import mock_aws
+        except ImportError:
+            sys.exit("需要安装 moto，或通过 --endpoint-url 指定 S3 兼容服务")
+        
+        for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+            os.environ.setdefault(name, 'bench')
+        with mock_aws():
+            s3_client = boto3.client('s3', region_name='us-east-1')
+            results.extend(bench_scale(s3_client, size, BenchS3Writer(s3_client, True), download_limit))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='性能基准测试')
+    parser.add_argument('rows', nargs='?', type=int, default=100000, help='端点提取、CSV 解析和合并对比测试的行数')
+    parser.add_argument('--scale', action='store_true', help='在本地 S3 中生成数据并测试完整流程')
+    parser.add_argument('--sizes', nargs='+', type=int, default=SCALE_SIZES, help='完整流程测试的联系记录数')
+    parser.add_argument('--endpoint-url', help='S3 兼容服务地址（例如 minio），不指定时使用 moto')
+    parser.add_argument('--download-limit', type=int, default=1000, help='下载测试的录音数量')
+    parser.add_argument('--json', help='将完整流程测试结果保存为 JSON 文件，便于对比')
+    args = parser.parse_args()
+    
+    if args.scale:
+        scale_results = run_scale_benchmarks(args.sizes, args.endpoint_url, args.download_limit)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(scale_results, f, ensure_ascii=False, indent=2)
+    else:
+        bench_endpoint_extraction(args.rows)
+        bench_csv_ingestion(args.rows)
+        bench_merge(args.rows)
@@ -0,0 +1,376 @@
+"""
+命令行批量查询和下载，不需要 Streamlit 和浏览器会话
+
+用法:
+    python cli.py search --ctr-path s3://bucket/ctr-base --start 2025-05-01 --end 2025-05-07 \\
+        --hotline +18005550100 --recordings-path s3://bucket/connect/instance/CallRecordings --output results.parquet
+    python cli.py search --instance-id ID --association-id ID --ctr-path s3://bucket/ctr-base \\
+        --output results.csv --download-dir recordings
+    python cli.py download --input results.parquet --output-dir recordings
+    python cli.py export-zip --input results.parquet --export-path s3://export-bucket/ctr-search-exports/
+    python cli.py search-instances --target us-east-1,INSTANCE_ID,ASSOCIATION_ID,s3://bucket/ctr-base \\
+        --target eu-west-1,INSTANCE_ID,ASSOCIATION_ID,s3://bucket-eu/ctr-base --start 2025-05-01 --end 2025-05-07 --output all.parquet
+    python cli.py rollup --ctr-path s3://bucket/ctr-base --recordings-path s3://bucket/connect/instance/CallRecordings \\
+        --output daily.csv
+"""
+import sys
+import logging
+import argparse
+import warnings
+from datetime import datetime, timedelta
+
+import boto3
+import pandas as pd
+
+from ctr_search import (
+    DEFAULT_MAX_WORKERS, ClientPool, ContactFileCache, DailyRollupStore, QueryStats, RecordingIndex,
+    ZIP_EXPORT_URL_EXPIRES, RecordingMetadataCache, concat_contact_batches, download_recordings_to_directories,
+    enrich_recording_metadata, export_recordings_zip_to_s3, get_all_phone_numbers, get_call_recordings_list,
+    get_call_recordings_s3_bucket, initialize_clients, instrument_s3_client, merge_contacts_and_recordings,
+    parse_s3_path, search_instances, stream_contact_files
+)
+
+logger = logging.getLogger('ctr_search.cli')
+
+# 每处理多少个文件输出一次进度
+PROGRESS_LOG_INTERVAL = 100
+
+def parse_date_range(start, end):
+    """
+    解析 --start/--end 为 (开始时间, 结束时间)
+    
+    只有日期时结束日期包含当天，与界面的日期范围一致；带时间时结束时间不包含
+    """
+    if not start and not end:
+        return None
+    if not (start and end):
+        raise ValueError("--start 和 --end 需要同时指定")
+    
+    start_time = datetime.fromisoformat(start)
+    end_time = datetime.fromisoformat(end)
+    if len(end) == 10:
+        end_time += timedelta(days=1)
+    if end_time <= start_time:
+        raise ValueError("结束时间需要晚于开始时间")
+    return start_time, end_time
+
+def parse_target(value):
+    """解析 --target 参数：区域,实例ID,关联ID,CTR路径，关联 ID 可以为空（不查询录音）"""
+    parts = [part.strip() for part in value.split(',', 3)]
+    if len(parts) != 4 or not (parts[0] and parts[1] and parts[3]):
+        raise argparse.ArgumentTypeError(f"{value} 的格式应为 区域,实例ID,关联ID,CTR路径")
+    return {'region': parts[0], 'instance_id': parts[1], 'association_id': parts[2], 'ctr_path': parts[3]}
+
+def parse_workers(value):
+    """解析 --workers 参数，必须为正整数"""
+    try:
+        workers = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} 不是整数")
+    if workers < 1:
+        raise argparse.ArgumentTypeError("--workers 至少为 1")
+    return workers
+
+def write_results(df, path):
+    """按扩展名将结果写入 Parquet 或 CSV 文件"""
+    if path.endswith('.csv'):
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+    else:
+        df.to_parquet(path, index=False)
+
+def read_results(path):
+    """读取 write_results 写入的结果文件"""
+    if path.endswith('.csv'):
+        return pd.read_csv(path, dtype=str, keep_default_na=False).replace({'录音S3地址': {'': None}})
+    return pd.read_parquet(path)
+
+def write_stats(stats, path):
+    """保存查询统计，.json 为 JSON，其余为 OpenMetrics 文本"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(stats.to_json() if path.endswith('.json') else stats.to_openmetrics())
+
+def log_download_progress(done, total, transferred_bytes, elapsed):
+    if done % PROGRESS_LOG_INTERVAL == 0 or done == total:
+        logger.info(f"已下载 {done}/{total} 个录音，{transferred_bytes / 1024 ** 2 / max(elapsed, 1e-6):.1f} MB/秒")
+
+def add_recording_metadata(s3_client, records, args, stats):
+    """读取结果中每个录音的 WAV 文件头，添加时长、采样率和声道数列"""
+    def log_metadata_progress(done, total):
+        if done % PROGRESS_LOG_INTERVAL == 0 or done == total:
+            logger.info(f"已读取 {done}/{total} 个录音文件头")
+    
+    with stats.span('enrich_recording_metadata'):
+        return enrich_recording_metadata(
+            s3_client, records,
+            cache=None if args.no_cache else RecordingMetadataCache(),
+            index=None if args.no_index else RecordingIndex(),
+            max_workers=args.workers,
+            progress_callback=log_metadata_progress,
+            stats=stats
+        )
+
+def download(s3_client, records, output_dir, max_workers):
+    """下载结果中的录音并输出统计，有失败的文件时返回 False"""
+    result = download_recordings_to_directories(s3_client, records, output_dir, max_workers, log_download_progress)
+    if result is None:
+        return False
+    logger.info(
+        f"下载完成：新下载 {result['downloaded']} 个，跳过已存在的 {result['skipped']} 个，失败 {result['failed']} 个，"
+        f"保存在 {result['base_dir']}（{result['phone_groups']} 个热线号码目录）"
+    )
+    return result['failed'] == 0
+
+def resolve_recordings_path(connect_client, args):
+    """
+    返回录音的 S3 路径，未指定 --recordings-path 时通过实例的录音存储配置获取
+    
+    :return: 录音路径，没有指定任何录音参数时为 None，获取失败时记录错误并返回 False
+    """
+    if args.recordings_path or not (args.instance_id and args.association_id):
+        return args.recordings_path
+    recordings_path = get_call_recordings_s3_bucket(connect_client, args.instance_id, args.association_id)
+    if not recordings_path.startswith('s3://'):
+        logger.error(recordings_path)
+        return False
+    return recordings_path
+
+def run_search(args):
+    session = boto3.Session(profile_name=args.profile, region_name=args.region)
+    connect_client, s3_client = initialize_clients(session, args.region, args.workers)
+    stats = QueryStats()
+    instrument_s3_client(s3_client, stats)
+    
+    hotlines = args.hotline
+    if not hotlines and args.instance_id:
+        hotlines = [number['PhoneNumber'] for number in get_all_phone_numbers(connect_client, args.instance_id)]
+        logger.info(f"使用实例的全部 {len(hotlines)} 个热线号码")
+    
+    recordings_path = resolve_recordings_path(connect_client, args)
+    if recordings_path is False:
+        return 1
+    
+    date_range = parse_date_range(args.start, args.end)
+    
+    def log_contact_progress(files_done, rows_done):
+        if files_done % PROGRESS_LOG_INTERVAL == 0:
+            logger.info(f"已处理 {files_done} 个通话记录文件，找到 {rows_done} 条联系记录")
+    
+    with stats.span('stream_contact_files'):
+        contact_files = concat_contact_batches(stream_contact_files(
+            s3_client, args.ctr_path, hotlines,
+            date_range=date_range,
+            max_workers=args.workers,
+            progress_callback=log_contact_progress,
+            cache=None if args.no_cache else ContactFileCache(),
+            stats=stats
+        ))
+    logger.info(f"找到 {len(contact_files)} 条联系记录")
+    
+    if recordings_path:
+        with stats.span('get_call_recordings_list'):
+            recordings = get_call_recordings_list(
+                s3_client, recordings_path, hotlines,
+                index=None if args.no_index else RecordingIndex(),
+                contact_hotlines=contact_files.set_index('ContactId')['热线号码']
+            )
+        logger.info(f"找到 {len(recordings)} 条录音记录")
+        with stats.span('merge_contacts_and_recordings'):
+            results = merge_contacts_and_recordings(contact_files, recordings, hotlines)
+    else:
+        results = contact_files
+    
+    if args.recording_metadata and recordings_path:
+        results = add_recording_metadata(s3_client, results, args, stats)
+    
+    write_results(results, args.output)
+    logger.info(f"已将 {len(results)} 条记录写入 {args.output}")
+    
+    succeeded = True
+    if args.download_dir:
+        if recordings_path:
+            succeeded = download(s3_client, results, args.download_dir, args.workers)
+        else:
+            logger.error("下载录音需要指定 --recordings-path 或 --instance-id 和 --association-id")
+            succeeded = False
+    
+    if args.stats_output:
+        write_stats(stats, args.stats_output)
+    return 0 if succeeded else 1
+
+def run_search_instances(args):
+    session = boto3.Session(profile_name=args.profile)
+    # 多个实例在同一区域时共享客户端，连接池按同时查询的实例数放大
+    pool = ClientPool(args.workers * len(args.target))
+    stats = QueryStats()
+    
+    with stats.span('search_instances'):
+        results = search_instances(
+            pool, session, args.target, args.hotline, parse_date_range(args.start, args.end),
+            max_workers=args.workers,
+            cache=None if args.no_cache else ContactFileCache(),
+            index=None if args.no_index else RecordingIndex(),
+            stats=stats
+        )
+    for target in results['targets'].to_dict('records'):
+        if target['错误']:
+            logger.error(f"实例 {target['实例ID']}（{target['区域']}）查询失败: {target['错误']}")
+        else:
+            logger.info(f"实例 {target['实例ID']}（{target['区域']}）: {target['联系记录数']} 条联系记录，{target['录音数']} 条录音")
+    
+    merged_records = results['merged_records']
+    if args.recording_metadata:
+        # 其他区域的存储桶由 botocore 按重定向自动切换区域
+        merged_records = add_recording_metadata(pool.get(session, args.region)[1], merged_records, args, stats)
+    write_results(merged_records, args.output)
+    logger.info(f"已将 {len(merged_records)} 条记录写入 {args.output}")
+    
+    succeeded = not results['targets']['错误'].any()
+    if args.download_dir:
+        # 其他区域的存储桶由 botocore 按重定向自动切换区域
+        _, s3_client = pool.get(session, args.region)
+        succeeded = download(s3_client, merged_records, args.download_dir, args.workers) and succeeded
+    
+    if args.stats_output:
+        write_stats(stats, args.stats_output)
+    return 0 if succeeded else 1
+
+def run_download(args):
+    session = boto3.Session(profile_name=args.profile, region_name=args.region)
+    _, s3_client = initialize_clients(session, args.region, args.workers)
+    records = read_results(args.input)
+    if '录音S3地址' not in records.columns:
+        logger.error(f"{args.input} 中没有录音S3地址列，请使用包含录音路径的查询结果")
+        return 1
+    return 0 if download(s3_client, records, args.output_dir, args.workers) else 1
+
+def run_export_zip(args):
+    session = boto3.Session(profile_name=args.profile, region_name=args.region)
+    _, s3_client = initialize_clients(session, args.region, args.workers)
+    records = read_results(args.input)
+    if '录音S3地址' not in records.columns:
+        logger.error(f"{args.input} 中没有录音S3地址列，请使用包含录音路径的查询结果")
+        return 1
+    export_uri, export_url = export_recordings_zip_to_s3(s3_client, records, args.export_path, args.label)
+    logger.info(f"已打包到 {export_uri}，下载链接 {ZIP_EXPORT_URL_EXPIRES // 60} 分钟内有效")
+    print(export_url)
+    return 0
+
+def run_rollup(args):
+    session = boto3.Session(profile_name=args.profile, region_name=args.region)
+    connect_client, s3_client = initialize_clients(session, args.region, args.workers)
+    recordings_path = resolve_recordings_path(connect_client, args)
+    if recordings_path is False:
+        return 1
+    
+    recording_index = None
+    if recordings_path:
+        recording_index = RecordingIndex()
+        added = recording_index.sync(s3_client, *parse_s3_path(recordings_path), max_workers=args.workers)
+        logger.info(f"录音索引新增 {added} 个录音")
+    else:
+        logger.warning("没有指定录音路径，新同步文件的有录音数为 0")
+    
+    def log_rollup_progress(files_done, rows_done):
+        if files_done % PROGRESS_LOG_INTERVAL == 0:
+            logger.info(f"已汇总 {files_done} 个通话记录文件，{rows_done} 条联系记录")
+    
+    store = DailyRollupStore()
+    date_range = parse_date_range(args.start, args.end)
+    stats = store.sync(
+        s3_client, args.ctr_path, recording_index, date_range,
+        full=args.full,
+        max_workers=args.workers,
+        cache=None if args.no_cache else ContactFileCache(),
+        progress_callback=log_rollup_progress
+    )
+    logger.info(
+        f"汇总完成：新增 {stats['files']} 个文件，{stats['rows']} 条联系记录，"
+        f"补充录音 {stats['recorded']} 条，失败 {stats['failed']} 个文件"
+    )
+    
+    if args.output:
+        summary = store.summary(args.hotline, date_range)
+        write_results(summary, args.output)
+        logger.info(f"已将 {len(summary)} 行每日汇总写入 {args.output}")
+    return 0 if stats['failed'] == 0 else 1
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Amazon Connect 通话记录批量查询和录音下载')
+    parser.add_argument('--region', default='us-east-1', help='AWS 区域')
+    parser.add_argument('--profile', help='AWS 配置文件名称，不指定时使用默认凭证链')
+    parser.add_argument('--workers', type=parse_workers, default=DEFAULT_MAX_WORKERS, help='并发读取和下载的线程数，S3 连接池按此大小创建')
+    parser.add_argument('--quiet', action='store_true', help='只输出警告和错误')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    search = subparsers.add_parser('search', help='查询通话记录并与录音合并，结果写入 Parquet 或 CSV 文件')
+    search.add_argument('--ctr-path', required=True, help="CTR 数据的 S3 路径，例如 s3://bucket/ctr-base")
+    search.add_argument('--start', help='开始日期或时间 (UTC)，例如 2025-05-01 或 2025-05-01T08:00')
+    search.add_argument('--end', help='结束日期（包含当天）或结束时间（不包含），例如 2025-05-07')
+    search.add_argument('--hotline', action='append', help='热线号码，可重复指定；不指定时使用实例的全部号码或不筛选')
+    search.add_argument('--recordings-path', help='录音的 S3 路径，不指定时通过 --instance-id 和 --association-id 获取')
+    search.add_argument('--instance-id', help='Amazon Connect 实例 ID')
+    search.add_argument('--association-id', help='录音存储配置的关联 ID')
+    search.add_argument('--output', required=True, help='结果文件，扩展名为 .csv 时写入 CSV，否则写入 Parquet')
+    search.add_argument('--download-dir', help='同时将录音下载到该目录，按热线号码分目录存放')
+    search.add_argument('--stats-output', help='保存查询统计，扩展名为 .json 时为 JSON，否则为 OpenMetrics 文本')
+    search.add_argument('--no-cache', action='store_true', help='不使用已解析 CTR 文件的本地缓存')
+    search.add_argument('--no-index', action='store_true', help='不使用本地录音索引，直接列出录音')
+    search.add_argument('--recording-metadata', action='store_true', help='按范围读取录音的 WAV 文件头，结果中添加时长、采样率和声道数列')
+    search.set_defaults(handler=run_search)
+    
+    search_instances_parser = subparsers.add_parser('search-instances', help='并发查询多个实例（可以在不同区域），结果合并为一个带区域和实例ID列的文件')
+    search_instances_parser.add_argument('--target', type=parse_target, action='append', required=True,
+                                         help='查询的实例，格式为 区域,实例ID,关联ID,CTR路径，可重复指定')
+    search_instances_parser.add_argument('--start', help='开始日期或时间 (UTC)，例如 2025-05-01 或 2025-05-01T08:00')
+    search_instances_parser.add_argument('--end', help='结束日期（包含当天）或结束时间（不包含），例如 2025-05-07')
+    search_instances_parser.add_argument('--hotline', action='append', help='热线号码，可重复指定；不指定时查询各实例的全部号码')
+    search_instances_parser.add_argument('--output', required=True, help='结果文件，扩展名为 .csv 时写入 CSV，否则写入 Parquet')
+    search_instances_parser.add_argument('--download-dir', help='同时将录音下载到该目录，按热线号码分目录存放')
+    search_instances_parser.add_argument('--stats-output', help='保存查询统计，扩展名为 .json 时为 JSON，否则为 OpenMetrics 文本')
+    search_instances_parser.add_argument('--no-cache', action='store_true', help='不使用已解析 CTR 文件的本地缓存')
+    search_instances_parser.add_argument('--no-index', action='store_true', help='不使用本地录音索引，直接列出录音')
+    search_instances_parser.add_argument('--recording-metadata', action='store_true', help='按范围读取录音的 WAV 文件头，结果中添加时长、采样率和声道数列')
+    search_instances_parser.set_defaults(handler=run_search_instances)
+    
+    download_parser = subparsers.add_parser('download', help='按查询结果文件下载录音')
+    download_parser.add_argument('--input', required=True, help='search 命令写入的结果文件')
+    download_parser.add_argument('--output-dir', required=True, help='录音保存目录，按热线号码分目录存放')
+    download_parser.set_defaults(handler=run_download)
+    
+    export_zip_parser = subparsers.add_parser('export-zip', help='按查询结果文件将录音打包为 ZIP 写入 S3，输出预签名下载链接')
+    export_zip_parser.add_argument('--input', required=True, help='search 命令写入的结果文件')
+    export_zip_parser.add_argument('--export-path', required=True,
+                                   help='保存 ZIP 的 S3 路径，例如 s3://export-bucket/ctr-search-exports/，需要写入权限，不要使用录音存储桶')
+    export_zip_parser.add_argument('--label', default='export', help='ZIP 文件名中的标识')
+    export_zip_parser.set_defaults(handler=run_export_zip)
+    
+    rollup = subparsers.add_parser('rollup', help='将新的 CTR 文件同步到本地每日汇总，可同时导出汇总')
+    rollup.add_argument('--ctr-path', required=True, help="CTR 数据的 S3 路径，例如 s3://bucket/ctr-base")
+    rollup.add_argument('--start', help='只同步该日期或时间 (UTC) 之后的分区，同时用于筛选导出的汇总')
+    rollup.add_argument('--end', help='结束日期（包含当天）或结束时间（不包含）')
+    rollup.add_argument('--recordings-path', help='录音的 S3 路径，用于统计有录音数，不指定时通过 --instance-id 和 --association-id 获取')
+    rollup.add_argument('--instance-id', help='Amazon Connect 实例 ID')
+    rollup.add_argument('--association-id', help='录音存储配置的关联 ID')
+    rollup.add_argument('--hotline', action='append', help='导出时只包含这些热线号码，可重复指定')
+    rollup.add_argument('--output', help='导出每日汇总，扩展名为 .csv 时写入 CSV，否则写入 Parquet')
+    rollup.add_argument('--full', action='store_true', help='清空汇总后重新读取全部文件；指定 --start/--end 时只重建范围内的日期')
+    rollup.add_argument('--no-cache', action='store_true', help='不使用已解析 CTR 文件的本地缓存')
+    rollup.set_defaults(handler=run_rollup)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # 忽略pandas的FutureWarning，只在命令行运行时设置，导入 ctr_search 不改变全局的警告过滤
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s'
+    )
+    try:
+        return args.handler(args)
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3325 @@
+"""
+Amazon Connect 通话记录和录音的查询、合并与下载
+
+不依赖 Streamlit，可在界面（recording.py）、命令行（cli.py）和批处理任务中导入使用。
+运行中的警告和错误通过 logging 输出，logger 名称为 ctr_search
+"""
+import asyncio
+import boto3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from datetime import date, datetime, timedelta, timezone
+import io
+import json
+import logging
+import base64
+import csv
+import gzip
+from io import BytesIO
+import os
+import re
+import shutil
+import time
+import random
+import hashlib
+import sqlite3
+import struct
+import threading
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# 并发读取 CTR 文件的默认线程数
+DEFAULT_MAX_WORKERS = 16
+
+# 流式读取联系记录时每批的最大记录数
+DEFAULT_BATCH_SIZE = 50000
+
+# CTR 数据的 Hive 分区字段，从粗到细
+PARTITION_KEYS = ('year', 'month', 'day', 'hour')
+
+# 并行列出对象时按 '/' 发现子前缀的最大层数（年/月/日/小时）
+LISTING_DISCOVERY_DEPTH = 4
+
+# 按范围读取 S3 对象时每次请求的最小字节数
+S3_RANGE_READ_BLOCK_SIZE = 256 * 1024
+
+# 流式解析 CSV 文件时每块的字节数，决定单个文件解析时的内存上限
+CSV_READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+# CSV 文件中需要读取的列，其余列只做分隔，不转换为 Python 对象
+CSV_CONTACT_COLUMNS = ('contactid', 'systemendpoint', 'customerendpoint')
+
+# gzip 压缩数据的文件头
+GZIP_MAGIC = b'\x1f\x8b'
+
+# 批量下载录音时每个线程只使用一个连接，由线程池控制整体并发
+DOWNLOAD_TRANSFER_CONFIG = TransferConfig(use_threads=False)
+
+# ZIP 导出：每次读取的字节数、提前打开的录音数、分段上传大小、导出文件名前缀和下载链接有效期
+ZIP_CHUNK_SIZE = 1024 * 1024
+ZIP_PREFETCH_COUNT = 4
+ZIP_UPLOAD_PART_SIZE = 16 * 1024 * 1024
+ZIP_EXPORT_FILE_PREFIX = 'recordings_'
+ZIP_EXPORT_URL_EXPIRES = 3600
+
+# 单个录音播放和下载：预签名链接有效期、按范围读取的块大小、共享缓存的总容量和单个录音上限
+RECORDING_URL_EXPIRES = 3600
+RECORDING_STREAM_CHUNK_SIZE = 1024 * 1024
+RECORDING_CACHE_MAX_BYTES = 256 * 1024 ** 2
+RECORDING_CACHE_MAX_ITEM_BYTES = 32 * 1024 ** 2
+
+# 读取录音元数据：首次按范围读取的文件头字节数，文件头之前有较大的其他块时最多读取的字节数
+WAV_HEADER_READ_BYTES = 4096
+WAV_HEADER_MAX_BYTES = 64 * 1024
+
+# 批量下载录音时记录已下载文件 ETag 的文件名
+DOWNLOAD_MANIFEST_NAME = '.download_manifest.json'
+
+# 异步 I/O 后端的默认连接池大小（同时也是执行 S3 调用的线程数）
+ASYNC_S3_POOL_CONNECTIONS = 64
+
+# 录音路径中切分数字串的分隔符（任意非数字字符）
+PHONE_TOKEN_SEPARATOR = r'\D+'
+
+# 查询结果每页显示的行数
+RESULT_PAGE_SIZE = 100
+
+# 本地缓存目录，可通过环境变量 CTR_CACHE_DIR 指定
+DEFAULT_CACHE_DIR = os.environ.get('CTR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'connect-ctr-search'))
+
+# 已解析 CTR 文件缓存的默认容量上限
+DEFAULT_CONTACT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# 每日汇总中，入库时还没有录音的联系记录保留多少天等待录音写入索引，更早的日期不再更新有录音数
+ROLLUP_PENDING_RECORDING_DAYS = 3
+
+# 从 CTR 文件的 Hive 分区路径中取出日期
+CONTACT_FILE_DAY_PATTERN = re.compile(r'year=(\d{4})/month=(\d{2})/day=(\d{2})/')
+
+# 查询统计导出为 OpenMetrics 时的指标名前缀
+QUERY_STATS_METRIC_PREFIX = 'ctr_search'
+
+# S3 限流时的重试配置
+S3_MAX_RETRIES = 5
+S3_RETRY_BASE_DELAY = 0.5
+S3_THROTTLING_ERROR_CODES = {
+    'SlowDown',
+    'Throttling',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'ServiceUnavailable',
+    'InternalError',
+    'RequestTimeout',
+}
+
+# 查询统计
+class QueryStats:
+    """
+    一次查询的耗时和计数统计，可在多个线程中同时记录
+    
+    span 记录各阶段的调用次数、总耗时和最长耗时；incr 记录带标签的计数（请求数、字节数、缓存命中等）。
+    结果可以导出为 JSON 或 OpenMetrics 文本格式
+    """
+    
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+    
+    @contextmanager
+    def span(self, name):
+        """记录代码块的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+    
+    def observe(self, name, seconds):
+        """记录一次耗时"""
+        with self._lock:
+            span = self._spans.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            span['count'] += 1
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+    
+    def incr(self, name, value=1, **labels):
+        """增加计数，labels 用于区分同一计数的不同维度（例如 S3 操作名称）"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def counter(self, name, **labels):
+        """返回计数的当前值；不指定 labels 时返回所有维度的合计"""
+        with self._lock:
+            if labels:
+                return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+            return sum(value for (counter_name, _), value in self._counters.items() if counter_name == name)
+    
+    def spans_frame(self):
+        """各阶段耗时的 DataFrame，按总耗时降序排列"""
+        with self._lock:
+            rows = [{'阶段': name, '次数': span['count'], '总耗时(秒)': round(span['seconds'], 4), '最长耗时(秒)': round(span['max_seconds'], 4)}
+                    for name, span in self._spans.items()]
+        return pd.DataFrame(rows, columns=['阶段', '次数', '总耗时(秒)', '最长耗时(秒)']).sort_values('总耗时(秒)', ascending=False, ignore_index=True)
+    
+    def counters_frame(self):
+        """计数的 DataFrame"""
+        with self._lock:
+            rows = [{'计数': name, '标签': ', '.join(f"{key}={value}" for key, value in labels), '值': value}
+                    for (name, labels), value in sorted(self._counters.items())]
+        return pd.DataFrame(rows, columns=['计数', '标签', '值'])
+    
+    def to_dict(self):
+        with self._lock:
+            return {
+                'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                'spans': {name: dict(span) for name, span in self._spans.items()},
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self._counters.items())]
+            }
+    
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+    
+    def to_openmetrics(self, prefix=QUERY_STATS_METRIC_PREFIX):
+        """导出为 OpenMetrics 文本格式：阶段耗时为 summary，计数为 counter"""
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        
+        def format_labels(labels):
+            return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}' if labels else ''
+        
+        data = self.to_dict()
+        lines = [f"# TYPE {prefix}_span_seconds summary", f"# UNIT {prefix}_span_seconds seconds"]
+        for name, span in sorted(data['spans'].items()):
+            labels = format_labels([('span', name)])
+            lines.append(f"{prefix}_span_seconds_count{labels} {span['count']}")
+            lines.append(f"{prefix}_span_seconds_sum{labels} {span['seconds']:.6f}")
+        
+        counter_names = sorted({counter['name'] for counter in data['counters']})
+        for name in counter_names:
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for counter in data['counters']:
+                if counter['name'] == name:
+                    lines.append(f"{prefix}_{name}_total{format_labels(sorted(counter['labels'].items()))} {counter['value']}")
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+def instrument_s3_client(s3_client, stats):
+    """
+    在 S3 客户端上注册事件处理函数，把每次 API 调用记录到 stats
+    
+    记录各操作的请求数和耗时、botocore 自动重试次数、错误码、列出的对象数和 GetObject 返回的字节数。
+    客户端的所有调用（包括线程池和 download_file 内部的调用）都会被统计。
+    同一个客户端再次调用时替换之前注册的处理函数，复用的客户端只记录到最近一次指定的 stats
+    
+    :param s3_client: boto3 S3 客户端
+    :param stats: QueryStats 实例，为 None 时只移除之前注册的处理函数
+    """
+    def before_call(context, **kwargs):
+        context['query_stats_started'] = time.perf_counter()
+    
+    def after_call(parsed, model, context, **kwargs):
+        operation = model.name
+        started = context.pop('query_stats_started', None)
+        if started is not None:
+            stats.observe(f"s3.{operation}", time.perf_counter() - started)
+        stats.incr('s3_requests', operation=operation)
+        
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        if retries:
+            stats.incr('s3_retries', retries, operation=operation)
+        error_code = parsed.get('Error', {}).get('Code')
+        if error_code:
+            stats.incr('s3_errors', operation=operation, code=error_code)
+        
+        if operation == 'ListObjectsV2':
+            stats.incr('s3_objects_listed', len(parsed.get('Contents', [])))
+        elif operation == 'GetObject' and not error_code:
+            stats.incr('s3_bytes_downloaded', parsed.get('ContentLength', 0))
+    
+    for event_name, handler in (('before-call.s3', before_call), ('after-call.s3', after_call)):
+        unique_id = f"ctr_search.query_stats.{event_name}"
+        s3_client.meta.events.unregister(event_name, unique_id=unique_id)
+        if stats is not None:
+            s3_client.meta.events.register(event_name, handler, unique_id=unique_id)
+
+# Connect API 函数
+def initialize_clients(session, region, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    初始化 AWS 客户端
+    
+    :param session: boto3 Session
+    :param region: AWS 区域
+    :param max_workers: 使用该客户端的最大并发线程数，S3 连接池按此大小创建
+    """
+    connect_client = session.client('connect', region_name=region)
+    # 连接池需要不小于并发线程数，否则并发读取时会频繁丢弃连接
+    s3_client = session.client(
+        's3',
+        region_name=region,
+        config=Config(max_pool_connections=max_workers * 2)
+    )
+    return connect_client, s3_client
+
+class ClientPool:
+    """
+    按凭证标识和区域复用的 Connect/S3 客户端
+    
+    boto3 客户端可以在多个线程中共享，但从同一个 Session 并发创建客户端不是线程安全的，因此创建时加锁。
+    S3 连接池按 max_workers 创建，使用客户端的并发线程数不应超过 max_workers
+    """
+    
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._clients = {}
+        self._lock = threading.Lock()
+    
+    def get(self, session, region, identity=None):
+        """
+        返回 (connect_client, s3_client)，同一凭证标识和区域只创建一次
+        
+        :param session: boto3 Session，仅在首次创建该区域的客户端时使用
+        :param region: AWS 区域
+        :param identity: 可选，凭证标识（例如配置文件名称或 Access Key ID），凭证变化时应使用不同的标识
+        """
+        key = (identity, region)
+        with self._lock:
+            clients = self._clients.get(key)
+            if clients is None:
+                clients = self._clients[key] = initialize_clients(session, region, self.max_workers)
+            return clients
+    
+    def clear(self):
+        """丢弃所有已创建的客户端"""
+        with self._lock:
+            self._clients.clear()
+
+def list_phone_numbers(connect_client, instance_id, max_results=100, next_token=None):
+    """获取 Connect 实例的电话号码列表"""
+    params = {
+        'InstanceId': instance_id,
+        'MaxResults': max_results
+    }
+    
+    if next_token:
+        params['NextToken'] = next_token
+        
+    return connect_client.list_phone_numbers(**params)
+
+def get_all_phone_numbers(connect_client, instance_id):
+    """获取所有电话号码，处理分页"""
+    phone_numbers = []
+    
+    # 获取第一页结果
+    response = list_phone_numbers(connect_client, instance_id)
+    
+    for number in response.get('PhoneNumberSummaryList', []):
+        phone_numbers.append({
+            'PhoneNumber': number.get('PhoneNumber'),
+            'PhoneNumberId': number.get('PhoneNumberId'),
+            'PhoneNumberType': number.get('PhoneNumberType')
+        })
+    
+    # 处理分页
+    while 'NextToken' in response:
+        response = list_phone_numbers(
+            connect_client, 
+            instance_id, 
+            next_token=response['NextToken']
+        )
+        
+        for number in response.get('PhoneNumberSummaryList', []):
+            phone_numbers.append({
+                'PhoneNumber': number.get('PhoneNumber'),
+                'PhoneNumberId': number.get('PhoneNumberId'),
+                'PhoneNumberType': number.get('PhoneNumberType')
+            })
+    
+    return phone_numbers
+
+def get_call_recordings_s3_bucket(connect_client, instance_id, association_id):
+    """
+    获取 Amazon Connect 实例的通话录音 S3 存储桶路径
+    
+    :param connect_client: Connect 客户端
+    :param instance_id: Amazon Connect 实例 ID
+    :param association_id: 关联 ID
+    :return: 通话录音的 S3 存储桶路径
+    """
+    try:
+        # 获取实例存储配置
+        response = connect_client.describe_instance_storage_config(
+            InstanceId=instance_id,
+            AssociationId=association_id,
+            ResourceType='CALL_RECORDINGS'  # 通话录音的固定值
+        )
+        
+        # 从存储配置中提取 S3 存储桶路径
+        storage_config = response.get('StorageConfig', {})
+        s3_config = storage_config.get('S3Config', {})
+        
+        if s3_config:
+            bucket_name = s3_config.get('BucketName')
+            bucket_prefix = s3_config.get('BucketPrefix', '')
+            
+            if bucket_name:
+                return f"s3://{bucket_name}/{bucket_prefix}"
+            else:
+                return "S3Config 中缺少 BucketName"
+        else:
+            return "StorageConfig 中缺少 S3Config"
+    
+    except Exception as e:
+        return f"获取通话录音 S3 路径时出错: {str(e)}"
+
+def contact_id_from_recording_key(key):
+    """从录音文件路径中提取联系 ID"""
+    file_name = key.split('/')[-1]
+    return file_name.split('_')[0] if '_' in file_name else file_name.replace('.wav', '')
+
+def attribute_recording_hotlines(recordings, phone_numbers=None, contact_hotlines=None):
+    """
+    确定每条录音所属的热线号码
+    
+    优先使用 CTR 数据中 ContactId 对应的热线号码；找不到时从录音路径中提取数字串，
+    在所选号码的哈希表中查找（每个路径只扫描一次，与号码数量无关）；仍然找不到时标记为 '未知'，
+    只选择了一个号码时也不会直接归属于该号码
+    
+    :param recordings: 包含 ContactId、录音S3地址 列的 DataFrame
+    :param phone_numbers: 可选，所选热线号码列表
+    :param contact_hotlines: 可选，以 ContactId 为索引、热线号码为值的 Series
+    :return: 更新了 热线号码 列的录音 DataFrame
+    """
+    recordings = recordings.copy()
+    hotlines = pd.Series(None, index=recordings.index, dtype=object)
+    if recordings.empty:
+        recordings['热线号码'] = hotlines
+        return compact_result_frame(recordings)
+    
+    if contact_hotlines is not None and len(contact_hotlines) > 0:
+        contact_hotlines = contact_hotlines[~contact_hotlines.index.duplicated()]
+        hotlines = recordings['ContactId'].astype(object).map(contact_hotlines.astype(object))
+        hotlines = hotlines.where(hotlines != '')
+    
+    missing = hotlines.isna()
+    if phone_numbers and missing.any():
+        # 路径按非数字字符切分为数字串，所有数字串一次性在号码哈希表中查找，取每条路径第一个命中的号码
+        digits = [phone.lstrip('+') for phone in phone_numbers]
+        paths = pa.array(recordings.loc[missing, '录音S3地址'].astype(object), type=pa.string())
+        tokens = pc.split_pattern_regex(paths, PHONE_TOKEN_SEPARATOR)
+        positions = pc.index_in(pc.list_flatten(tokens), value_set=pa.array(digits)).to_numpy(zero_copy_only=False)
+        parents = pc.list_parent_indices(tokens).to_numpy()
+        hit = ~np.isnan(positions.astype(float))
+        rows, first = np.unique(parents[hit], return_index=True)
+        numbers = np.array(phone_numbers, dtype=object)[positions[hit][first].astype(np.int64)]
+        hotlines.iloc[np.flatnonzero(missing.to_numpy())[rows]] = numbers
+    
+    recordings['热线号码'] = hotlines.fillna('未知')
+    return compact_result_frame(recordings)
+
+def lookup_indexed_recordings(index, bucket_name, bucket_prefix, phone_numbers, contact_hotlines):
+    """
+    在已同步的录音索引中按通话记录的 ContactId 查找录音，并确定录音的热线号码
+    
+    :param index: RecordingIndex 实例
+    :param bucket_name: 录音存储桶名称
+    :param bucket_prefix: 录音前缀
+    :param phone_numbers: 可选，所选热线号码列表
+    :param contact_hotlines: 以 ContactId 为索引、热线号码为值的 Series
+    :return: 包含 ContactId、录音S3地址、热线号码 列的 DataFrame
+    """
+    found = index.lookup(contact_hotlines.index.dropna().unique().astype(str), bucket_name, bucket_prefix)
+    recordings = found.sort_values('录音S3地址')[['ContactId', '录音S3地址']].reset_index(drop=True)
+    return attribute_recording_hotlines(recordings, phone_numbers, contact_hotlines)[RECORDING_COLUMNS]
+
+def get_call_recordings_list(s3_client, s3_bucket_path, phone_numbers=None, index=None, contact_hotlines=None):
+    """
+    获取指定 S3 存储桶路径中的所有通话录音列表
+    
+    :param s3_client: S3 客户端
+    :param s3_bucket_path: S3 存储桶路径，格式为 's3://{bucket_name}/{bucket_prefix}'
+    :param phone_numbers: 可选，筛选特定电话号码的录音
+    :param index: 可选，RecordingIndex 实例，指定时先增量同步索引，再从索引读取录音列表
+    :param contact_hotlines: 可选，以 ContactId 为索引、热线号码为值的 Series，用于确定录音的热线号码；
+                             同时指定 index 时只在索引中按这些 ContactId 查找录音，不读取前缀下的全部录音
+    :return: 包含 ContactId、录音S3地址、热线号码 列的 DataFrame
+    """
+    try:
+        # 解析 S3 存储桶路径
+        bucket_name, bucket_prefix = parse_s3_path(s3_bucket_path)
+        
+        if index is not None:
+            index.sync(s3_client, bucket_name, bucket_prefix)
+            if contact_hotlines is not None and len(contact_hotlines) > 0:
+                return lookup_indexed_recordings(index, bucket_name, bucket_prefix, phone_numbers, contact_hotlines)
+            keys = index.iter_keys(bucket_name, bucket_prefix)
+        else:
+            keys = iter_recording_keys(s3_client, bucket_name, bucket_prefix)
+        
+        contact_ids = []
+        s3_uris = []
+        for key in keys:
+            contact_ids.append(contact_id_from_recording_key(key))
+            s3_uris.append(f"s3://{bucket_name}/{key}")
+        
+        recordings = pd.DataFrame({'ContactId': contact_ids, '录音S3地址': s3_uris})
+        return attribute_recording_hotlines(recordings, phone_numbers, contact_hotlines)[RECORDING_COLUMNS]
+    
+    except Exception as e:
+        logger.error(f"获取录音列表时出错: {str(e)}")
+        return pd.DataFrame(columns=RECORDING_COLUMNS)
+
+def iter_recording_objects(s3_client, bucket_name, prefix, start_after=None):
+    """
+    逐页列出前缀下的录音文件（.wav）
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param prefix: 对象键前缀
+    :param start_after: 可选，只列出排在该键之后的对象
+    :return: 生成列表结果中的对象信息
+    """
+    params = {'Bucket': bucket_name, 'Prefix': prefix}
+    if start_after:
+        params['StartAfter'] = start_after
+    
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        for obj in page.get('Contents', []):
+            if is_recording_file(obj['Key']):
+                yield obj
+
+def is_recording_file(key):
+    """判断对象是否为录音文件（假设为 .wav 格式）"""
+    return key.endswith('.wav')
+
+def iter_recording_keys(s3_client, bucket_name, prefix, max_workers=DEFAULT_MAX_WORKERS):
+    """按日期目录并行列出前缀下录音文件的对象键"""
+    for obj in iter_objects_parallel(s3_client, bucket_name, prefix, is_recording_file, max_workers):
+        yield obj['Key']
+
+def _list_delimited(s3_client, bucket_name, prefix):
+    """按 '/' 分隔列出一层，返回 (子前缀列表, 该层直接包含的对象列表)"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    sub_prefixes = []
+    objects = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/'):
+        sub_prefixes.extend(item['Prefix'] for item in page.get('CommonPrefixes', []))
+        objects.extend(page.get('Contents', []))
+    return sub_prefixes, objects
+
+def _list_all(s3_client, bucket_name, prefix, predicate=None):
+    """逐页列出前缀下的全部对象"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    return [
+        obj
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+        for obj in page.get('Contents', [])
+        if predicate is None or predicate(obj['Key'])
+    ]
+
+def discover_listing_parts(s3_client, bucket_name, prefix, max_depth=LISTING_DISCOVERY_DEPTH, target_parts=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    按 '/' 逐层发现子前缀（日期目录、小时分区等），把一个前缀拆分为可以并发列出的多个部分
+    
+    每一层的前缀并发列出；子前缀数量达到 target_parts 或到达 max_depth 层后停止展开。
+    各层直接包含的对象在发现时已经列出，作为单独的部分返回，所有部分合起来与直接列出整个前缀的结果相同
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param prefix: 对象键前缀
+    :param max_depth: 最多展开的层数
+    :param target_parts: 子前缀数量达到该值后停止展开，默认为 max_workers 的四倍
+    :param max_workers: 并发列出的最大线程数
+    :return: [(部分名称, 已列出的对象列表或 None)]，按名称排序；对象列表为 None 的部分需要完整列出
+    """
+    target_parts = target_parts or max_workers * 4
+    parts = []
+    level = [prefix]
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in range(max_depth):
+            listings = list(executor.map(lambda p: _list_delimited(s3_client, bucket_name, p), level))
+            next_level = []
+            for level_prefix, (sub_prefixes, objects) in zip(level, listings):
+                if objects:
+                    parts.append((level_prefix, objects))
+                next_level.extend(sub_prefixes)
+            level = next_level
+            if not level or len(level) >= target_parts:
+                break
+    
+    parts.extend((leaf_prefix, None) for leaf_prefix in level)
+    return sorted(parts, key=lambda part: part[0])
+
+def iter_listing_parts(s3_client, bucket_name, prefix, predicate=None, completed=(), max_workers=DEFAULT_MAX_WORKERS, max_depth=LISTING_DISCOVERY_DEPTH):
+    """
+    并行列出前缀下的对象，按部分逐个返回结果
+    
+    先用 discover_listing_parts 拆分前缀，再并发逐页列出各个子前缀。结果按部分名称顺序输出，
+    同时进行中的部分不超过 max_workers 的两倍，每输出一个部分即为一个检查点，
+    调用方记录已完成的部分后，中断时可以通过 completed 跳过这些部分继续列出
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param prefix: 对象键前缀
+    :param predicate: 可选，只返回 predicate(key) 为真的对象
+    :param completed: 已完成的部分名称，这些部分不再列出
+    :param max_workers: 并发列出的最大线程数
+    :param max_depth: 发现子前缀时最多展开的层数
+    :return: 生成 (部分名称, 对象列表)
+    """
+    completed = set(completed)
+    parts = iter([
+        part for part in discover_listing_parts(s3_client, bucket_name, prefix, max_depth, max_workers=max_workers)
+        if part[0] not in completed
+    ])
+    pending = deque()
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(pending) < max_workers * 2:
+                part = next(parts, None)
+                if part is None:
+                    break
+                part_name, objects = part
+                if objects is None:
+                    pending.append((part_name, executor.submit(_list_all, s3_client, bucket_name, part_name, predicate)))
+                else:
+                    pending.append((part_name, [obj for obj in objects if predicate is None or predicate(obj['Key'])]))
+            
+            if not pending:
+                break
+            
+            part_name, result = pending.popleft()
+            yield part_name, result if isinstance(result, list) else result.result()
+
+def iter_objects_parallel(s3_client, bucket_name, prefix, predicate=None, max_workers=DEFAULT_MAX_WORKERS):
+    """并行列出前缀下的对象，以流的形式逐个返回对象信息"""
+    for _, objects in iter_listing_parts(s3_client, bucket_name, prefix, predicate, max_workers=max_workers):
+        yield from objects
+
+def parse_s3_path(s3_bucket_path):
+    """
+    解析 S3 路径
+    
+    :param s3_bucket_path: S3 存储桶路径，格式为 's3://{bucket_name}/{bucket_prefix}'
+    :return: (bucket_name, bucket_prefix)
+    """
+    if not s3_bucket_path.startswith('s3://'):
+        raise ValueError("S3 存储桶路径格式无效，应以 's3://' 开头")
+    
+    parts = s3_bucket_path.replace('s3://', '').split('/', 1)
+    bucket_name = parts[0]
+    bucket_prefix = parts[1] if len(parts) > 1 else ''
+    return bucket_name, bucket_prefix
+
+def is_throttling_error(error):
+    """判断异常是否为 S3 限流或临时性错误"""
+    if isinstance(error, ClientError):
+        error_info = error.response.get('Error', {})
+        status_code = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return error_info.get('Code') in S3_THROTTLING_ERROR_CODES or status_code in (500, 503)
+    return False
+
+def call_with_s3_retry(func, max_retries=S3_MAX_RETRIES, base_delay=S3_RETRY_BASE_DELAY):
+    """
+    调用 func()，遇到限流时按指数退避重试
+    
+    :param func: 发起 S3 请求的无参函数
+    :param max_retries: 最大重试次数
+    :param base_delay: 首次重试前的等待秒数，之后每次翻倍并加入随机抖动
+    :return: func() 的返回值
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= max_retries or not is_throttling_error(e):
+                raise
+            delay = base_delay * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay))
+            attempt += 1
+
+def read_s3_object_with_retry(s3_client, bucket_name, key, byte_range=None, max_retries=S3_MAX_RETRIES, base_delay=S3_RETRY_BASE_DELAY):
+    """
+    读取 S3 对象内容，遇到限流时按指数退避重试
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param key: 对象键
+    :param byte_range: 可选，(起始字节, 结束字节) 闭区间，仅读取该范围
+    :param max_retries: 最大重试次数
+    :param base_delay: 首次重试前的等待秒数，之后每次翻倍并加入随机抖动
+    :return: 对象内容 (bytes)
+    """
+    params = {'Bucket': bucket_name, 'Key': key}
+    if byte_range:
+        params['Range'] = f"bytes={byte_range[0]}-{byte_range[1]}"
+    return call_with_s3_retry(lambda: s3_client.get_object(**params)['Body'].read(), max_retries, base_delay)
+
+def open_s3_object_stream(s3_client, bucket_name, key, max_retries=S3_MAX_RETRIES, base_delay=S3_RETRY_BASE_DELAY):
+    """
+    打开 S3 对象的数据流，只对 GetObject 请求本身按限流重试
+    
+    :return: 响应的 Body（StreamingBody），使用后需要关闭
+    """
+    return call_with_s3_retry(lambda: s3_client.get_object(Bucket=bucket_name, Key=key)['Body'], max_retries, base_delay)
+
+class S3RangeReader(io.RawIOBase):
+    """
+    基于 S3 范围请求的只读文件对象
+    
+    供 pyarrow 读取 Parquet 文件尾部元数据和所需的列块，不下载整个对象
+    """
+    
+    def __init__(self, s3_client, bucket_name, key, size=None, block_size=S3_RANGE_READ_BLOCK_SIZE):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        if size is None:
+            size = s3_client.head_object(Bucket=bucket_name, Key=key)['ContentLength']
+        self.size = size
+        self.block_size = block_size
+        self.position = 0
+        self.bytes_read = 0
+        self._block_start = 0
+        self._block = b''
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f"无效的 whence: {whence}")
+        return self.position
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size, self.size)
+        if self.position >= end:
+            return b''
+        
+        # 请求的范围不在缓存块内时重新读取，至少读取 block_size 字节以合并小请求
+        block_end = self._block_start + len(self._block)
+        if self.position < self._block_start or end > block_end:
+            fetch_end = min(max(end, self.position + self.block_size), self.size)
+            self._block = read_s3_object_with_retry(
+                self.s3_client, self.bucket_name, self.key,
+                byte_range=(self.position, fetch_end - 1)
+            )
+            self._block_start = self.position
+            self.bytes_read += len(self._block)
+        
+        offset = self.position - self._block_start
+        data = self._block[offset:offset + (end - self.position)]
+        self.position += len(data)
+        return data
+    
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+# 联系记录和录音记录结果的列
+CONTACT_COLUMNS = ['ContactId', '热线号码', '客户号码', '文件路径']
+RECORDING_COLUMNS = ['ContactId', '录音S3地址', '热线号码']
+
+# 录音元数据列：列名 -> (元数据字段, 类型)
+RECORDING_DURATION_COLUMN = '时长(秒)'
+RECORDING_METADATA_COLUMNS = {
+    RECORDING_DURATION_COLUMN: ('duration', 'Float64'),
+    '采样率': ('sample_rate', 'Int32'),
+    '声道数': ('channels', 'Int16'),
+}
+
+# 结果列的紧凑存储类型：ContactId 等长字符串使用 Arrow 连续缓冲区，取值较少的列使用分类类型
+RESULT_COLUMN_DTYPES = {
+    'ContactId': 'string[pyarrow]',
+    '热线号码': 'category',
+    '热线号码_recording': 'category',
+    '客户号码': 'string[pyarrow]',
+    '文件路径': 'category',
+    '录音S3地址': 'string[pyarrow]',
+    '区域': 'category',
+    '实例ID': 'category',
+}
+
+def compact_result_frame(df):
+    """将结果列转换为紧凑的存储类型，避免每个值都是一个 Python 对象"""
+    dtypes = {column: dtype for column, dtype in RESULT_COLUMN_DTYPES.items() if column in df.columns}
+    return df.astype(dtypes)
+
+# 从 JSON 字符串中直接提取 address 字段的正则
+ENDPOINT_ADDRESS_PATTERN = r'"address"\s*:\s*"([^"\\]*)"'
+# 同一正则的 Arrow (RE2) 写法，pc.extract_regex 要求使用命名分组
+ENDPOINT_ADDRESS_ARROW_PATTERN = r'"address"\s*:\s*"(?P<address>[^"\\]*)"'
+
+def _json_endpoint_address(value):
+    """逐个解析 JSON 字符串中的 address，仅用于正则无法处理的少量值"""
+    try:
+        return json.loads(value).get('address', '')
+    except:
+        return ''
+
+def extract_endpoint_address(series):
+    """
+    批量提取 endpoint 列中的 address 字段
+    
+    Parquet 文件中的 endpoint 为结构体（读取后为 dict），CSV 文件中为 JSON 字符串，两种情况均按列处理
+    
+    :param series: systemendpoint 或 customerendpoint 列
+    :return: address 列，缺失或无法解析时为空字符串
+    """
+    addresses = pd.Series('', index=series.index, dtype=object)
+    if series.empty:
+        return addresses
+    
+    if series.dtype == object:
+        value_types = series.map(type)
+        is_dict = value_types == dict
+        is_str = value_types == str
+    else:
+        is_dict = pd.Series(False, index=series.index)
+        is_str = series.notna()
+    
+    # 结构体列：直接按键取值
+    if is_dict.any():
+        addresses[is_dict] = series[is_dict].str.get('address')
+    
+    # JSON 字符串列：先用正则批量提取，含转义字符或格式不规范的值再回退到 json 解析
+    if is_str.any():
+        strings = series[is_str].astype(str)
+        extracted = strings.str.extract(ENDPOINT_ADDRESS_PATTERN, expand=False)
+        fallback = extracted.isna() & strings.str.contains('"address"', regex=False)
+        if fallback.any():
+            extracted[fallback] = strings[fallback].map(_json_endpoint_address)
+        addresses[is_str] = extracted
+    
+    return addresses.fillna('')
+
+def extract_contacts_frame(df, key):
+    """
+    从 CTR 数据中按列提取联系 ID 和电话号码
+    
+    :param df: CTR 文件解析得到的 DataFrame
+    :param key: 文件的对象键
+    :return: 包含 ContactId、热线号码、客户号码、文件路径 列的 DataFrame
+    """
+    if 'contactid' not in df.columns:
+        return pd.DataFrame(columns=CONTACT_COLUMNS)
+    
+    empty = pd.Series('', index=df.index, dtype=object)
+    return pd.DataFrame({
+        'ContactId': df['contactid'],
+        '热线号码': extract_endpoint_address(df['systemendpoint']) if 'systemendpoint' in df.columns else empty,
+        '客户号码': extract_endpoint_address(df['customerendpoint']) if 'customerendpoint' in df.columns else empty,
+        '文件路径': key
+    }, columns=CONTACT_COLUMNS)
+
+def _endpoint_column(schema, name):
+    """
+    返回需要读取的 endpoint 列路径
+    
+    结构体列只读取 address 子列，字符串列读取整列，不存在时返回 None
+    """
+    if name not in schema.names:
+        return None
+    field_type = schema.field(name).type
+    if pa.types.is_struct(field_type) and field_type.get_field_index('address') >= 0:
+        return f"{name}.address"
+    return name
+
+def _row_group_may_match(row_group, column_path, phone_numbers):
+    """根据列块的 min/max 统计信息判断行组中是否可能包含所选热线号码"""
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        if column.path_in_schema != column_path:
+            continue
+        statistics = column.statistics
+        if statistics is None or not statistics.has_min_max:
+            return True
+        return any(statistics.min <= phone <= statistics.max for phone in phone_numbers)
+    return True
+
+def _endpoint_addresses_from_table(table, name, column_path):
+    """从 Arrow 表中取出 endpoint 的 address 列"""
+    if column_path is None:
+        return pd.Series('', index=range(table.num_rows), dtype=object)
+    column = table.column(name)
+    if column_path.endswith('.address'):
+        return pc.struct_field(column, 'address').to_pandas().astype(object).fillna('')
+    return extract_endpoint_address(column.to_pandas())
+
+def read_parquet_contacts(source, key, phone_numbers=None):
+    """
+    读取 Parquet 格式的 CTR 文件，只解码 contactid 和两个 endpoint 的 address 列
+    
+    指定热线号码时，先按行组统计信息跳过不可能匹配的行组，再按行筛选
+    
+    :param source: Parquet 文件对象，可以是 S3RangeReader 或 BytesIO
+    :param key: 文件的对象键
+    :param phone_numbers: 可选，只保留这些热线号码的联系记录
+    :return: 联系记录 DataFrame
+    """
+    parquet_file = pq.ParquetFile(source)
+    schema = parquet_file.schema_arrow
+    if 'contactid' not in schema.names:
+        return pd.DataFrame(columns=CONTACT_COLUMNS)
+    
+    system_path = _endpoint_column(schema, 'systemendpoint')
+    customer_path = _endpoint_column(schema, 'customerendpoint')
+    columns = ['contactid'] + [path for path in (system_path, customer_path) if path]
+    
+    frames = []
+    for index in range(parquet_file.num_row_groups):
+        if phone_numbers and system_path and system_path.endswith('.address'):
+            if not _row_group_may_match(parquet_file.metadata.row_group(index), system_path, phone_numbers):
+                continue
+        
+        table = parquet_file.read_row_group(index, columns=columns)
+        df = pd.DataFrame({
+            'ContactId': table.column('contactid').to_pandas(),
+            '热线号码': _endpoint_addresses_from_table(table, 'systemendpoint', system_path),
+            '客户号码': _endpoint_addresses_from_table(table, 'customerendpoint', customer_path),
+            '文件路径': key
+        }, columns=CONTACT_COLUMNS)
+        
+        if phone_numbers:
+            df = df[df['热线号码'].isin(phone_numbers)]
+        frames.append(df)
+    
+    if not frames:
+        return pd.DataFrame(columns=CONTACT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def _csv_endpoint_addresses(batch, name):
+    """
+    在 Arrow 中批量提取 CSV 数据块里 endpoint JSON 字符串的 address
+    
+    与 extract_endpoint_address 的结果一致：正则无法匹配但包含 address 的少量值回退到 json 解析，
+    缺失或无法解析时为空字符串
+    """
+    if name not in batch.schema.names:
+        return pa.array([''] * batch.num_rows, pa.string())
+    
+    column = batch.column(name)
+    addresses = pc.struct_field(pc.extract_regex(column, ENDPOINT_ADDRESS_ARROW_PATTERN), 'address')
+    fallback = pc.fill_null(pc.and_(pc.is_null(addresses), pc.match_substring(column, '"address"')), False)
+    if pc.any(fallback).as_py():
+        values = addresses.to_pylist()
+        for i in np.flatnonzero(fallback.to_numpy(zero_copy_only=False)):
+            address = _json_endpoint_address(column[i].as_py())
+            values[i] = None if address is None else str(address)
+        addresses = pa.array(values, pa.string())
+    return pc.fill_null(addresses, '')
+
+def read_csv_contacts(stream, key, phone_numbers=None, block_size=CSV_READ_BLOCK_SIZE):
+    """
+    流式读取 CSV 格式的 CTR 文件，只转换 contactid 和两个 endpoint 列
+    
+    使用 pyarrow 按块解析，每块在 Arrow 中提取号码并筛选热线，只把保留的行转换为 DataFrame，
+    内存占用与文件大小无关。
+    gzip 压缩的文件按文件头自动识别并边读边解压
+    
+    :param stream: 可读的文件对象，例如 S3 响应的 Body
+    :param key: 文件的对象键
+    :param phone_numbers: 可选，只保留这些热线号码的联系记录
+    :param block_size: 每块解析的字节数
+    :return: 联系记录 DataFrame
+    """
+    source = io.BufferedReader(stream, block_size)
+    if source.peek(len(GZIP_MAGIC)).startswith(GZIP_MAGIC):
+        source = io.BufferedReader(gzip.GzipFile(fileobj=source), block_size)
+    
+    # 先从缓冲区读出表头，只让 pyarrow 转换文件中实际存在的所需列
+    header = source.peek(block_size).split(b'\n', 1)[0].decode('utf-8-sig').rstrip('\r')
+    columns = [column for column in CSV_CONTACT_COLUMNS if column in next(csv.reader([header]), [])]
+    if 'contactid' not in columns:
+        return pd.DataFrame(columns=CONTACT_COLUMNS)
+    
+    reader = pa_csv.open_csv(
+        pa.PythonFile(source, mode='r'),
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={column: pa.string() for column in columns},
+            strings_can_be_null=True
+        )
+    )
+    
+    frames = []
+    for batch in reader:
+        hotlines = _csv_endpoint_addresses(batch, 'systemendpoint')
+        if phone_numbers:
+            matched = pc.is_in(hotlines, value_set=pa.array(phone_numbers, pa.string()))
+            batch = batch.filter(matched)
+            hotlines = hotlines.filter(matched)
+        if batch.num_rows == 0:
+            continue
+        
+        frames.append(pd.DataFrame({
+            'ContactId': batch.column('contactid').to_pandas(),
+            '热线号码': hotlines.to_pandas().astype(object),
+            '客户号码': _csv_endpoint_addresses(batch, 'customerendpoint').to_pandas().astype(object),
+            '文件路径': key
+        }, columns=CONTACT_COLUMNS))
+    
+    if not frames:
+        return pd.DataFrame(columns=CONTACT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def parse_contact_file(s3_client, bucket_name, key, size=None, phone_numbers=None, ranged_reads=True):
+    """
+    下载并解析单个联系记录文件
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param key: CSV（可以是 gzip 压缩的 .csv.gz）或 Parquet 文件的对象键
+    :param size: 可选，对象大小（来自列表结果），避免额外的 HEAD 请求
+    :param phone_numbers: 可选，只保留这些热线号码的联系记录
+    :param ranged_reads: Parquet 文件是否按范围只读取尾部元数据和所需列块
+    :return: 该文件中联系记录的 DataFrame
+    """
+    if key.endswith('.parquet'):
+        if ranged_reads:
+            source = S3RangeReader(s3_client, bucket_name, key, size)
+        else:
+            source = BytesIO(read_s3_object_with_retry(s3_client, bucket_name, key))
+        return read_parquet_contacts(source, key, phone_numbers)
+    
+    body = open_s3_object_stream(s3_client, bucket_name, key)
+    try:
+        return read_csv_contacts(body, key, phone_numbers)
+    finally:
+        body.close()
+
+@contextmanager
+def open_sqlite(path):
+    """打开 SQLite 数据库，退出时提交事务并关闭连接"""
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+class ContactFileCache:
+    """
+    已解析 CTR 文件的本地缓存
+    
+    每个 S3 对象提取出的联系记录保存为一个 Parquet 文件，清单保存在 SQLite 中，
+    读取时用列表结果中的 ETag 和 LastModified 校验，总大小超过上限时按最近访问时间淘汰
+    """
+    
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_CONTACT_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'contacts')
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "cache_key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+                "file_name TEXT, size_bytes INTEGER, last_access REAL)"
+            )
+    
+    def _connect(self):
+        return open_sqlite(os.path.join(self.cache_dir, 'manifest.sqlite'))
+    
+    @staticmethod
+    def _cache_key(bucket_name, key):
+        return f"{bucket_name}/{key}"
+    
+    @staticmethod
+    def _version(obj):
+        last_modified = obj.get('LastModified')
+        return obj.get('ETag', ''), last_modified.isoformat() if last_modified else ''
+    
+    def get(self, bucket_name, obj):
+        """
+        读取缓存
+        
+        :param bucket_name: 存储桶名称
+        :param obj: 列表结果中的对象信息
+        :return: 联系记录 DataFrame，未命中或已过期时返回 None
+        """
+        cache_key = self._cache_key(bucket_name, obj['Key'])
+        etag, last_modified = self._version(obj)
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT file_name FROM entries WHERE cache_key = ? AND etag = ? AND last_modified = ?",
+                (cache_key, etag, last_modified)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+        
+        try:
+            return pd.read_parquet(os.path.join(self.cache_dir, row[0]))
+        except Exception:
+            return None
+    
+    def put(self, bucket_name, obj, df):
+        """
+        写入缓存，并在超出容量时淘汰最久未访问的条目
+        
+        :param bucket_name: 存储桶名称
+        :param obj: 列表结果中的对象信息
+        :param df: 该文件提取出的全部联系记录
+        """
+        cache_key = self._cache_key(bucket_name, obj['Key'])
+        etag, last_modified = self._version(obj)
+        file_name = hashlib.sha1(cache_key.encode('utf-8')).hexdigest() + '.parquet'
+        file_path = os.path.join(self.cache_dir, file_name)
+        
+        # 先写临时文件再重命名，避免并发读取到不完整的文件
+        temp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        df.to_parquet(temp_path, index=False)
+        os.replace(temp_path, file_path)
+        
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, etag, last_modified, file_name, os.path.getsize(file_path), time.time())
+            )
+            self._evict(conn)
+    
+    def _evict(self, conn):
+        """按最近访问时间淘汰条目，直到总大小不超过上限"""
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for cache_key, file_name, size_bytes in conn.execute(
+            "SELECT cache_key, file_name, size_bytes FROM entries ORDER BY last_access"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE cache_key = ?", (cache_key,))
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                pass
+            total -= size_bytes
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock, self._connect() as conn:
+            for (file_name,) in conn.execute("SELECT file_name FROM entries").fetchall():
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    pass
+            conn.execute("DELETE FROM entries")
+
+class RecordingIndex:
+    """
+    录音文件的本地索引 (ContactId -> S3 地址、大小、LastModified)
+    
+    同步时从上次看到的最后一个键所在的目录开始列出 (StartAfter)，因此只会重新列出最近的日期分区。
+    Connect 的录音按 年/月/日 目录存放，新录音的键总是排在已同步的日期目录之后或之中
+    """
+    
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS recordings ("
+                "bucket TEXT, key TEXT, contact_id TEXT, size INTEGER, last_modified TEXT, etag TEXT, "
+                "PRIMARY KEY (bucket, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS recordings_contact_id ON recordings (contact_id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                "bucket TEXT, prefix TEXT, last_key TEXT, synced_at REAL, PRIMARY KEY (bucket, prefix))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS listing_checkpoints ("
+                "bucket TEXT, prefix TEXT, part TEXT, PRIMARY KEY (bucket, prefix, part))"
+            )
+            # 完整同步时记录本次列出的键，结束后删除前缀下未列出的录音（已过期或被删除的对象）
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS listing_seen ("
+                "bucket TEXT, prefix TEXT, key TEXT, PRIMARY KEY (bucket, prefix, key)) WITHOUT ROWID"
+            )
+    
+    def _connect(self):
+        return open_sqlite(os.path.join(self.cache_dir, 'recordings.sqlite'))
+    
+    def sync(self, s3_client, bucket_name, prefix, full=False, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        增量同步前缀下的录音文件
+        
+        首次同步时按日期目录并行列出，每完成一个目录记录检查点；之后从上次同步的最后一个目录继续列出。
+        完整同步重新列出整个前缀，更新大小和 ETag 有变化的录音，并删除前缀下已不存在的录音
+        
+        :param s3_client: S3 客户端
+        :param bucket_name: 存储桶名称
+        :param prefix: 录音文件前缀
+        :param full: 是否忽略同步进度，重新列出整个前缀
+        :param max_workers: 首次同步时并发列出的最大线程数
+        :return: 本次新增或更新的录音数量
+        """
+        with self._lock:
+            with self._connect() as conn:
+                if full:
+                    conn.execute("DELETE FROM listing_checkpoints WHERE bucket = ? AND prefix = ?", (bucket_name, prefix))
+                    conn.execute("DELETE FROM listing_seen WHERE bucket = ? AND prefix = ?", (bucket_name, prefix))
+                row = conn.execute(
+                    "SELECT last_key FROM sync_state WHERE bucket = ? AND prefix = ?", (bucket_name, prefix)
+                ).fetchone()
+            last_key = row[0] if row and not full else None
+            
+            if last_key is None:
+                return self._sync_parallel(s3_client, bucket_name, prefix, max_workers, sweep=full)
+            
+            # 从最后一个键所在的目录重新开始，覆盖同一天内排在其前面的新录音
+            start_after = last_key.rsplit('/', 1)[0] + '/' if last_key and '/' in last_key else None
+            if start_after is not None and not start_after.startswith(prefix):
+                start_after = None
+            
+            added = 0
+            batch = []
+            for obj in iter_recording_objects(s3_client, bucket_name, prefix, start_after):
+                batch.append(obj)
+                if len(batch) >= 1000:
+                    added += self._store(bucket_name, prefix, batch)
+                    batch = []
+            if batch:
+                added += self._store(bucket_name, prefix, batch)
+            return added
+    
+    def _sync_parallel(self, s3_client, bucket_name, prefix, max_workers, sweep=False):
+        """
+        并行列出整个前缀并写入索引
+        
+        每个部分写入时同时记录检查点，中断后再次同步会跳过已完成的部分；
+        全部完成后才记录同步进度并清除检查点，避免增量同步跳过未列出的目录。
+        指定 sweep 时同时记录列出的键，全部完成后删除前缀下本次没有列出的录音
+        """
+        with self._connect() as conn:
+            completed = [part for (part,) in conn.execute(
+                "SELECT part FROM listing_checkpoints WHERE bucket = ? AND prefix = ?", (bucket_name, prefix)
+            )]
+        
+        added = 0
+        for part, objects in iter_listing_parts(s3_client, bucket_name, prefix, is_recording_file, completed, max_workers):
+            added += self._store(bucket_name, prefix, objects, checkpoint=part, record_seen=sweep)
+        
+        with self._connect() as conn:
+            if sweep:
+                conn.execute(
+                    "DELETE FROM recordings WHERE bucket = ? AND key >= ? AND key < ? AND NOT EXISTS ("
+                    "SELECT 1 FROM listing_seen WHERE listing_seen.bucket = recordings.bucket "
+                    "AND listing_seen.prefix = ? AND listing_seen.key = recordings.key)",
+                    (bucket_name, prefix, prefix + '\U0010ffff', prefix)
+                )
+                conn.execute("DELETE FROM listing_seen WHERE bucket = ? AND prefix = ?", (bucket_name, prefix))
+            (last_key,) = conn.execute(
+                "SELECT MAX(key) FROM recordings WHERE bucket = ? AND key >= ? AND key < ?",
+                (bucket_name, prefix, prefix + '\U0010ffff')
+            ).fetchone()
+            if last_key is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)", (bucket_name, prefix, last_key, time.time())
+                )
+            else:
+                conn.execute("DELETE FROM sync_state WHERE bucket = ? AND prefix = ?", (bucket_name, prefix))
+            conn.execute("DELETE FROM listing_checkpoints WHERE bucket = ? AND prefix = ?", (bucket_name, prefix))
+        return added
+    
+    def _store(self, bucket_name, prefix, objects, checkpoint=None, record_seen=False):
+        """
+        写入一页列表结果并记录同步进度，中断后可从该页之后继续
+        
+        已有的录音在大小或 ETag 变化时更新（同一个键的对象被覆盖）；
+        指定 checkpoint 时改为在同一事务中记录该部分已完成，不更新同步进度；
+        指定 record_seen 时同时记录列出的键，用于完整同步结束后删除已不存在的录音
+        """
+        rows = [
+            (
+                bucket_name,
+                obj['Key'],
+                contact_id_from_recording_key(obj['Key']),
+                obj.get('Size'),
+                obj['LastModified'].isoformat() if obj.get('LastModified') else '',
+                obj.get('ETag', '')
+            )
+            for obj in objects
+        ]
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT INTO recordings VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (bucket, key) DO UPDATE SET "
+                "size = excluded.size, last_modified = excluded.last_modified, etag = excluded.etag "
+                "WHERE size IS NOT excluded.size OR etag IS NOT excluded.etag",
+                rows
+            )
+            added = conn.total_changes - before
+            if record_seen:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO listing_seen VALUES (?, ?, ?)",
+                    [(bucket_name, prefix, obj['Key']) for obj in objects]
+                )
+            if checkpoint is not None:
+                conn.execute("INSERT OR IGNORE INTO listing_checkpoints VALUES (?, ?, ?)", (bucket_name, prefix, checkpoint))
+                return added
+            last_key = max(obj['Key'] for obj in objects)
+            conn.execute(
+                "INSERT INTO sync_state VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (bucket, prefix) DO UPDATE SET "
+                "last_key = MAX(COALESCE(last_key, ''), excluded.last_key), synced_at = excluded.synced_at",
+                (bucket_name, prefix, last_key, time.time())
+            )
+        return added
+    
+    def iter_keys(self, bucket_name, prefix):
+        """按键顺序返回索引中前缀下的录音对象键"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "SELECT key FROM recordings WHERE bucket = ? AND key >= ? AND key < ? ORDER BY key",
+                (bucket_name, prefix, prefix + '\U0010ffff')
+            )
+            for (key,) in cursor:
+                yield key
+    
+    def lookup(self, contact_ids, bucket_name=None, prefix=''):
+        """
+        按 ContactId 查找录音
+        
+        :param contact_ids: ContactId 列表
+        :param bucket_name: 可选，只返回该存储桶中的录音
+        :param prefix: 指定 bucket_name 时只返回该前缀下的录音
+        :return: 包含 ContactId、录音S3地址、大小、LastModified、ETag 列的 DataFrame
+        """
+        contact_ids = list(contact_ids)
+        location = ''
+        location_params = []
+        if bucket_name is not None:
+            location = " AND bucket = ? AND key >= ? AND key < ?"
+            location_params = [bucket_name, prefix, prefix + '\U0010ffff']
+        rows = []
+        with self._connect() as conn:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for start in range(0, len(contact_ids), 500):
+                chunk = contact_ids[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                rows.extend(conn.execute(
+                    f"SELECT contact_id, 's3://' || bucket || '/' || key, size, last_modified, etag "
+                    f"FROM recordings WHERE contact_id IN ({placeholders}){location}",
+                    chunk + location_params
+                ).fetchall())
+        return pd.DataFrame(rows, columns=['ContactId', '录音S3地址', '大小', 'LastModified', 'ETag'])
+
+class ContactLookupIndex:
+    """
+    联系记录的本地查找索引
+    
+    按 ContactId、客户号码、热线号码建立 SQLite 索引，支持精确和前缀查找。
+    同步时只读取新增或 ETag 变化的 CTR 文件，单个客户的查询不需要扫描存储桶
+    """
+    
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS contacts ("
+                "contact_id TEXT PRIMARY KEY, hotline TEXT, customer TEXT, bucket TEXT, file_key TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS contacts_customer ON contacts (customer)")
+            conn.execute("CREATE INDEX IF NOT EXISTS contacts_hotline ON contacts (hotline, customer)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "bucket TEXT, key TEXT, etag TEXT, indexed_at REAL, PRIMARY KEY (bucket, key))"
+            )
+    
+    def _connect(self):
+        return open_sqlite(os.path.join(self.cache_dir, 'contacts_index.sqlite'))
+    
+    def sync(self, s3_client, ctr_path, date_range=None, max_workers=DEFAULT_MAX_WORKERS, cache=None, progress_callback=None):
+        """
+        增量同步 CTR 文件到索引
+        
+        :param s3_client: S3 客户端
+        :param ctr_path: CTR 数据的 S3 路径
+        :param date_range: 可选，(开始时间, 结束时间)，只同步范围内的分区
+        :param max_workers: 并发读取文件的最大线程数
+        :param cache: 可选，ContactFileCache 实例
+        :param progress_callback: 可选，每处理完一个新文件调用 progress_callback(已处理文件数, 已写入记录数)
+        :return: dict，包含 files（新同步的文件数）、rows（写入的记录数）、failed（失败的文件数）
+        """
+        bucket_name, files = list_contact_files_for_path(s3_client, ctr_path, date_range, max_workers)
+        
+        with self._connect() as conn:
+            indexed = dict(conn.execute("SELECT key, etag FROM files WHERE bucket = ?", (bucket_name,)).fetchall())
+        new_files = (obj for obj in files if indexed.get(obj['Key']) != obj.get('ETag', ''))
+        
+        stats = {'files': 0, 'rows': 0, 'failed': 0}
+        for obj, df, error in iter_loaded_contact_files(s3_client, bucket_name, new_files, max_workers=max_workers, cache=cache):
+            if error is not None:
+                stats['failed'] += 1
+                continue
+            
+            rows = list(zip(
+                df['ContactId'].astype(object),
+                df['热线号码'].astype(object),
+                df['客户号码'].astype(object),
+                [bucket_name] * len(df),
+                [obj['Key']] * len(df)
+            ))
+            # 文件内容和同步记录在同一事务中写入，中断后未完成的文件会在下次同步时重新读取
+            with self._lock, self._connect() as conn:
+                conn.executemany("INSERT OR REPLACE INTO contacts VALUES (?, ?, ?, ?, ?)", rows)
+                conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (bucket_name, obj['Key'], obj.get('ETag', ''), time.time())
+                )
+            
+            stats['files'] += 1
+            stats['rows'] += len(rows)
+            if progress_callback:
+                progress_callback(stats['files'], stats['rows'])
+        
+        return stats
+    
+    def search(self, customer=None, contact_id=None, hotlines=None, prefix=True, limit=1000):
+        """
+        按客户号码、ContactId 和热线号码查找联系记录
+        
+        :param customer: 可选，客户号码
+        :param contact_id: 可选，ContactId
+        :param hotlines: 可选，热线号码列表
+        :param prefix: 客户号码和 ContactId 是否按前缀匹配，False 时精确匹配
+        :param limit: 最多返回的记录数
+        :return: 联系记录 DataFrame
+        """
+        conditions = []
+        params = []
+        for column, value in (('customer', customer), ('contact_id', contact_id)):
+            if not value:
+                continue
+            if prefix:
+                # 使用范围条件代替 LIKE，以便命中索引
+                conditions.append(f"{column} >= ? AND {column} < ?")
+                params.extend([value, value + '\U0010ffff'])
+            else:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if hotlines:
+            conditions.append(f"hotline IN ({', '.join('?' * len(hotlines))})")
+            params.extend(hotlines)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT contact_id, hotline, customer, file_key FROM contacts {where} LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return compact_result_frame(pd.DataFrame(rows, columns=CONTACT_COLUMNS))
+
+def contact_file_day(obj):
+    """
+    返回 CTR 文件所属的日期 (YYYY-MM-DD)
+    
+    优先使用 Hive 分区路径中的 year/month/day，没有分区目录时使用对象的 LastModified (UTC)
+    """
+    match = CONTACT_FILE_DAY_PATTERN.search(obj['Key'])
+    if match:
+        return '-'.join(match.groups())
+    last_modified = obj.get('LastModified')
+    return last_modified.astimezone(timezone.utc).date().isoformat() if last_modified else ''
+
+# 每日汇总结果的列
+ROLLUP_COLUMNS = ['热线号码', '日期', '通话数', '有录音数', '客户数']
+
+class DailyRollupStore:
+    """
+    按热线号码和日期预先汇总的通话统计（通话数、有录音数、不同客户数）
+    
+    同步时只读取新增或 ETag 变化的 CTR 文件，每个文件的汇总和 daily_rollups 的增量在同一事务中写入，
+    汇总视图直接读取 daily_rollups，不需要扫描 CTR 文件。
+    不同客户数通过按文件记录的 (热线号码, 日期, 客户号码) 表计算，文件被改写时先删除该文件原来的客户；
+    有录音数按 RecordingIndex 中的 ContactId 判断，入库时还没有录音的近期联系记录会在之后的同步中补充
+    """
+    
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            # 旧版本的客户表没有记录来源文件，文件改写时无法删除原来的客户；删除所有汇总表，下次同步时重建
+            customer_columns = [row[1] for row in conn.execute("PRAGMA table_info(rollup_customers)")]
+            if customer_columns and 'key' not in customer_columns:
+                for table in ('daily_rollups', 'rollup_customers', 'file_rollups', 'pending_recordings', 'files'):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS daily_rollups ("
+                "hotline TEXT, day TEXT, contacts INTEGER, recorded INTEGER, customers INTEGER, "
+                "PRIMARY KEY (hotline, day)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS daily_rollups_day ON daily_rollups (day)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rollup_customers ("
+                "hotline TEXT, day TEXT, customer TEXT, bucket TEXT, key TEXT, "
+                "PRIMARY KEY (hotline, day, customer, bucket, key)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS rollup_customers_file ON rollup_customers (bucket, key)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_rollups ("
+                "bucket TEXT, key TEXT, hotline TEXT, day TEXT, contacts INTEGER, recorded INTEGER, "
+                "PRIMARY KEY (bucket, key, hotline, day)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_recordings ("
+                "bucket TEXT, key TEXT, contact_id TEXT, hotline TEXT, day TEXT, "
+                "PRIMARY KEY (bucket, key, contact_id)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "bucket TEXT, key TEXT, etag TEXT, synced_at REAL, PRIMARY KEY (bucket, key))"
+            )
+    
+    def _connect(self):
+        return open_sqlite(os.path.join(self.cache_dir, 'rollups.sqlite'))
+    
+    def sync(self, s3_client, ctr_path, recording_index=None, date_range=None, full=False, max_workers=DEFAULT_MAX_WORKERS, cache=None, progress_callback=None):
+        """
+        增量同步 CTR 文件到每日汇总
+        
+        有录音数来自 recording_index，调用前应先同步录音索引
+        
+        :param s3_client: S3 客户端
+        :param ctr_path: CTR 数据的 S3 路径
+        :param recording_index: 可选，RecordingIndex 实例，不指定时有录音数为 0
+        :param date_range: 可选，(开始时间, 结束时间)，只同步范围内的分区
+        :param full: 是否清空汇总后重新读取全部文件；指定 date_range 时只清空并重建范围内的日期（扩展到整天）
+        :param max_workers: 并发读取文件的最大线程数
+        :param cache: 可选，ContactFileCache 实例
+        :param progress_callback: 可选，每处理完一个新文件调用 progress_callback(已处理文件数, 已汇总记录数)
+        :return: dict，包含 files（新同步的文件数）、rows（汇总的记录数）、failed（失败的文件数）、
+                 recorded（之前没有录音、本次补充为有录音的记录数）
+        """
+        if full:
+            if date_range:
+                # 汇总按天清空，读取范围也扩展到整天，清空的日期都会重新读取
+                first_day, last_day = self._day_bounds(date_range)
+                date_range = (
+                    datetime.combine(date.fromisoformat(first_day), datetime.min.time(), date_range[0].tzinfo),
+                    datetime.combine(date.fromisoformat(last_day) + timedelta(days=1), datetime.min.time(), date_range[1].tzinfo)
+                )
+            self.clear(date_range)
+        bucket_name, files = list_contact_files_for_path(s3_client, ctr_path, date_range, max_workers)
+        
+        with self._connect() as conn:
+            synced = dict(conn.execute("SELECT key, etag FROM files WHERE bucket = ?", (bucket_name,)).fetchall())
+        new_files = (obj for obj in files if synced.get(obj['Key']) != obj.get('ETag', ''))
+        
+        stats = {'files': 0, 'rows': 0, 'failed': 0, 'recorded': 0}
+        if recording_index is not None:
+            stats['recorded'] = self.refresh_recorded(recording_index)
+        
+        for obj, df, error in iter_loaded_contact_files(s3_client, bucket_name, new_files, max_workers=max_workers, cache=cache):
+            if error is not None:
+                stats['failed'] += 1
+                continue
+            
+            self._store(bucket_name, obj, df, recording_index)
+            stats['files'] += 1
+            stats['rows'] += len(df)
+            if progress_callback:
+                progress_callback(stats['files'], stats['rows'])
+        
+        return stats
+    
+    def _store(self, bucket_name, obj, df, recording_index=None):
+        """
+        写入单个文件的汇总，文件重新写入过（ETag 变化）时先减去该文件之前的汇总并删除该文件原来的客户，
+        再重新计算新旧汇总涉及的每个 (热线号码, 日期) 的不同客户数
+        """
+        key = obj['Key']
+        day = contact_file_day(obj)
+        contacts = pd.DataFrame({
+            'contact_id': df['ContactId'].astype(object),
+            'hotline': df['热线号码'].astype(object).fillna(''),
+            'customer': df['客户号码'].astype(object).fillna('')
+        })
+        
+        recorded_ids = set()
+        if recording_index is not None and not contacts.empty:
+            recorded_ids = set(recording_index.lookup(contacts['contact_id'].unique())['ContactId'])
+        contacts['recorded'] = contacts['contact_id'].isin(recorded_ids)
+        
+        totals = contacts.groupby('hotline', sort=False)['recorded'].agg(['size', 'sum'])
+        file_rows = [(bucket_name, key, hotline, day, int(size), int(recorded)) for hotline, (size, recorded) in totals.iterrows()]
+        customer_rows = contacts.loc[contacts['customer'] != '', ['hotline', 'customer']].drop_duplicates()
+        
+        # 只记录近期日期中没有录音的联系记录，等待之后的同步补充
+        pending_rows = []
+        if day >= self._pending_cutoff():
+            unrecorded = contacts.loc[~contacts['recorded'], ['contact_id', 'hotline']].drop_duplicates('contact_id')
+            pending_rows = [(bucket_name, key, contact_id, hotline, day) for contact_id, hotline in unrecorded.itertuples(index=False)]
+        
+        with self._lock, self._connect() as conn:
+            # 新旧汇总涉及的 (热线号码, 日期)，写入后重新计算这些组合的不同客户数
+            touched = {(hotline, day) for _, _, hotline, day, _, _ in file_rows}
+            for hotline, old_day, old_contacts, old_recorded in conn.execute(
+                "SELECT hotline, day, contacts, recorded FROM file_rollups WHERE bucket = ? AND key = ?", (bucket_name, key)
+            ).fetchall():
+                conn.execute(
+                    "UPDATE daily_rollups SET contacts = contacts - ?, recorded = recorded - ? WHERE hotline = ? AND day = ?",
+                    (old_contacts, old_recorded, hotline, old_day)
+                )
+                touched.add((hotline, old_day))
+            conn.execute("DELETE FROM file_rollups WHERE bucket = ? AND key = ?", (bucket_name, key))
+            conn.execute("DELETE FROM rollup_customers WHERE bucket = ? AND key = ?", (bucket_name, key))
+            conn.execute("DELETE FROM pending_recordings WHERE bucket = ? AND key = ?", (bucket_name, key))
+            
+            conn.executemany("INSERT INTO file_rollups VALUES (?, ?, ?, ?, ?, ?)", file_rows)
+            conn.executemany(
+                "INSERT INTO daily_rollups VALUES (?, ?, ?, ?, 0) ON CONFLICT (hotline, day) DO UPDATE SET "
+                "contacts = contacts + excluded.contacts, recorded = recorded + excluded.recorded",
+                [(hotline, day, contacts_count, recorded) for _, _, hotline, day, contacts_count, recorded in file_rows]
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO rollup_customers VALUES (?, ?, ?, ?, ?)",
+                [(hotline, day, customer, bucket_name, key) for hotline, customer in customer_rows.itertuples(index=False)]
+            )
+            for hotline, touched_day in touched:
+                conn.execute(
+                    "UPDATE daily_rollups SET customers = "
+                    "(SELECT COUNT(DISTINCT customer) FROM rollup_customers WHERE hotline = ? AND day = ?) "
+                    "WHERE hotline = ? AND day = ?",
+                    (hotline, touched_day, hotline, touched_day)
+                )
+            conn.executemany("INSERT INTO pending_recordings VALUES (?, ?, ?, ?, ?)", pending_rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (bucket_name, key, obj.get('ETag', ''), time.time())
+            )
+    
+    @staticmethod
+    def _day_bounds(date_range):
+        """返回时间范围覆盖的第一天和最后一天 (YYYY-MM-DD)，结束时间不包含"""
+        start, end = date_range
+        return start.date().isoformat(), (end - timedelta(microseconds=1)).date().isoformat()
+    
+    @staticmethod
+    def _pending_cutoff():
+        return (datetime.now(timezone.utc) - timedelta(days=ROLLUP_PENDING_RECORDING_DAYS)).date().isoformat()
+    
+    def refresh_recorded(self, recording_index):
+        """
+        用录音索引补充近期还没有录音的联系记录，并清除超出等待天数的记录
+        
+        :param recording_index: RecordingIndex 实例
+        :return: 本次补充为有录音的记录数
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM pending_recordings WHERE day < ?", (self._pending_cutoff(),))
+            pending = pd.DataFrame(
+                conn.execute("SELECT bucket, key, contact_id, hotline, day FROM pending_recordings").fetchall(),
+                columns=['bucket', 'key', 'contact_id', 'hotline', 'day']
+            )
+            if pending.empty:
+                return 0
+            
+            recorded_ids = set(recording_index.lookup(pending['contact_id'].unique())['ContactId'])
+            found = pending[pending['contact_id'].isin(recorded_ids)]
+            if found.empty:
+                return 0
+            
+            for (bucket_name, key, hotline, day), count in found.groupby(['bucket', 'key', 'hotline', 'day']).size().items():
+                conn.execute(
+                    "UPDATE file_rollups SET recorded = recorded + ? WHERE bucket = ? AND key = ? AND hotline = ? AND day = ?",
+                    (int(count), bucket_name, key, hotline, day)
+                )
+                conn.execute(
+                    "UPDATE daily_rollups SET recorded = recorded + ? WHERE hotline = ? AND day = ?", (int(count), hotline, day)
+                )
+            conn.executemany(
+                "DELETE FROM pending_recordings WHERE bucket = ? AND key = ? AND contact_id = ?",
+                found[['bucket', 'key', 'contact_id']].itertuples(index=False)
+            )
+            return len(found)
+    
+    def summary(self, hotlines=None, date_range=None):
+        """
+        读取每日汇总
+        
+        :param hotlines: 可选，热线号码列表
+        :param date_range: 可选，(开始时间, 结束时间)，结束时间不包含
+        :return: 包含 热线号码、日期、通话数、有录音数、客户数、录音占比 列的 DataFrame，按日期和热线号码排序
+        """
+        conditions = ['contacts > 0']
+        params = []
+        if hotlines:
+            conditions.append(f"hotline IN ({', '.join('?' * len(hotlines))})")
+            params.extend(hotlines)
+        if date_range:
+            conditions.append("day >= ? AND day <= ?")
+            params.extend(self._day_bounds(date_range))
+        
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT hotline, day, contacts, recorded, customers FROM daily_rollups "
+                f"WHERE {' AND '.join(conditions)} ORDER BY day, hotline",
+                params
+            ).fetchall()
+        summary = pd.DataFrame(rows, columns=ROLLUP_COLUMNS)
+        summary['录音占比'] = (summary['有录音数'] / summary['通话数']).astype(float)
+        return summary
+    
+    def clear(self, date_range=None):
+        """
+        清空汇总
+        
+        :param date_range: 可选，(开始时间, 结束时间)，只清空范围内日期的汇总和这些日期的文件同步记录
+        """
+        with self._lock, self._connect() as conn:
+            if date_range is None:
+                for table in ('daily_rollups', 'rollup_customers', 'file_rollups', 'pending_recordings', 'files'):
+                    conn.execute(f"DELETE FROM {table}")
+                return
+            
+            days = self._day_bounds(date_range)
+            # 先按 file_rollups 删除这些日期的文件同步记录，下次同步时重新读取
+            conn.execute(
+                "DELETE FROM files WHERE EXISTS (SELECT 1 FROM file_rollups WHERE file_rollups.bucket = files.bucket "
+                "AND file_rollups.key = files.key AND file_rollups.day >= ? AND file_rollups.day <= ?)",
+                days
+            )
+            for table in ('daily_rollups', 'rollup_customers', 'file_rollups', 'pending_recordings'):
+                conn.execute(f"DELETE FROM {table} WHERE day >= ? AND day <= ?", days)
+
+def is_contact_file(key):
+    """判断对象是否为 CSV（包括 gzip 压缩的 .csv.gz）或 Parquet 格式的联系记录文件"""
+    return key.endswith(('.csv', '.csv.gz', '.parquet'))
+
+def iter_contact_files(s3_client, bucket_name, prefix):
+    """
+    逐页列出前缀下的联系记录文件
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param prefix: 对象键前缀
+    :return: 生成列表结果中的对象信息（包含 Key、Size、ETag、LastModified）
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+    
+    for page in page_iterator:
+        for obj in page.get('Contents', []):
+            if is_contact_file(obj['Key']):
+                yield obj
+
+def list_contact_files_in_prefixes(s3_client, bucket_name, prefixes, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    并发列出多个前缀下的联系记录文件
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param prefixes: 对象键前缀列表
+    :param max_workers: 并发列出的最大线程数
+    :return: 对象信息列表，按前缀顺序排列
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = list(executor.map(lambda prefix: list(iter_contact_files(s3_client, bucket_name, prefix)), prefixes))
+    
+    return [file for listing in listings for file in listing]
+
+def strip_partition_suffix(prefix):
+    """
+    去掉前缀末尾的 Hive 分区目录，得到 CTR 数据的根前缀
+    
+    例如 'ctr-base/year=2025/month=05' 返回 'ctr-base'
+    """
+    parts = [part for part in prefix.split('/') if part]
+    while parts and parts[-1].split('=', 1)[0] in PARTITION_KEYS:
+        parts.pop()
+    return '/'.join(parts)
+
+def _partition_prefix(base_prefix, moment, depth):
+    """生成指定深度的分区前缀，depth 为 1 到 4，分别对应 year/month/day/hour"""
+    values = (f"{moment.year:04d}", f"{moment.month:02d}", f"{moment.day:02d}", f"{moment.hour:02d}")
+    segments = [f"{PARTITION_KEYS[i]}={values[i]}" for i in range(depth)]
+    return '/'.join(([base_prefix] if base_prefix else []) + segments) + '/'
+
+def _add_months(moment, months):
+    """返回 months 个月之后的同一天（调用方保证为 1 日）"""
+    month_index = moment.month - 1 + months
+    return moment.replace(year=moment.year + month_index // 12, month=month_index % 12 + 1)
+
+def build_partition_prefixes(base_prefix, start, end):
+    """
+    将时间范围转换为覆盖该范围的最少 Hive 分区前缀
+    
+    完整覆盖的年、月、天分别合并为 year=、month=、day= 级别的前缀，其余部分按小时分区列出
+    
+    :param base_prefix: CTR 数据的根前缀，例如 'ctr-base'
+    :param start: 开始时间（包含），按小时向下取整
+    :param end: 结束时间（不包含），按小时向上取整
+    :return: 分区前缀列表，按时间顺序排列
+    """
+    base_prefix = base_prefix.strip('/')
+    current = start.replace(minute=0, second=0, microsecond=0)
+    end_hour = end.replace(minute=0, second=0, microsecond=0)
+    if end_hour < end:
+        end_hour += timedelta(hours=1)
+    
+    prefixes = []
+    while current < end_hour:
+        at_day_start = current.hour == 0
+        at_month_start = at_day_start and current.day == 1
+        at_year_start = at_month_start and current.month == 1
+        
+        if at_year_start and current.replace(year=current.year + 1) <= end_hour:
+            prefixes.append(_partition_prefix(base_prefix, current, 1))
+            current = current.replace(year=current.year + 1)
+        elif at_month_start and _add_months(current, 1) <= end_hour:
+            prefixes.append(_partition_prefix(base_prefix, current, 2))
+            current = _add_months(current, 1)
+        elif at_day_start and current + timedelta(days=1) <= end_hour:
+            prefixes.append(_partition_prefix(base_prefix, current, 3))
+            current += timedelta(days=1)
+        else:
+            prefixes.append(_partition_prefix(base_prefix, current, 4))
+            current += timedelta(hours=1)
+    
+    return prefixes
+
+def load_contact_file(s3_client, bucket_name, obj, phone_numbers=None, ranged_reads=True, cache=None, stats=None):
+    """
+    读取单个联系记录文件，优先使用本地缓存
+    
+    缓存的是文件中的全部联系记录，热线号码筛选在读取缓存后进行，因此同一文件的缓存可用于任意号码组合
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param obj: 列表结果中的对象信息
+    :param phone_numbers: 可选，只保留这些热线号码的联系记录
+    :param ranged_reads: Parquet 文件是否按范围只读取所需列块
+    :param cache: 可选，ContactFileCache 实例
+    :param stats: 可选，QueryStats 实例，记录读取耗时、解析的记录数和缓存命中情况
+    :return: 该文件中联系记录的 DataFrame
+    """
+    started = time.perf_counter()
+    key = obj['Key']
+    if cache is None:
+        df = parse_contact_file(s3_client, bucket_name, key, obj.get('Size'), phone_numbers, ranged_reads)
+        if stats:
+            stats.observe('load_contact_file', time.perf_counter() - started)
+            stats.incr('ctr_files_parsed')
+            stats.incr('contact_rows_parsed', len(df))
+        return df
+    
+    df = cache.get(bucket_name, obj)
+    if stats:
+        stats.incr('contact_cache', result='miss' if df is None else 'hit')
+    if df is None:
+        df = parse_contact_file(s3_client, bucket_name, key, obj.get('Size'), ranged_reads=ranged_reads)
+        cache.put(bucket_name, obj, df)
+        if stats:
+            stats.incr('ctr_files_parsed')
+            stats.incr('contact_rows_parsed', len(df))
+    
+    if phone_numbers:
+        df = df[df['热线号码'].isin(phone_numbers)].reset_index(drop=True)
+    if stats:
+        stats.observe('load_contact_file', time.perf_counter() - started)
+    return df
+
+def iter_loaded_contact_files(s3_client, bucket_name, files, phone_numbers=None, max_workers=DEFAULT_MAX_WORKERS, ranged_reads=True, cache=None, stats=None):
+    """
+    并发读取联系记录文件，按文件顺序逐个返回结果
+    
+    同时处理的文件数不超过 max_workers 的两倍
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param files: 列表结果中对象信息的可迭代对象
+    :param phone_numbers: 可选，只返回这些热线号码的联系记录
+    :param max_workers: 并发下载和解析文件的最大线程数
+    :param ranged_reads: Parquet 文件是否按范围只读取所需列块
+    :param cache: 可选，ContactFileCache 实例
+    :param stats: 可选，QueryStats 实例
+    :return: 生成 (对象信息, 联系记录 DataFrame, 异常)，读取失败时 DataFrame 为 None
+    """
+    files = iter(files)
+    pending = deque()
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # 保持有限数量的文件在处理中
+            while len(pending) < max_workers * 2:
+                obj = next(files, None)
+                if obj is None:
+                    break
+                pending.append((obj, executor.submit(load_contact_file, s3_client, bucket_name, obj, phone_numbers, ranged_reads, cache, stats)))
+            
+            if not pending:
+                break
+            
+            obj, future = pending.popleft()
+            try:
+                yield obj, future.result(), None
+            except Exception as e:
+                yield obj, None, e
+
+def iter_contact_batches(s3_client, bucket_name, files, phone_numbers=None, batch_size=DEFAULT_BATCH_SIZE, max_workers=DEFAULT_MAX_WORKERS, ranged_reads=True, progress_callback=None, cache=None, stats=None):
+    """
+    并发下载和解析联系记录文件，按批次逐步返回结果
+    
+    同时处理的文件数不超过 max_workers 的两倍，结果按文件顺序输出，与逐个处理的输出一致。
+    内存占用取决于批次大小和并发数，与文件总数无关
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param files: 列表结果中对象信息的可迭代对象，可以是逐页列出的生成器
+    :param phone_numbers: 可选，只返回这些热线号码的联系记录
+    :param batch_size: 每批返回的最大记录数
+    :param max_workers: 并发下载和解析文件的最大线程数
+    :param ranged_reads: Parquet 文件是否按范围只读取所需列块
+    :param progress_callback: 可选，每处理完一个文件调用 progress_callback(已处理文件数, 已找到记录数)
+    :param cache: 可选，ContactFileCache 实例，命中时不再下载文件
+    :param stats: 可选，QueryStats 实例
+    :return: 生成联系记录 DataFrame 批次
+    """
+    buffered = []
+    buffered_rows = 0
+    files_done = 0
+    rows_done = 0
+    
+    for obj, df, error in iter_loaded_contact_files(s3_client, bucket_name, files, phone_numbers, max_workers, ranged_reads, cache, stats):
+        if error is not None:
+            logger.warning(f"处理文件 {obj['Key']} 时出错: {str(error)}")
+            if stats:
+                stats.incr('ctr_files_failed')
+        
+        files_done += 1
+        if df is not None and not df.empty:
+            buffered.append(df)
+            buffered_rows += len(df)
+            rows_done += len(df)
+        if progress_callback:
+            progress_callback(files_done, rows_done)
+        
+        # 攒够一批后输出，超过批次大小的部分留到下一批
+        while buffered_rows >= batch_size:
+            batch = pd.concat(buffered, ignore_index=True)
+            yield batch.iloc[:batch_size].reset_index(drop=True)
+            rest = batch.iloc[batch_size:]
+            buffered = [rest] if not rest.empty else []
+            buffered_rows = len(rest)
+    
+    if buffered:
+        yield pd.concat(buffered, ignore_index=True)
+
+def list_contact_files_for_path(s3_client, ctr_path, date_range=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    列出 CTR 路径下需要读取的联系记录文件
+    
+    :param s3_client: S3 客户端
+    :param ctr_path: CTR 数据的 S3 路径，格式为 's3://{bucket_name}/{prefix}'
+    :param date_range: 可选，(开始时间, 结束时间)，指定时只列出范围内的分区，路径末尾的分区目录会被忽略
+    :param max_workers: 并发列出分区的最大线程数
+    :return: (存储桶名称, 对象信息的可迭代对象)
+    """
+    bucket_name, bucket_prefix = parse_s3_path(ctr_path)
+    
+    if date_range:
+        prefixes = build_partition_prefixes(strip_partition_suffix(bucket_prefix), *date_range)
+        return bucket_name, list_contact_files_in_prefixes(s3_client, bucket_name, prefixes, max_workers)
+    return bucket_name, iter_objects_parallel(s3_client, bucket_name, bucket_prefix, is_contact_file, max_workers)
+
+def stream_contact_files(s3_client, ctr_path, phone_numbers=None, date_range=None, batch_size=DEFAULT_BATCH_SIZE, max_workers=DEFAULT_MAX_WORKERS, ranged_reads=True, progress_callback=None, cache=None, stats=None):
+    """
+    以流式方式获取联系记录：列出 -> 下载 -> 解析 -> 筛选 -> 按批次返回
+    
+    :param s3_client: S3 客户端
+    :param ctr_path: CTR 数据的 S3 路径，格式为 's3://{bucket_name}/{prefix}'
+    :param phone_numbers: 可选，只返回这些热线号码的联系记录
+    :param date_range: 可选，(开始时间, 结束时间)，指定时只读取范围内的分区，路径末尾的分区目录会被忽略
+    :param batch_size: 每批返回的最大记录数
+    :param max_workers: 并发列出、下载和解析的最大线程数
+    :param ranged_reads: Parquet 文件是否按范围只读取所需列块
+    :param progress_callback: 可选，每处理完一个文件调用 progress_callback(已处理文件数, 已找到记录数)
+    :param cache: 可选，ContactFileCache 实例
+    :param stats: 可选，QueryStats 实例
+    :return: 生成联系记录 DataFrame 批次
+    """
+    bucket_name, files = list_contact_files_for_path(s3_client, ctr_path, date_range, max_workers)
+    yield from iter_contact_batches(s3_client, bucket_name, files, phone_numbers, batch_size, max_workers, ranged_reads, progress_callback, cache, stats)
+
+def concat_contact_batches(batches):
+    """合并联系记录批次"""
+    frames = list(batches)
+    if not frames:
+        return compact_result_frame(pd.DataFrame(columns=CONTACT_COLUMNS))
+    return compact_result_frame(pd.concat(frames, ignore_index=True))
+
+def get_contact_files_list(s3_client, s3_bucket_path, phone_numbers=None, max_workers=DEFAULT_MAX_WORKERS, ranged_reads=True):
+    """
+    获取指定 S3 存储桶路径中的所有联系记录文件
+    
+    文件在线程池中并发下载和解析，结果按列表顺序合并，与逐个处理的输出一致
+    
+    :param s3_client: S3 客户端
+    :param s3_bucket_path: S3 存储桶路径，格式为 's3://{bucket_name}/{bucket_prefix}'
+    :param phone_numbers: 可选，只返回这些热线号码的联系记录，Parquet 文件会在读取时下推筛选
+    :param max_workers: 并发下载和解析文件的最大线程数
+    :param ranged_reads: Parquet 文件是否按范围只读取所需列块
+    :return: 包含联系记录信息的 DataFrame
+    """
+    try:
+        return concat_contact_batches(stream_contact_files(
+            s3_client, s3_bucket_path, phone_numbers,
+            max_workers=max_workers, ranged_reads=ranged_reads
+        ))
+    
+    except Exception as e:
+        logger.error(f"获取通话列表时出错: {str(e)}")
+        return pd.DataFrame(columns=CONTACT_COLUMNS)
+
+def get_contact_files_by_date_range(s3_client, ctr_base_path, start, end, phone_numbers=None, max_workers=DEFAULT_MAX_WORKERS, ranged_reads=True):
+    """
+    获取时间范围内的联系记录，只列出和读取范围内的分区
+    
+    :param s3_client: S3 客户端
+    :param ctr_base_path: CTR 数据的根路径，格式为 's3://{bucket_name}/{prefix}'，末尾的分区目录会被忽略
+    :param start: 开始时间（包含，UTC）
+    :param end: 结束时间（不包含，UTC）
+    :param phone_numbers: 可选，只返回这些热线号码的联系记录
+    :param max_workers: 并发列出和读取的最大线程数
+    :param ranged_reads: Parquet 文件是否按范围只读取所需列块
+    :return: 包含联系记录信息的 DataFrame
+    """
+    try:
+        return concat_contact_batches(stream_contact_files(
+            s3_client, ctr_base_path, phone_numbers, date_range=(start, end),
+            max_workers=max_workers, ranged_reads=ranged_reads
+        ))
+    
+    except Exception as e:
+        logger.error(f"获取通话列表时出错: {str(e)}")
+        return pd.DataFrame(columns=CONTACT_COLUMNS)
+
+def merge_contacts_and_recordings(contact_files, recordings, selected_numbers=None):
+    """
+    合并联系记录和录音记录，基于ContactId进行left join
+    
+    先按热线号码筛选联系记录，再通过录音 ContactId 的哈希索引按位置取值，全程按列处理，不生成逐行的 dict
+    
+    :param contact_files: 联系记录 DataFrame
+    :param recordings: 录音记录 DataFrame
+    :param selected_numbers: 可选，筛选特定电话号码的记录
+    :return: 合并后的记录 DataFrame
+    """
+    try:
+        df_contacts = contact_files if isinstance(contact_files, pd.DataFrame) else pd.DataFrame(contact_files)
+        df_recordings = recordings if isinstance(recordings, pd.DataFrame) else pd.DataFrame(recordings)
+        
+        # 确保两个DataFrame都有ContactId列
+        if 'ContactId' not in df_contacts.columns or 'ContactId' not in df_recordings.columns:
+            logger.warning("联系记录或录音记录缺少ContactId列，无法合并")
+            return pd.DataFrame(columns=CONTACT_COLUMNS + ['录音S3地址', '有录音'])
+        
+        # 筛选特定电话号码的记录
+        if selected_numbers and len(selected_numbers) > 0:
+            df_contacts = df_contacts[df_contacts['热线号码'].isin(selected_numbers)]
+        merged_df = df_contacts.reset_index(drop=True)
+        
+        recording_index = pd.Index(df_recordings['ContactId'])
+        if recording_index.is_unique:
+            # 每条联系记录在录音中的位置，-1 表示没有录音
+            positions = recording_index.get_indexer(merged_df['ContactId'])
+            for column in df_recordings.columns:
+                if column == 'ContactId':
+                    continue
+                name = f"{column}_recording" if column in merged_df.columns else column
+                merged_df[name] = df_recordings[column].array.take(positions, allow_fill=True)
+        else:
+            # 同一个 ContactId 有多条录音时，每条录音各占一行
+            merged_df = pd.merge(
+                merged_df,
+                df_recordings,
+                on='ContactId',
+                how='left',
+                suffixes=('', '_recording')
+            )
+        
+        # 添加是否有录音的标记
+        merged_df['有录音'] = merged_df['录音S3地址'].notna()
+        
+        return compact_result_frame(merged_df)
+    
+    except Exception as e:
+        logger.error(f"合并联系记录和录音记录时出错: {str(e)}")
+        return pd.DataFrame(columns=CONTACT_COLUMNS + ['录音S3地址', '有录音'])
+
+# 多实例查询结果中标记来源的列
+TARGET_COLUMNS = ['区域', '实例ID']
+
+@contextmanager
+def collect_thread_warnings():
+    """
+    收集当前线程输出到查询模块日志的警告和错误
+    
+    记录仍按原来的处理器输出；在工作线程中查询时用于把警告交给调用方线程显示
+    
+    :return: 警告消息列表，退出前持续追加
+    """
+    messages = []
+    thread_id = threading.get_ident()
+    
+    class Collector(logging.Handler):
+        def emit(self, record):
+            if record.thread == thread_id:
+                messages.append(record.getMessage())
+    
+    collector = Collector(logging.WARNING)
+    logger.addHandler(collector)
+    try:
+        yield messages
+    finally:
+        logger.removeHandler(collector)
+
+def search_instance(connect_client, s3_client, target, hotlines=None, date_range=None, max_workers=DEFAULT_MAX_WORKERS, cache=None, index=None, stats=None):
+    """
+    查询单个 Connect 实例：获取热线号码和录音路径，读取通话记录并与录音合并
+    
+    :param connect_client: 该实例所在区域的 Connect 客户端
+    :param s3_client: 该实例所在区域的 S3 客户端
+    :param target: dict，包含 region、instance_id、association_id、ctr_path
+    :param hotlines: 可选，只查询这些热线号码（与实例的号码取交集），不指定时查询实例的全部号码
+    :param date_range: 可选，(开始时间, 结束时间)
+    :param max_workers: 该实例并发读取文件的最大线程数
+    :param cache: 可选，ContactFileCache 实例
+    :param index: 可选，RecordingIndex 实例
+    :param stats: 可选，QueryStats 实例
+    :return: dict，包含 recordings、contact_files、merged_records（均带有 区域 和 实例ID 列）和 recordings_path
+    """
+    instance_numbers = [number['PhoneNumber'] for number in get_all_phone_numbers(connect_client, target['instance_id'])]
+    phone_numbers = [number for number in instance_numbers if not hotlines or number in hotlines]
+    
+    recordings_path = None
+    if target.get('association_id'):
+        recordings_path = get_call_recordings_s3_bucket(connect_client, target['instance_id'], target['association_id'])
+        if not recordings_path.startswith('s3://'):
+            logger.warning(f"实例 {target['instance_id']}: {recordings_path}")
+            recordings_path = None
+    
+    if phone_numbers:
+        contact_files = concat_contact_batches(stream_contact_files(
+            s3_client, target['ctr_path'], phone_numbers,
+            date_range=date_range,
+            max_workers=max_workers,
+            cache=cache,
+            stats=stats
+        ))
+    else:
+        contact_files = concat_contact_batches([])
+    
+    if recordings_path and phone_numbers:
+        recordings = get_call_recordings_list(
+            s3_client, recordings_path, phone_numbers, index, contact_files.set_index('ContactId')['热线号码']
+        )
+    else:
+        recordings = pd.DataFrame(columns=RECORDING_COLUMNS)
+    merged_records = merge_contacts_and_recordings(contact_files, recordings, phone_numbers)
+    
+    result = {'recordings_path': recordings_path, 'phone_numbers': phone_numbers}
+    for name, df in (('recordings', recordings), ('contact_files', contact_files), ('merged_records', merged_records)):
+        result[name] = df.assign(**{'区域': target['region'], '实例ID': target['instance_id']})
+    return result
+
+def iter_instance_searches(pool, session, targets, hotlines=None, date_range=None, identity=None, max_workers=DEFAULT_MAX_WORKERS, cache=None, index=None, stats=None):
+    """
+    并发查询多个 Connect 实例，按完成顺序返回各实例的结果
+    
+    每个实例在单独的线程中查询，客户端从 pool 中按区域复用；单个实例出错时记录警告，不影响其他实例。
+    工作线程中输出的警告随结果一起返回，由调用方在自己的线程中显示
+    
+    :param pool: ClientPool 实例
+    :param session: boto3 Session
+    :param targets: dict 列表，每个包含 region、instance_id、association_id、ctr_path
+    :param hotlines: 可选，只查询这些热线号码
+    :param date_range: 可选，(开始时间, 结束时间)
+    :param identity: 可选，凭证标识，用于从 pool 中取客户端
+    :param max_workers: 每个实例并发读取文件的最大线程数
+    :param cache: 可选，ContactFileCache 实例
+    :param index: 可选，RecordingIndex 实例
+    :param stats: 可选，QueryStats 实例，所有实例的 S3 调用记录到同一个统计中
+    :return: 生成 (target, result, error, warnings)，出错时 result 为 None，warnings 为该实例查询时输出的警告消息列表
+    """
+    def search(target):
+        connect_client, s3_client = pool.get(session, target['region'], identity)
+        with collect_thread_warnings() as messages:
+            try:
+                if stats:
+                    instrument_s3_client(s3_client, stats)
+                    with stats.span('search_instance'):
+                        result = search_instance(connect_client, s3_client, target, hotlines, date_range, max_workers, cache, index, stats)
+                else:
+                    result = search_instance(connect_client, s3_client, target, hotlines, date_range, max_workers, cache, index, stats)
+            except Exception as e:
+                return None, e, messages
+        return result, None, messages
+    
+    if not targets:
+        return
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {executor.submit(search, target): target for target in targets}
+        for future in as_completed(futures):
+            target = futures[future]
+            try:
+                result, error, messages = future.result()
+            except Exception as e:
+                result, error, messages = None, e, []
+            if error is not None:
+                logger.warning(f"查询实例 {target['instance_id']}（{target['region']}）时出错: {str(error)}")
+                if stats:
+                    stats.incr('instance_searches_failed')
+            yield target, result, error, messages
+
+def combine_instance_results(targets, results):
+    """
+    按 targets 的顺序合并多个实例的查询结果，合并结果与各实例的完成顺序无关
+    
+    :param targets: 查询的实例列表
+    :param results: iter_instance_searches 生成的 (target, result, error, warnings) 列表
+    :return: dict，包含 recordings、contact_files、merged_records 和各实例的查询概况 targets
+    """
+    order = {id(target): position for position, target in enumerate(targets)}
+    results = sorted(results, key=lambda item: order[id(item[0])])
+    combined = {}
+    for name, columns in (
+        ('recordings', RECORDING_COLUMNS),
+        ('contact_files', CONTACT_COLUMNS),
+        ('merged_records', CONTACT_COLUMNS + ['录音S3地址', '有录音'])
+    ):
+        frames = [result[name] for _, result, _, _ in results if result is not None and not result[name].empty]
+        if frames:
+            combined[name] = compact_result_frame(pd.concat(frames, ignore_index=True))
+        else:
+            combined[name] = pd.DataFrame(columns=columns + TARGET_COLUMNS)
+    
+    combined['targets'] = pd.DataFrame([{
+        '区域': target['region'],
+        '实例ID': target['instance_id'],
+        '通话记录 S3 路径': target['ctr_path'],
+        '录音 S3 路径': result['recordings_path'] if result else None,
+        '热线号码数': len(result['phone_numbers']) if result else 0,
+        '联系记录数': len(result['contact_files']) if result else 0,
+        '录音数': len(result['recordings']) if result else 0,
+        '错误': str(error) if error else '',
+        '警告': '\n'.join(messages)
+    } for target, result, error, messages in results])
+    return combined
+
+def search_instances(pool, session, targets, hotlines=None, date_range=None, identity=None, max_workers=DEFAULT_MAX_WORKERS, cache=None, index=None, stats=None):
+    """并发查询多个 Connect 实例并合并为一个带 区域 和 实例ID 列的结果，参数同 iter_instance_searches"""
+    results = list(iter_instance_searches(pool, session, targets, hotlines, date_range, identity, max_workers, cache, index, stats))
+    return combine_instance_results(targets, results)
+
+class ResultQueryEngine:
+    """
+    查询结果的筛选、排序和分页
+    
+    每种筛选和排序组合的结果位置会被缓存，翻页时只取出当前页的行。
+    分页游标中包含结果集标识和查询条件的指纹，结果或条件变化后旧游标自动回到第一页
+    
+    支持的筛选条件 (filters)：
+    - hotlines: 热线号码列表
+    - customer_prefix: 客户号码前缀
+    - has_recording: 是否有录音 (True/False)
+    - contact_id_prefix: ContactId 前缀
+    - min_duration / max_duration: 录音时长范围（秒），没有时长的行不符合条件
+    """
+    
+    def __init__(self, df, max_cached_queries=8, result_id=None):
+        """
+        :param df: 查询结果 DataFrame
+        :param max_cached_queries: 最多缓存的筛选和排序组合数
+        :param result_id: 可选，结果集标识，不指定时每个实例随机生成，其他结果集的游标不能用于本实例
+        """
+        self.df = df.reset_index(drop=True)
+        self.max_cached_queries = max_cached_queries
+        self.result_id = result_id or os.urandom(8).hex()
+        self._positions_cache = {}
+    
+    def _fingerprint(self, filters, sort_by, descending):
+        query = json.dumps([self.result_id, filters or {}, sort_by, descending], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+    
+    def _mask(self, filters):
+        """根据筛选条件生成布尔掩码"""
+        df = self.df
+        mask = np.ones(len(df), dtype=bool)
+        if not filters:
+            return mask
+        
+        if filters.get('hotlines') and '热线号码' in df.columns:
+            mask &= df['热线号码'].isin(filters['hotlines']).to_numpy()
+        if filters.get('customer_prefix') and '客户号码' in df.columns:
+            mask &= df['客户号码'].astype('string[pyarrow]').str.startswith(filters['customer_prefix']).fillna(False).to_numpy(dtype=bool)
+        if filters.get('has_recording') is not None and '有录音' in df.columns:
+            mask &= df['有录音'].to_numpy(dtype=bool) == bool(filters['has_recording'])
+        if filters.get('contact_id_prefix') and 'ContactId' in df.columns:
+            mask &= df['ContactId'].astype('string[pyarrow]').str.startswith(filters['contact_id_prefix']).fillna(False).to_numpy(dtype=bool)
+        if RECORDING_DURATION_COLUMN in df.columns:
+            durations = df[RECORDING_DURATION_COLUMN].to_numpy(dtype=float, na_value=np.nan)
+            if filters.get('min_duration') is not None:
+                mask &= durations >= filters['min_duration']
+            if filters.get('max_duration') is not None:
+                mask &= durations <= filters['max_duration']
+        return mask
+    
+    def _positions(self, filters, sort_by, descending):
+        """返回筛选并排序后的行位置，结果按查询条件缓存"""
+        fingerprint = self._fingerprint(filters, sort_by, descending)
+        positions = self._positions_cache.get(fingerprint)
+        if positions is not None:
+            return fingerprint, positions
+        
+        positions = np.flatnonzero(self._mask(filters))
+        if sort_by and sort_by in self.df.columns:
+            values = self.df[sort_by].take(positions)
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            order = values.reset_index(drop=True).sort_values(
+                ascending=not descending, kind='stable', na_position='last'
+            ).index.to_numpy()
+            positions = positions[order]
+        
+        if len(self._positions_cache) >= self.max_cached_queries:
+            self._positions_cache.pop(next(iter(self._positions_cache)))
+        self._positions_cache[fingerprint] = positions
+        return fingerprint, positions
+    
+    @staticmethod
+    def encode_cursor(fingerprint, offset):
+        return base64.urlsafe_b64encode(f"{fingerprint}:{offset}".encode('ascii')).decode('ascii')
+    
+    @staticmethod
+    def decode_cursor(cursor, fingerprint):
+        """解析游标，结果集或查询条件不一致、游标无效（包括偏移为负数）时返回 0"""
+        if not cursor:
+            return 0
+        try:
+            cursor_fingerprint, offset = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split(':')
+            offset = int(offset)
+            return offset if cursor_fingerprint == fingerprint and offset >= 0 else 0
+        except (ValueError, UnicodeDecodeError):
+            return 0
+    
+    def page(self, filters=None, sort_by=None, descending=False, cursor=None, page_size=RESULT_PAGE_SIZE):
+        """
+        返回一页查询结果
+        
+        :param filters: 筛选条件 dict
+        :param sort_by: 可选，排序列名
+        :param descending: 是否降序
+        :param cursor: 可选，上一次返回的游标，为空时返回第一页
+        :param page_size: 每页行数
+        :return: dict，包含 rows（当前页 DataFrame）、total、start、next_cursor、prev_cursor
+        """
+        fingerprint, positions = self._positions(filters, sort_by, descending)
+        total = len(positions)
+        start = min(self.decode_cursor(cursor, fingerprint), max(total - 1, 0))
+        end = min(start + page_size, total)
+        
+        return {
+            'rows': self.df.take(positions[start:end]),
+            'total': total,
+            'start': start,
+            'next_cursor': self.encode_cursor(fingerprint, end) if end < total else None,
+            'prev_cursor': self.encode_cursor(fingerprint, max(start - page_size, 0)) if start > 0 else None,
+        }
+
+def split_s3_uri(s3_uri):
+    """将 's3://{bucket_name}/{key}' 解析为 (bucket_name, key)"""
+    s3_parts = s3_uri.replace('s3://', '').split('/')
+    return s3_parts[0], '/'.join(s3_parts[1:])
+
+def download_recording_file(s3_client, s3_uri, file_path, known_etag=None):
+    """
+    下载单个录音文件，已存在且大小和 ETag 一致时跳过
+    
+    先写入临时文件，下载完成后再重命名，中断时不会留下不完整的录音文件
+    
+    :param s3_client: S3 客户端
+    :param s3_uri: 录音的 S3 地址
+    :param file_path: 本地文件路径
+    :param known_etag: 上次下载该文件时记录的 ETag
+    :return: (是否实际下载, 字节数, ETag)
+    """
+    bucket_name, object_key = split_s3_uri(s3_uri)
+    head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    size = head['ContentLength']
+    etag = head.get('ETag', '')
+    
+    if os.path.exists(file_path) and os.path.getsize(file_path) == size and (known_etag is None or known_etag == etag):
+        return False, size, etag
+    
+    temp_path = file_path + '.part'
+    s3_client.download_file(bucket_name, object_key, temp_path, Config=DOWNLOAD_TRANSFER_CONFIG)
+    os.replace(temp_path, file_path)
+    return True, size, etag
+
+def plan_recording_files(merged_records):
+    """
+    按热线号码分组，生成每个录音的相对路径
+    
+    同一个录音只下载一次（重复的 ContactId 各占一行，录音S3地址相同）。文件名默认为 ContactId，
+    同一目录中一个 ContactId 有多条录音时改用录音对象的文件名，仍然重名时加序号，
+    保证并发下载和 ZIP 中的每个录音使用不同的路径
+    
+    :param merged_records: 合并后的记录 DataFrame
+    :return: ([(录音S3地址, ContactId, 相对路径)], 热线号码分组数)
+    """
+    df = merged_records if isinstance(merged_records, pd.DataFrame) else pd.DataFrame(merged_records)
+    if df.empty or '录音S3地址' not in df.columns:
+        return [], 0
+    
+    df = df[df['录音S3地址'].notna() & (df['录音S3地址'] != '')].drop_duplicates('录音S3地址')
+    hotlines = df['热线号码'].astype(object).fillna('未知') if '热线号码' in df.columns else pd.Series('未知', index=df.index)
+    contact_ids = df['ContactId'].astype(object).fillna('')
+    # 同一热线号码下有多条录音的 ContactId
+    shared = pd.DataFrame({'hotline': hotlines, 'contact_id': contact_ids}).duplicated(keep=False).to_numpy()
+    
+    # 按热线号码首次出现的顺序分组，组内保持原有顺序
+    group_codes, group_names = pd.factorize(hotlines)
+    order = group_codes.argsort(kind='stable')
+    
+    files = []
+    used_paths = set()
+    for s3_uri, contact_id, hotline, is_shared in zip(
+        df['录音S3地址'].to_numpy()[order],
+        contact_ids.to_numpy()[order],
+        hotlines.to_numpy()[order],
+        shared[order]
+    ):
+        # 目录名称（去掉+号）
+        dir_name = hotline.replace('+', '')
+        file_name = os.path.splitext(s3_uri.rsplit('/', 1)[-1])[0] if is_shared else contact_id
+        relative_path = f"{dir_name}/{file_name}.wav"
+        suffix = 1
+        while relative_path in used_paths:
+            suffix += 1
+            relative_path = f"{dir_name}/{file_name}_{suffix}.wav"
+        used_paths.add(relative_path)
+        files.append((s3_uri, contact_id, relative_path))
+    
+    return files, len(group_names)
+
+def load_download_manifest(manifest_path):
+    """读取下载记录（相对路径 -> ETag），文件不存在或损坏时返回空字典"""
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_download_manifest(manifest_path, manifest):
+    """先写入临时文件再重命名，保存下载记录"""
+    temp_path = manifest_path + '.part'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, manifest_path)
+
+def download_recordings_to_directories(s3_client, merged_records, recording_dir, max_workers=DEFAULT_MAX_WORKERS, progress_callback=None):
+    """
+    将录音文件下载到按热线号码组织的目录中
+    
+    文件在线程池中并发下载。已下载的文件记录在目录下的 .download_manifest.json 中，
+    重新运行时跳过大小和 ETag 一致的文件，因此中断后可以继续下载
+    
+    :param s3_client: S3客户端
+    :param merged_records: 合并后的记录 DataFrame
+    :param recording_dir: 录音根目录名称，位于当前目录下
+    :param max_workers: 并发下载的最大线程数
+    :param progress_callback: 可选，每完成一个文件调用 progress_callback(已完成数, 总数, 已传输字节数, 已用秒数)
+    :return: 下载统计信息
+    """
+    try:
+        # 如果没有指定基础目录，则使用当前目录
+        base_dir = os.getcwd()
+        
+        # 创建recordings目录作为根目录
+        recordings_dir = os.path.join(base_dir, recording_dir)
+        os.makedirs(recordings_dir, exist_ok=True)
+        
+        # 记录下载的文件数量
+        downloaded_count = 0
+        skipped_count = 0
+        failed_count = 0
+        transferred_bytes = 0
+        
+        # 按热线号码分组，为每个热线号码创建目录
+        tasks, group_count = plan_recording_files(merged_records)
+        for dir_name in {os.path.dirname(relative_path) for _, _, relative_path in tasks}:
+            os.makedirs(os.path.join(recordings_dir, dir_name), exist_ok=True)
+        
+        # 读取上次下载记录的 ETag
+        manifest_path = os.path.join(recordings_dir, DOWNLOAD_MANIFEST_NAME)
+        manifest = load_download_manifest(manifest_path)
+        
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    download_recording_file, s3_client, s3_uri,
+                    os.path.join(recordings_dir, relative_path), manifest.get(relative_path)
+                ): (contact_id, relative_path)
+                for s3_uri, contact_id, relative_path in tasks
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                contact_id, relative_path = futures[future]
+                try:
+                    downloaded, size, etag = future.result()
+                    manifest[relative_path] = etag
+                    if downloaded:
+                        downloaded_count += 1
+                        transferred_bytes += size
+                    else:
+                        skipped_count += 1
+                except Exception as e:
+                    logger.warning(f"下载录音失败 (ContactId: {contact_id}): {e}")
+                    failed_count += 1
+                
+                # 定期保存下载记录，中断后可以继续
+                if done % 100 == 0:
+                    save_download_manifest(manifest_path, manifest)
+                if progress_callback:
+                    progress_callback(done, len(tasks), transferred_bytes, time.monotonic() - started)
+        
+        save_download_manifest(manifest_path, manifest)
+        
+        return {
+            "base_dir": recordings_dir,
+            "downloaded": downloaded_count,
+            "skipped": skipped_count,
+            "failed": failed_count,
+            "bytes": transferred_bytes,
+            "seconds": time.monotonic() - started,
+            "phone_groups": group_count
+        }
+    
+    except Exception as e:
+        logger.error(f"下载全部录音失败: {e}")
+        return None
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """不可定位的只写缓冲区，zipfile 写入的数据由生成器逐段取出"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _prefetch_recording(s3_client, s3_uri, prefetch_bytes):
+    """打开录音对象并预读开头部分，返回 (预读数据, 剩余数据流)"""
+    body = get_s3_object(s3_client, s3_uri)['Body']
+    return body.read(prefetch_bytes), body
+
+def iter_recordings_zip(s3_client, merged_records, chunk_size=ZIP_CHUNK_SIZE, prefetch=ZIP_PREFETCH_COUNT):
+    """
+    将录音按热线号码目录打包为 ZIP，以数据块的形式逐段生成
+    
+    后续录音在线程池中提前打开并预读 chunk_size 字节，内存占用约为 prefetch * chunk_size，
+    与录音总大小无关，也不需要本地磁盘
+    
+    :param s3_client: S3 客户端
+    :param merged_records: 合并后的记录 DataFrame
+    :param chunk_size: 每次读取和预读的字节数
+    :param prefetch: 提前打开的录音数量
+    :return: 生成 ZIP 数据块 (bytes)
+    """
+    files, _ = plan_recording_files(merged_records)
+    buffer = _ZipStreamBuffer()
+    pending = deque()
+    files = iter(files)
+    
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            while True:
+                while len(pending) < prefetch:
+                    next_file = next(files, None)
+                    if next_file is None:
+                        break
+                    s3_uri, contact_id, relative_path = next_file
+                    pending.append((contact_id, relative_path, executor.submit(_prefetch_recording, s3_client, s3_uri, chunk_size)))
+                
+                if not pending:
+                    break
+                
+                contact_id, relative_path, future = pending.popleft()
+                try:
+                    head, body = future.result()
+                except Exception as e:
+                    logger.warning(f"读取录音失败 (ContactId: {contact_id}): {e}")
+                    continue
+                
+                entry = zipfile.ZipInfo(relative_path, date_time=time.localtime()[:6])
+                with archive.open(entry, 'w', force_zip64=True) as target:
+                    chunk = head
+                    while chunk:
+                        target.write(chunk)
+                        yield buffer.drain()
+                        chunk = body.read(chunk_size)
+                body.close()
+                yield buffer.drain()
+        
+        # 写入 ZIP 目录
+        yield buffer.drain()
+
+def zip_export_location(export_path, label):
+    """
+    生成 ZIP 导出文件的存储桶和对象键
+    
+    :param export_path: 导出路径，格式为 's3://{bucket_name}/{prefix}'
+    :param label: 文件名中的标识，例如热线号码
+    :return: (bucket_name, key)
+    """
+    bucket_name, prefix = parse_s3_path(export_path)
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    return bucket_name, f"{prefix}{ZIP_EXPORT_FILE_PREFIX}{label}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}.zip"
+
+def delete_expired_zip_exports(s3_client, bucket_name, prefix, max_age=ZIP_EXPORT_URL_EXPIRES):
+    """
+    删除导出前缀下下载链接已过期的 ZIP 文件
+    
+    只删除 export_recordings_zip_to_s3 写入的文件（文件名以 ZIP_EXPORT_FILE_PREFIX 开头、以 .zip 结尾），
+    前缀下的其他对象不受影响
+    
+    :param s3_client: S3 客户端
+    :param bucket_name: 存储桶名称
+    :param prefix: 导出前缀
+    :param max_age: 超过该秒数的导出文件被删除，默认与下载链接有效期相同
+    :return: 删除的文件数
+    """
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    expired = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix + ZIP_EXPORT_FILE_PREFIX):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.zip') and obj['LastModified'] < cutoff:
+                expired.append({'Key': obj['Key']})
+    
+    # 每次最多删除 1000 个对象
+    for start in range(0, len(expired), 1000):
+        s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': expired[start:start + 1000], 'Quiet': True})
+    return len(expired)
+
+def export_recordings_zip_to_s3(s3_client, merged_records, export_path, label, part_size=ZIP_UPLOAD_PART_SIZE):
+    """
+    将录音流式打包为 ZIP 并以分段上传的方式写入导出路径，返回可直接下载的预签名链接
+    
+    导出文件包含通话录音，只在下载链接有效期内保留：每次导出后删除同一前缀下已过期的导出文件，
+    也可以为导出前缀配置 S3 生命周期规则自动删除。导出路径需要写入权限，应使用单独的存储桶或前缀，
+    不要写入 Connect 的录音存储桶
+    
+    :param s3_client: S3 客户端
+    :param merged_records: 合并后的记录 DataFrame
+    :param export_path: 保存 ZIP 的 S3 路径，格式为 's3://{bucket_name}/{prefix}'
+    :param label: 文件名中的标识，例如热线号码
+    :param part_size: 分段上传的分段大小，不能小于 5 MB
+    :return: (ZIP 的 S3 地址, 预签名下载链接)
+    """
+    bucket_name, key = zip_export_location(export_path, label)
+    upload = s3_client.create_multipart_upload(Bucket=bucket_name, Key=key, ContentType='application/zip')
+    upload_id = upload['UploadId']
+    parts = []
+    
+    def upload_part(data):
+        response = s3_client.upload_part(
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            PartNumber=len(parts) + 1, Body=data
+        )
+        parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+    
+    try:
+        pending = bytearray()
+        for chunk in iter_recordings_zip(s3_client, merged_records):
+            pending.extend(chunk)
+            if len(pending) >= part_size:
+                upload_part(bytes(pending))
+                pending = bytearray()
+        if pending or not parts:
+            upload_part(bytes(pending))
+        
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+        raise
+    
+    # 清理失败（例如没有删除权限）不影响本次导出，过期文件需要由生命周期规则删除
+    export_prefix = key[:key.rfind('/') + 1]
+    try:
+        delete_expired_zip_exports(s3_client, bucket_name, export_prefix)
+    except Exception as e:
+        logger.warning(f"删除过期的 ZIP 导出文件失败，请为 s3://{bucket_name}/{export_prefix} 配置生命周期规则: {e}")
+    
+    url = s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': bucket_name, 'Key': key},
+        ExpiresIn=ZIP_EXPORT_URL_EXPIRES
+    )
+    return f"s3://{bucket_name}/{key}", url
+
+# 异步 I/O 后端
+class AsyncS3Client:
+    """
+    基于线程池的异步 S3 客户端
+    
+    boto3 调用在专用线程池中执行，协程通过 await 等待结果，因此列出、下载和解析可以在多个前缀间同时进行。
+    连接池大小与线程数一致，可按需调整；也可以传入 endpoint_url 连接 moto 等本地 S3 服务
+    
+    用法：
+        async with AsyncS3Client(session, region) as client:
+            files = await client.list_objects(bucket, prefix)
+    """
+    
+    def __init__(self, session=None, region=None, max_pool_connections=ASYNC_S3_POOL_CONNECTIONS, endpoint_url=None, stats=None):
+        session = session or boto3.Session()
+        self.max_pool_connections = max_pool_connections
+        self.s3 = session.client(
+            's3',
+            region_name=region,
+            endpoint_url=endpoint_url,
+            config=Config(max_pool_connections=max_pool_connections)
+        )
+        if stats:
+            instrument_s3_client(self.s3, stats)
+        self._executor = ThreadPoolExecutor(max_workers=max_pool_connections, thread_name_prefix='async-s3')
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def close(self):
+        """等待进行中的调用结束并释放线程池"""
+        self._executor.shutdown(wait=True)
+    
+    async def run(self, func, *args, **kwargs):
+        """在线程池中执行同步函数，函数的第一个参数为 boto3 S3 客户端"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, self.s3, *args, **kwargs))
+    
+    async def iter_objects(self, bucket_name, prefix, start_after=None):
+        """逐页列出前缀下的对象，每页请求在线程池中执行"""
+        params = {'Bucket': bucket_name, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = start_after
+        while True:
+            page = await self.run(lambda s3: s3.list_objects_v2(**params))
+            for obj in page.get('Contents', []):
+                yield obj
+            if not page.get('IsTruncated'):
+                break
+            params['ContinuationToken'] = page['NextContinuationToken']
+    
+    async def list_objects(self, bucket_name, prefix, predicate=None):
+        """列出前缀下满足 predicate(key) 的全部对象"""
+        return [obj async for obj in self.iter_objects(bucket_name, prefix) if predicate is None or predicate(obj['Key'])]
+    
+    async def read_object(self, bucket_name, key, byte_range=None):
+        """读取对象内容，限流时自动重试"""
+        return await self.run(read_s3_object_with_retry, bucket_name, key, byte_range)
+    
+    async def head_object(self, bucket_name, key):
+        return await self.run(lambda s3: s3.head_object(Bucket=bucket_name, Key=key))
+    
+    async def download_file(self, bucket_name, key, file_path):
+        await self.run(lambda s3: s3.download_file(bucket_name, key, file_path, Config=DOWNLOAD_TRANSFER_CONFIG))
+
+async def async_list_contact_files(client, ctr_path, date_range=None):
+    """
+    并发列出 CTR 路径下需要读取的联系记录文件
+    
+    :param client: AsyncS3Client 实例
+    :param ctr_path: CTR 数据的 S3 路径，格式为 's3://{bucket_name}/{prefix}'
+    :param date_range: 可选，(开始时间, 结束时间)，指定时各分区前缀同时列出
+    :return: (存储桶名称, 对象信息列表)，按前缀顺序排列
+    """
+    bucket_name, bucket_prefix = parse_s3_path(ctr_path)
+    if date_range:
+        prefixes = build_partition_prefixes(strip_partition_suffix(bucket_prefix), *date_range)
+    else:
+        prefixes = [bucket_prefix]
+    
+    listings = await asyncio.gather(*(client.list_objects(bucket_name, prefix, is_contact_file) for prefix in prefixes))
+    return bucket_name, [obj for listing in listings for obj in listing]
+
+async def async_fetch_contact_files(client, ctr_path, phone_numbers=None, date_range=None, ranged_reads=True, cache=None, progress_callback=None, stats=None):
+    """
+    异步列出、下载并解析联系记录文件
+    
+    同时处理的文件数不超过连接池大小，结果按文件顺序合并，与同步流程的结果一致
+    
+    :param client: AsyncS3Client 实例
+    :param ctr_path: CTR 数据的 S3 路径
+    :param phone_numbers: 可选，只返回这些热线号码的联系记录
+    :param date_range: 可选，(开始时间, 结束时间)
+    :param ranged_reads: Parquet 文件是否按范围只读取所需列块
+    :param cache: 可选，ContactFileCache 实例
+    :param progress_callback: 可选，每处理完一个文件调用 progress_callback(已处理文件数, 已找到记录数)
+    :param stats: 可选，QueryStats 实例
+    :return: 联系记录 DataFrame
+    """
+    bucket_name, files = await async_list_contact_files(client, ctr_path, date_range)
+    semaphore = asyncio.Semaphore(client.max_pool_connections)
+    progress = {'files': 0, 'rows': 0}
+    
+    async def load(obj):
+        async with semaphore:
+            try:
+                df = await client.run(load_contact_file, bucket_name, obj, phone_numbers, ranged_reads, cache, stats)
+            except Exception as e:
+                logger.warning(f"处理文件 {obj['Key']} 时出错: {str(e)}")
+                if stats:
+                    stats.incr('ctr_files_failed')
+                df = None
+        
+        # 回调在事件循环所在的线程中执行
+        progress['files'] += 1
+        progress['rows'] += 0 if df is None else len(df)
+        if progress_callback:
+            progress_callback(progress['files'], progress['rows'])
+        return df
+    
+    frames = await asyncio.gather(*(load(obj) for obj in files))
+    return concat_contact_batches(df for df in frames if df is not None and not df.empty)
+
+async def async_get_call_recordings_list(client, s3_bucket_path, phone_numbers=None, contact_hotlines=None):
+    """
+    异步列出录音文件，返回与 get_call_recordings_list 相同的 DataFrame
+    
+    :param client: AsyncS3Client 实例
+    :param s3_bucket_path: 录音的 S3 路径
+    :param phone_numbers: 可选，所选热线号码列表
+    :param contact_hotlines: 可选，以 ContactId 为索引、热线号码为值的 Series
+    :return: 包含 ContactId、录音S3地址、热线号码 列的 DataFrame
+    """
+    bucket_name, bucket_prefix = parse_s3_path(s3_bucket_path)
+    objects = await client.list_objects(bucket_name, bucket_prefix, is_recording_file)
+    keys = [obj['Key'] for obj in objects]
+    recordings = pd.DataFrame({
+        'ContactId': [contact_id_from_recording_key(key) for key in keys],
+        '录音S3地址': [f"s3://{bucket_name}/{key}" for key in keys]
+    })
+    return attribute_recording_hotlines(recordings, phone_numbers, contact_hotlines)[RECORDING_COLUMNS]
+
+async def async_query_contacts_and_recordings(client, ctr_path, s3_bucket_path, phone_numbers, date_range=None, ranged_reads=True, cache=None, progress_callback=None, stats=None, index=None):
+    """
+    同时获取联系记录和录音列表，并按 ContactId 确定录音的热线号码
+    
+    指定 index 时读取联系记录的同时增量同步录音索引，再按联系记录的 ContactId 在索引中查找录音，
+    不列出整个录音前缀
+    
+    :param index: 可选，RecordingIndex 实例
+    :return: (联系记录 DataFrame, 录音 DataFrame)
+    """
+    if index is not None:
+        bucket_name, bucket_prefix = parse_s3_path(s3_bucket_path)
+        contact_files, _ = await asyncio.gather(
+            async_fetch_contact_files(client, ctr_path, phone_numbers, date_range, ranged_reads, cache, progress_callback, stats),
+            client.run(index.sync, bucket_name, bucket_prefix)
+        )
+        contact_hotlines = contact_files.set_index('ContactId')['热线号码']
+        if contact_hotlines.empty:
+            return contact_files, pd.DataFrame(columns=RECORDING_COLUMNS)
+        recordings = await client.run(
+            lambda s3: lookup_indexed_recordings(index, bucket_name, bucket_prefix, phone_numbers, contact_hotlines)
+        )
+        return contact_files, recordings
+    
+    contact_files, recordings = await asyncio.gather(
+        async_fetch_contact_files(client, ctr_path, phone_numbers, date_range, ranged_reads, cache, progress_callback, stats),
+        async_get_call_recordings_list(client, s3_bucket_path, phone_numbers)
+    )
+    recordings = attribute_recording_hotlines(recordings, phone_numbers, contact_files.set_index('ContactId')['热线号码'])
+    return contact_files, recordings[RECORDING_COLUMNS]
+
+async def async_download_recordings_to_directories(client, merged_records, recording_dir, progress_callback=None):
+    """
+    异步下载录音到按热线号码组织的目录中，与 download_recordings_to_directories 使用相同的目录结构和下载记录
+    
+    :param client: AsyncS3Client 实例
+    :param merged_records: 合并后的记录 DataFrame
+    :param recording_dir: 录音根目录名称，位于当前目录下
+    :param progress_callback: 可选，每完成一个文件调用 progress_callback(已完成数, 总数, 已传输字节数, 已用秒数)
+    :return: 下载统计信息
+    """
+    recordings_dir = os.path.join(os.getcwd(), recording_dir)
+    tasks, group_count = plan_recording_files(merged_records)
+    for dir_name in {os.path.dirname(relative_path) for _, _, relative_path in tasks} | {''}:
+        os.makedirs(os.path.join(recordings_dir, dir_name), exist_ok=True)
+    
+    manifest_path = os.path.join(recordings_dir, DOWNLOAD_MANIFEST_NAME)
+    manifest = load_download_manifest(manifest_path)
+    stats = {'downloaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+    semaphore = asyncio.Semaphore(client.max_pool_connections)
+    started = time.monotonic()
+    
+    async def download(s3_uri, contact_id, relative_path):
+        async with semaphore:
+            try:
+                downloaded, size, etag = await client.run(
+                    download_recording_file, s3_uri, os.path.join(recordings_dir, relative_path), manifest.get(relative_path)
+                )
+            except Exception as e:
+                logger.warning(f"下载录音失败 (ContactId: {contact_id}): {e}")
+                stats['failed'] += 1
+                return
+        
+        manifest[relative_path] = etag
+        if downloaded:
+            stats['downloaded'] += 1
+            stats['bytes'] += size
+        else:
+            stats['skipped'] += 1
+    
+    done = 0
+    for finished in asyncio.as_completed([download(*task) for task in tasks]):
+        await finished
+        done += 1
+        if done % 100 == 0:
+            save_download_manifest(manifest_path, manifest)
+        if progress_callback:
+            progress_callback(done, len(tasks), stats['bytes'], time.monotonic() - started)
+    save_download_manifest(manifest_path, manifest)
+    
+    return {
+        "base_dir": recordings_dir,
+        **stats,
+        "seconds": time.monotonic() - started,
+        "phone_groups": group_count
+    }
+
+# S3 API 函数
+def get_s3_object(s3_client, s3_uri):
+    """从S3获取对象"""
+    # 解析S3 URI
+    bucket_name, object_key = split_s3_uri(s3_uri)
+    
+    # 获取文件
+    return s3_client.get_object(Bucket=bucket_name, Key=object_key)
+
+def presign_recording_url(s3_client, s3_uri, file_name=None, expires=RECORDING_URL_EXPIRES):
+    """
+    生成录音的预签名下载链接
+    
+    浏览器直接从 S3 读取录音，播放时按需发送 Range 请求，录音内容不经过服务器内存
+    
+    :param s3_client: S3 客户端
+    :param s3_uri: 录音的 S3 地址
+    :param file_name: 可选，指定时浏览器将录音作为附件下载并使用该文件名
+    :param expires: 链接有效期（秒）
+    :return: 预签名链接
+    """
+    bucket_name, object_key = split_s3_uri(s3_uri)
+    params = {'Bucket': bucket_name, 'Key': object_key, 'ResponseContentType': 'audio/wav'}
+    if file_name:
+        params['ResponseContentDisposition'] = f'attachment; filename="{file_name}"'
+    return s3_client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+
+def iter_s3_object_chunks(s3_client, s3_uri, chunk_size=RECORDING_STREAM_CHUNK_SIZE, size=None):
+    """
+    按范围逐块读取 S3 对象，每块单独发送一次 GET 请求，限流时自动重试
+    
+    内存占用不超过一个数据块，与对象大小无关
+    
+    :param s3_client: S3 客户端
+    :param s3_uri: 对象的 S3 地址
+    :param chunk_size: 每块的字节数
+    :param size: 可选，对象大小，不指定时通过 HEAD 请求获取
+    :return: 生成数据块 (bytes)
+    """
+    bucket_name, object_key = split_s3_uri(s3_uri)
+    if size is None:
+        size = s3_client.head_object(Bucket=bucket_name, Key=object_key)['ContentLength']
+    
+    for start in range(0, size, chunk_size):
+        end = min(start + chunk_size, size) - 1
+        yield read_s3_object_with_retry(s3_client, bucket_name, object_key, (start, end))
+
+class RecordingBytesCache:
+    """
+    最近播放的录音的内存缓存，多个会话共享
+    
+    按总字节数淘汰最久未使用的录音，超过单个录音上限的不缓存。缓存按 ETag 校验，录音被覆盖后重新读取；
+    多个会话同时请求同一录音时只读取一次
+    """
+    
+    def __init__(self, max_bytes=RECORDING_CACHE_MAX_BYTES, max_item_bytes=RECORDING_CACHE_MAX_ITEM_BYTES):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._loading = {}
+        self._size = 0
+    
+    def _lookup(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+    
+    def _store(self, key, data):
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+    
+    def get(self, s3_client, s3_uri):
+        """
+        返回录音内容，未缓存时按范围分块读取后缓存
+        
+        :param s3_client: S3 客户端
+        :param s3_uri: 录音的 S3 地址
+        :return: 录音内容；录音超过单个录音上限时返回 None，由调用方改用预签名链接
+        """
+        bucket_name, object_key = split_s3_uri(s3_uri)
+        head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        size = head['ContentLength']
+        if size > self.max_item_bytes:
+            return None
+        
+        key = (s3_uri, head.get('ETag', ''))
+        data = self._lookup(key)
+        if data is not None:
+            return data
+        
+        # 同一录音只由一个线程读取，其余线程等待读取完成后从缓存获取
+        with self._lock:
+            loading = self._loading.get(key)
+            owner = loading is None
+            if owner:
+                loading = self._loading[key] = threading.Event()
+        if not owner:
+            loading.wait()
+            data = self._lookup(key)
+            if data is not None:
+                return data
+        
+        try:
+            buffer = bytearray()
+            for chunk in iter_s3_object_chunks(s3_client, s3_uri, size=size):
+                buffer.extend(chunk)
+            data = bytes(buffer)
+            self._store(key, data)
+            return data
+        finally:
+            if owner:
+                with self._lock:
+                    self._loading.pop(key, None)
+                loading.set()
+    
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+def parse_wav_header(data, total_size=None):
+    """
+    解析 RIFF/WAV 文件头
+    
+    依次跳过 fmt 和 data 之前的其他块（如 LIST），时长按 data 块长度除以每秒字节数计算。
+    data 块长度为 0 或 0xFFFFFFFF（边录边写、RF64）或超出文件大小时，按对象大小推算
+    
+    :param data: 文件开头的字节
+    :param total_size: 可选，对象的总大小
+    :return: dict，包含 duration、sample_rate、channels、bits_per_sample；
+             不是 WAV 文件或 data 块之前的内容不完整时返回 None
+    """
+    if len(data) < 12 or data[:4] not in (b'RIFF', b'RF64') or data[8:12] != b'WAVE':
+        return None
+    
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        (chunk_size,) = struct.unpack_from('<I', data, offset + 4)
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            if body + 16 > len(data):
+                return None
+            _, channels, sample_rate, byte_rate, _, bits_per_sample = struct.unpack_from('<HHIIHH', data, body)
+            fmt = {'sample_rate': sample_rate, 'channels': channels, 'bits_per_sample': bits_per_sample, 'byte_rate': byte_rate}
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            data_size = chunk_size
+            if total_size is not None:
+                available = max(total_size - body, 0)
+                if data_size in (0, 0xFFFFFFFF) or data_size > available:
+                    data_size = available
+            byte_rate = fmt.pop('byte_rate')
+            return dict(fmt, duration=data_size / byte_rate if byte_rate else None)
+        # 块按偶数字节对齐
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+def read_wav_metadata(s3_client, s3_uri, header_bytes=WAV_HEADER_READ_BYTES):
+    """
+    按范围只读取录音开头的字节并解析 WAV 文件头
+    
+    文件头之前有较大的其他块、首次读取不完整时，再读取一次 WAV_HEADER_MAX_BYTES 字节
+    
+    :param s3_client: S3 客户端
+    :param s3_uri: 录音的 S3 地址
+    :param header_bytes: 读取的字节数
+    :return: dict，包含 etag、size、duration、sample_rate、channels、bits_per_sample，无法解析的字段为 None；
+             空文件的时长为 0
+    """
+    bucket_name, key = split_s3_uri(s3_uri)
+    try:
+        response = call_with_s3_retry(
+            lambda: s3_client.get_object(Bucket=bucket_name, Key=key, Range=f"bytes=0-{header_bytes - 1}")
+        )
+    except ClientError as e:
+        # 空文件无法满足任何范围请求，ETag 从 HEAD 请求读取，用于之后校验缓存
+        if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+            head = s3_client.head_object(Bucket=bucket_name, Key=key)
+            return {'etag': head.get('ETag'), 'size': 0, 'duration': 0.0, 'sample_rate': None, 'channels': None, 'bits_per_sample': None}
+        raise
+    
+    data = response['Body'].read()
+    content_range = response.get('ContentRange') or ''
+    total_size = int(content_range.rsplit('/', 1)[1]) if '/' in content_range else len(data)
+    
+    metadata = parse_wav_header(data, total_size)
+    if metadata is None and len(data) < total_size and header_bytes < WAV_HEADER_MAX_BYTES and data[8:12] == b'WAVE':
+        return read_wav_metadata(s3_client, s3_uri, WAV_HEADER_MAX_BYTES)
+    
+    metadata = metadata or {'duration': None, 'sample_rate': None, 'channels': None, 'bits_per_sample': None}
+    return dict(metadata, etag=response.get('ETag'), size=total_size)
+
+def head_recording_etags(s3_client, s3_uris, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    并发发送 HEAD 请求，读取录音当前的 ETag
+    
+    :param s3_client: S3 客户端
+    :param s3_uris: 录音 S3 地址列表
+    :param max_workers: 最大并发线程数
+    :return: dict，S3 地址 -> ETag，不存在或读取失败的录音不包含在结果中
+    """
+    def head(s3_uri):
+        bucket_name, key = split_s3_uri(s3_uri)
+        return call_with_s3_retry(lambda: s3_client.head_object(Bucket=bucket_name, Key=key)).get('ETag')
+    
+    etags = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(head, s3_uri): s3_uri for s3_uri in s3_uris}
+        for future in as_completed(futures):
+            try:
+                etags[futures[future]] = future.result()
+            except Exception:
+                continue
+    return etags
+
+class RecordingMetadataCache:
+    """
+    录音元数据（时长、采样率、声道数）的本地缓存
+    
+    按 S3 地址保存，同时记录读取时的 ETag；使用前与录音当前的 ETag（来自录音索引或 HEAD 请求）比较，不一致时重新读取
+    """
+    
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS recording_metadata ("
+                "s3_uri TEXT PRIMARY KEY, etag TEXT, size INTEGER, duration REAL, sample_rate INTEGER, "
+                "channels INTEGER, bits_per_sample INTEGER, fetched_at REAL)"
+            )
+    
+    def _connect(self):
+        return open_sqlite(os.path.join(self.cache_dir, 'recording_metadata.sqlite'))
+    
+    def get_many(self, s3_uris):
+        """
+        批量读取缓存
+        
+        :param s3_uris: 录音 S3 地址列表
+        :return: dict，S3 地址 -> 元数据 dict（包含 etag）
+        """
+        s3_uris = list(s3_uris)
+        found = {}
+        columns = ['etag', 'size', 'duration', 'sample_rate', 'channels', 'bits_per_sample']
+        with self._connect() as conn:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for start in range(0, len(s3_uris), 500):
+                chunk = s3_uris[start:start + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                for row in conn.execute(
+                    f"SELECT s3_uri, {', '.join(columns)} FROM recording_metadata WHERE s3_uri IN ({placeholders})", chunk
+                ):
+                    found[row[0]] = dict(zip(columns, row[1:]))
+        return found
+    
+    def put_many(self, items):
+        """
+        批量写入缓存
+        
+        :param items: dict，S3 地址 -> read_wav_metadata 返回的元数据
+        """
+        now = time.time()
+        rows = [
+            (
+                s3_uri, metadata['etag'], metadata['size'], metadata['duration'],
+                metadata['sample_rate'], metadata['channels'], metadata['bits_per_sample'], now
+            )
+            for s3_uri, metadata in items.items()
+        ]
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO recording_metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM recording_metadata")
+
+def enrich_recording_metadata(s3_client, records, cache=None, index=None, max_workers=DEFAULT_MAX_WORKERS, progress_callback=None, stats=None):
+    """
+    为带有 录音S3地址 列的结果添加 时长(秒)、采样率、声道数 列
+    
+    每个录音只按范围读取开头几 KB 的文件头，不下载音频数据；已缓存且 ETag 未变化的录音不再读取。
+    缓存的 ETag 与录音索引中的 ETag 比较，索引中没有的录音发送 HEAD 请求读取当前 ETag
+    
+    :param s3_client: S3 客户端
+    :param records: 合并结果或录音列表 DataFrame
+    :param cache: 可选，RecordingMetadataCache 实例
+    :param index: 可选，RecordingIndex 实例，用其中的 ETag 判断缓存是否过期，可以减少 HEAD 请求
+    :param max_workers: 并发读取文件头的最大线程数
+    :param progress_callback: 可选，每读取完一个文件头调用 progress_callback(已完成数, 总数)
+    :param stats: 可选，QueryStats 实例，记录读取的文件头数量、缓存命中情况和失败数
+    :return: 添加了元数据列的 DataFrame（新对象）
+    """
+    s3_uris = records['录音S3地址'].dropna().astype(str).unique().tolist() if '录音S3地址' in records.columns else []
+    
+    known_etags = {}
+    if index is not None and s3_uris and 'ContactId' in records.columns:
+        indexed = index.lookup(records.loc[records['录音S3地址'].notna(), 'ContactId'].astype(str).unique())
+        known_etags = dict(zip(indexed['录音S3地址'], indexed['ETag']))
+    
+    metadata = cache.get_many(s3_uris) if cache is not None else {}
+    unknown = [s3_uri for s3_uri in metadata if not known_etags.get(s3_uri)]
+    if unknown:
+        known_etags.update(head_recording_etags(s3_client, unknown, max_workers))
+        if stats:
+            stats.incr('recording_metadata_validations', len(unknown))
+    metadata = {s3_uri: item for s3_uri, item in metadata.items() if item['etag'] and known_etags.get(s3_uri) == item['etag']}
+    missing = [s3_uri for s3_uri in s3_uris if s3_uri not in metadata]
+    if stats:
+        stats.incr('recording_metadata_cache', len(s3_uris) - len(missing), result='hit')
+        stats.incr('recording_metadata_cache', len(missing), result='miss')
+    
+    fetched = {}
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(read_wav_metadata, s3_client, s3_uri): s3_uri for s3_uri in missing}
+            for done, future in enumerate(as_completed(futures), 1):
+                s3_uri = futures[future]
+                try:
+                    fetched[s3_uri] = future.result()
+                except Exception as e:
+                    logger.warning(f"读取录音 {s3_uri} 的文件头时出错: {str(e)}")
+                    if stats:
+                        stats.incr('recording_headers_failed')
+                if progress_callback:
+                    progress_callback(done, len(missing))
+        if stats:
+            stats.incr('recording_headers_read', len(fetched))
+        if cache is not None and fetched:
+            cache.put_many(fetched)
+    metadata.update(fetched)
+    
+    enriched = records.copy()
+    uris = enriched['录音S3地址'].astype(object) if '录音S3地址' in enriched.columns else pd.Series(None, index=enriched.index, dtype=object)
+    for column, (field, dtype) in RECORDING_METADATA_COLUMNS.items():
+        values = {s3_uri: item[field] for s3_uri, item in metadata.items()}
+        enriched[column] = uris.map(values).astype(dtype)
+    return enriched
+
+def extract_number_after_plus(selected_numbers):
+    """
+    从selected_numbers中的第一个号码中提取"+"后面的数字
+    
+    :param selected_numbers: 电话号码列表
+    :return: "+"后面的数字，如果没有"+"或列表为空则返回原始号码
+    """
+    if not selected_numbers or len(selected_numbers) == 0:
+        return ""
+    
+    phone_number = selected_numbers[0]
+    
+    if "+" in phone_number:
+        # 找到"+"的位置并提取之后的所有字符
+        plus_index = phone_number.find("+")
+        return phone_number[plus_index + 1:]
+    else:
+        # 如果没有"+"，则返回原始号码
+        return phone_number
@@ -3,431 +3,81 @@ import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import asyncio
+import logging
 import boto3
+import hashlib
 import pandas as pd
-from datetime import datetime, timedelta
-import io
-import json
-from io import BytesIO
-import os
-import shutil
-
-# Connect API 函数
-def initialize_clients(session, region):
-    """初始化 AWS 客户端"""
-    try:
-        connect_client = session.client('connect', region_name=region)
-        s3_client = session.client('s3', region_name=region)
-        return connect_client, s3_client
-    except Exception as e:
-        st.error(f"无法初始化AWS客户端: {e}")
-        st.stop()
-
-def list_phone_numbers(connect_client, instance_id, max_results=100, next_token=None):
-    """获取 Connect 实例的电话号码列表"""
-    params = {
-        'InstanceId': instance_id,
-        'MaxResults': max_results
-    }
-    
-    if next_token:
-        params['NextToken'] = next_token
-        
-    return connect_client.list_phone_numbers(**params)
+import time
+from datetime import datetime, timedelta, timezone
 
-def get_all_phone_numbers(connect_client, instance_id):
-    """获取所有电话号码，处理分页"""
-    phone_numbers = []
-    
-    # 获取第一页结果
-    response = list_phone_numbers(connect_client, instance_id)
-    
-    for number in response.get('PhoneNumberSummaryList', []):
-        phone_numbers.append({
-            'PhoneNumber': number.get('PhoneNumber'),
-            'PhoneNumberId': number.get('PhoneNumberId'),
-            'PhoneNumberType': number.get('PhoneNumberType')
-        })
-    
-    # 处理分页
-    while 'NextToken' in response:
-        response = list_phone_numbers(
-            connect_client, 
-            instance_id, 
-            next_token=response['NextToken']
-        )
-        
-        for number in response.get('PhoneNumberSummaryList', []):
-            phone_numbers.append({
-                'PhoneNumber': number.get('PhoneNumber'),
-                'PhoneNumberId': number.get('PhoneNumberId'),
-                'PhoneNumberType': number.get('PhoneNumberType')
-            })
-    
-    return phone_numbers
+from ctr_search import (
+    ASYNC_S3_POOL_CONNECTIONS, DEFAULT_CONTACT_CACHE_MAX_BYTES, RECORDING_COLUMNS, RECORDING_DURATION_COLUMN,
+    ZIP_EXPORT_URL_EXPIRES, AsyncS3Client, ClientPool, ContactFileCache, ContactLookupIndex, DailyRollupStore, QueryStats,
+    RecordingBytesCache, RecordingIndex, RecordingMetadataCache, ResultQueryEngine,
+    async_download_recordings_to_directories, async_query_contacts_and_recordings,
+    attribute_recording_hotlines, combine_instance_results, concat_contact_batches, download_recordings_to_directories,
+    enrich_recording_metadata, export_recordings_zip_to_s3, extract_number_after_plus, get_all_phone_numbers,
+    get_call_recordings_list, get_call_recordings_s3_bucket, instrument_s3_client, iter_instance_searches,
+    merge_contacts_and_recordings, parse_s3_path, presign_recording_url, stream_contact_files
+)
 
-def get_call_recordings_s3_bucket(connect_client, instance_id, association_id):
-    """
-    获取 Amazon Connect 实例的通话录音 S3 存储桶路径
+# Streamlit 缓存有效期（秒）：Connect 实例信息、查询结果
+CONNECT_CACHE_TTL = 600
+QUERY_CACHE_TTL = 900
+
+class StreamlitLogHandler(logging.Handler):
+    """把查询模块输出的警告和错误显示在页面上，工作线程中的记录由调用方收集后显示"""
     
-    :param connect_client: Connect 客户端
-    :param instance_id: Amazon Connect 实例 ID
-    :param association_id: 关联 ID
-    :return: 通话录音的 S3 存储桶路径
-    """
-    try:
-        # 获取实例存储配置
-        response = connect_client.describe_instance_storage_config(
-            InstanceId=instance_id,
-            AssociationId=association_id,
-            ResourceType='CALL_RECORDINGS'  # 通话录音的固定值
-        )
-        
-        # 从存储配置中提取 S3 存储桶路径
-        storage_config = response.get('StorageConfig', {})
-        s3_config = storage_config.get('S3Config', {})
-        
-        if s3_config:
-            bucket_name = s3_config.get('BucketName')
-            bucket_prefix = s3_config.get('BucketPrefix', '')
-            
-            if bucket_name:
-                return f"s3://{bucket_name}/{bucket_prefix}"
-            else:
-                return "S3Config 中缺少 BucketName"
+    def emit(self, record):
+        if get_script_run_ctx(suppress_warning=True) is None:
+            return
+        message = self.format(record)
+        if record.levelno >= logging.ERROR:
+            st.error(message)
         else:
-            return "StorageConfig 中缺少 S3Config"
-    
-    except Exception as e:
-        return f"获取通话录音 S3 路径时出错: {str(e)}"
+            st.warning(message)
 
-def get_call_recordings_list(s3_client, s3_bucket_path, phone_numbers=None):
-    """
-    获取指定 S3 存储桶路径中的所有通话录音列表
-    
-    :param s3_client: S3 客户端
-    :param s3_bucket_path: S3 存储桶路径，格式为 's3://{bucket_name}/{bucket_prefix}'
-    :param phone_numbers: 可选，筛选特定电话号码的录音
-    :return: 包含录音信息的列表
-    """
-    try:
-        # 解析 S3 存储桶路径
-        if not s3_bucket_path.startswith('s3://'):
-            raise ValueError("S3 存储桶路径格式无效，应以 's3://' 开头")
-        
-        parts = s3_bucket_path.replace('s3://', '').split('/', 1)
-        bucket_name = parts[0]
-        bucket_prefix = parts[1] if len(parts) > 1 else ''
-        
-        # 列出 S3 存储桶中的对象
-        paginator = s3_client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=bucket_prefix)
-        
-        recordings = []
-        
-        for page in page_iterator:
-            if 'Contents' in page:
-                for obj in page['Contents']:
-                    key = obj['Key']
-                    
-                    # 检查对象是否为录音文件（假设为 .wav 格式）
-                    if key.endswith('.wav'):
-                        # 从文件路径中提取联系 ID
-                        file_name = key.split('/')[-1]
-                        contact_id = file_name.split('_')[0] if '_' in file_name else file_name.replace('.wav', '')
-                        
-                        # 默认使用第一个选择的电话号码
-                        default_phone = phone_numbers[0] if phone_numbers else '未知'
-                        
-                        # 构建录音信息
-                        recording_info = {
-                            'ContactId': contact_id,
-                            '录音S3地址': f"s3://{bucket_name}/{key}",
-                            '热线号码': default_phone  # 默认使用第一个选择的号码
-                        }
-                        
-                        # 如果有电话号码筛选，尝试从文件名或路径中提取
-                        if phone_numbers and len(phone_numbers) > 1:
-                            for phone in phone_numbers:
-                                if phone in key:
-                                    recording_info['热线号码'] = phone
-                                    break
-                        
-                        recordings.append(recording_info)
-        
-        return recordings
-    
-    except Exception as e:
-        st.error(f"获取录音列表时出错: {str(e)}")
-        return []
+# 每次运行脚本都会重新定义处理器类，按名称判断是否已注册，避免同一条消息重复显示
+ctr_search_logger = logging.getLogger('ctr_search')
+if not any(handler.get_name() == 'streamlit' for handler in ctr_search_logger.handlers):
+    streamlit_log_handler = StreamlitLogHandler(logging.WARNING)
+    streamlit_log_handler.set_name('streamlit')
+    ctr_search_logger.addHandler(streamlit_log_handler)
 
-def get_contact_files_list(s3_client, s3_bucket_path):
+def render_recording_player(s3_client, s3_uri, phone_number, contact_id, cache=None):
     """
-    获取指定 S3 存储桶路径中的所有联系记录文件
+    播放和下载单个录音
     
-    :param s3_client: S3 客户端
-    :param s3_bucket_path: S3 存储桶路径，格式为 's3://{bucket_name}/{bucket_prefix}'
-    :return: 包含联系记录信息的列表
-    """
-    try:
-        # 解析 S3 存储桶路径
-        if not s3_bucket_path.startswith('s3://'):
-            raise ValueError("S3 存储桶路径格式无效，应以 's3://' 开头")
-        
-        parts = s3_bucket_path.replace('s3://', '').split('/', 1)
-        bucket_name = parts[0]
-        bucket_prefix = parts[1] if len(parts) > 1 else ''
-        
-        # 列出 S3 存储桶中的对象
-        paginator = s3_client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=bucket_prefix)
-        
-        contact_files = []
-        processed_files = 0
-        max_files = 1000  # 限制处理的文件数量，避免处理太多文件
-        
-        for page in page_iterator:
-            if 'Contents' in page:
-                for obj in page['Contents']:
-                    key = obj['Key']
-                    
-                    # 检查对象是否为 CSV 或 Parquet 文件
-                    if key.endswith('.csv') or key.endswith('.parquet'):
-                        processed_files += 1
-                        if processed_files > max_files:
-                            st.warning(f"已达到最大处理文件数量限制 ({max_files})，停止处理更多文件")
-                            return contact_files
-                        
-                        try:
-                            # 获取对象
-                            s3_obj = s3_client.get_object(Bucket=bucket_name, Key=key)
-                            file_content = s3_obj['Body'].read()
-                            
-                            # 根据文件类型解析
-                            if key.endswith('.csv'):
-                                df = pd.read_csv(BytesIO(file_content))
-                            elif key.endswith('.parquet'):
-                                df = pd.read_parquet(BytesIO(file_content))
-                            
-                            # 提取联系 ID 和地址值
-                            if 'contactid' in df.columns:
-                                for _, row in df.iterrows():
-                                    contact_info = {
-                                        'ContactId': row.get('contactid', ''),
-                                        '热线号码': '',
-                                        '客户号码': '',
-                                        '文件路径': key
-                                    }
-                                    
-                                    # 尝试从不同字段获取电话号码
-                                    if 'systemendpoint' in df.columns:
-                                        if isinstance(row.get('systemendpoint'), dict):
-                                            contact_info['热线号码'] = row['systemendpoint'].get('address', '')
-                                        elif isinstance(row.get('systemendpoint'), str):
-                                            try:
-                                                system_endpoint = json.loads(row['systemendpoint'])
-                                                contact_info['热线号码'] = system_endpoint.get('address', '')
-                                            except:
-                                                pass
-                                    
-                                    if not contact_info['客户号码'] and 'customerendpoint' in df.columns:
-                                        if isinstance(row.get('customerendpoint'), dict):
-                                            contact_info['客户号码'] = row['customerendpoint'].get('address', '')
-                                        elif isinstance(row.get('customerendpoint'), str):
-                                            try:
-                                                customer_endpoint = json.loads(row['customerendpoint'])
-                                                contact_info['客户号码'] = customer_endpoint.get('address', '')
-                                            except:
-                                                pass
-                                    
-                                    contact_files.append(contact_info)
-                        except Exception as e:
-                            st.warning(f"处理文件 {key} 时出错: {str(e)}")
-                            continue
-        
-        return contact_files
-    
-    except Exception as e:
-        st.error(f"获取通话列表时出错: {str(e)}")
-        return []
-
-def merge_contacts_and_recordings(contact_files, recordings, selected_numbers=None):
-    """
-    合并联系记录和录音记录，基于ContactId进行left join
-    
-    :param contact_files: 联系记录列表
-    :param recordings: 录音记录列表
-    :param selected_numbers: 可选，筛选特定电话号码的记录
-    :return: 合并后的记录列表
-    """
-    try:
-        # 转换为DataFrame
-        df_contacts = pd.DataFrame(contact_files)
-        df_recordings = pd.DataFrame(recordings)
-        
-        # 确保两个DataFrame都有ContactId列
-        if 'ContactId' not in df_contacts.columns or 'ContactId' not in df_recordings.columns:
-            st.warning("联系记录或录音记录缺少ContactId列，无法合并")
-            return []
-        
-        # 执行left join
-        merged_df = pd.merge(
-            df_contacts, 
-            df_recordings, 
-            on='ContactId', 
-            how='left', 
-            suffixes=('', '_recording')
-        )
-        
-        # 筛选特定电话号码的记录
-        if selected_numbers and len(selected_numbers) > 0:
-            # 创建筛选条件：热线号码在selected_numbers中
-            mask = merged_df['热线号码'].isin(selected_numbers)
-            merged_df = merged_df[mask]
-        
-        # 添加是否有录音的标记
-        merged_df['有录音'] = merged_df['录音S3地址'].notna()
-        
-        return merged_df.to_dict('records')
-    
-    except Exception as e:
-        st.error(f"合并联系记录和录音记录时出错: {str(e)}")
-        return []
-
-def download_recordings_to_directories(s3_client, merged_records, recording_dir):
-    """
-    将录音文件下载到按热线号码组织的目录中
+    未指定 cache 时使用预签名链接，浏览器直接从 S3 按范围读取录音，不占用服务器内存；
+    指定 cache 时由服务器分块读取录音并放入多个会话共享的缓存，超过单个录音上限的录音仍使用预签名链接
     
-    :param s3_client: S3客户端
-    :param merged_records: 合并后的记录列表
-    :param base_dir: 基础目录，如果为None则使用当前目录
-    :return: 下载统计信息
+    :param s3_client: S3 客户端
+    :param s3_uri: 录音的 S3 地址
+    :param phone_number: 热线号码，用于下载文件名
+    :param contact_id: 联系 ID，用于下载文件名
+    :param cache: 可选，RecordingBytesCache 实例
     """
-    try:
-        # 如果没有指定基础目录，则使用当前目录
-        base_dir = os.getcwd()
-        
-        # 创建recordings目录作为根目录
-        recordings_dir = os.path.join(base_dir, recording_dir)
-        os.makedirs(recordings_dir, exist_ok=True)
-        
-        print(recording_dir)
-        
-        # 记录下载的文件数量
-        downloaded_count = 0
-        failed_count = 0
-        
-        # 按热线号码分组
-        phone_groups = {}
-        for record in merged_records:
-            s3_uri = record.get('录音S3地址')
-            if not s3_uri or pd.isna(s3_uri):
-                continue
-                
-            phone_number = record.get('热线号码', '未知')
-            if phone_number not in phone_groups:
-                phone_groups[phone_number] = []
-            
-            phone_groups[phone_number].append(record)
-        
-        print(phone_groups)
-        
-        # 为每个热线号码创建目录并下载文件
-        for phone_number, records in phone_groups.items():
-            # 创建目录名称（去掉+号）
-            dir_name = phone_number.replace('+', '')
-            dir_path = os.path.join(recordings_dir, dir_name)
-            
-            # 创建目录
-            os.makedirs(dir_path, exist_ok=True)
-            st.write(f"创建目录: {dir_path}")
-            
-            # 下载该热线号码的所有录音
-            for record in records:
-                s3_uri = record.get('录音S3地址')
-                contact_id = record.get('ContactId', '')
-                
-                try:
-                    # 解析S3 URI
-                    s3_parts = s3_uri.replace('s3://', '').split('/')
-                    bucket_name = s3_parts[0]
-                    object_key = '/'.join(s3_parts[1:])
-                    
-                    # 文件名称
-                    file_name = f"{contact_id}.wav"
-                    file_path = os.path.join(dir_path, file_name)
-                    
-                    # 下载文件
-                    s3_client.download_file(bucket_name, object_key, file_path)
-                    downloaded_count += 1
-                    
-                    st.write(f"下载文件: {file_path}")
-                except Exception as e:
-                    st.warning(f"下载录音失败 (ContactId: {contact_id}): {e}")
-                    failed_count += 1
-        
-        return {
-            "base_dir": recordings_dir,
-            "downloaded": downloaded_count,
-            "failed": failed_count,
-            "phone_groups": len(phone_groups)
-        }
-    
-    except Exception as e:
-        st.error(f"下载全部录音失败: {e}")
-        return None
-
-# S3 API 函数
-def get_s3_object(s3_client, s3_uri):
-    """从S3获取对象"""
-    # 解析S3 URI
-    s3_parts = s3_uri.replace('s3://', '').split('/')
-    bucket_name = s3_parts[0]
-    object_key = '/'.join(s3_parts[1:])
+    # 文件名称
+    file_name = f"recording_{phone_number}_{contact_id}.wav"
     
-    # 获取文件
-    return s3_client.get_object(Bucket=bucket_name, Key=object_key)
-
-def download_recording(s3_client, s3_uri, phone_number, contact_id):
-    """下载录音文件并创建下载按钮"""
     try:
-        obj = get_s3_object(s3_client, s3_uri)
-        data = obj['Body'].read()
-        
-        # 文件名称
-        file_name = f"recording_{phone_number}_{contact_id}.wav"
-        
-        # 提供下载
-        st.download_button(
-            label=f"下载 {file_name}",
-            data=data,
-            file_name=file_name,
-            mime="audio/wav"
-        )
+        data = cache.get(s3_client, s3_uri) if cache is not None else None
+        if data is None:
+            st.audio(presign_recording_url(s3_client, s3_uri))
+            st.link_button(f"下载 {file_name}", presign_recording_url(s3_client, s3_uri, file_name))
+        else:
+            st.audio(data, format="audio/wav")
+            st.download_button(
+                label=f"下载 {file_name}",
+                data=data,
+                file_name=file_name,
+                mime="audio/wav"
+            )
     except Exception as e:
         st.error(f"下载录音失败: {e}")
 
-def extract_number_after_plus(selected_numbers):
-    """
-    从selected_numbers中的第一个号码中提取"+"后面的数字
-    
-    :param selected_numbers: 电话号码列表
-    :return: "+"后面的数字，如果没有"+"或列表为空则返回原始号码
-    """
-    if not selected_numbers or len(selected_numbers) == 0:
-        return ""
-    
-    phone_number = selected_numbers[0]
-    
-    if "+" in phone_number:
-        # 找到"+"的位置并提取之后的所有字符
-        plus_index = phone_number.find("+")
-        return phone_number[plus_index + 1:]
-    else:
-        # 如果没有"+"，则返回原始号码
-        return phone_number
-
-
 # 主应用
 st.set_page_config(page_title="Amazon Connect 通话记录查询工具", layout="wide")
 
@@ -444,6 +94,7 @@ with st.sidebar:
     if use_profile:
         profile_name = st.text_input("配置文件名称", "default")
         session = boto3.Session(profile_name=profile_name)
+        client_identity = f"profile:{profile_name}"
     else:
         aws_access_key = st.text_input("AWS Access Key ID", "")
         aws_secret_key = st.text_input("AWS Secret Access Key", "", type="password")
@@ -452,16 +103,347 @@ with st.sidebar:
             aws_secret_access_key=aws_secret_key,
             region_name=aws_region
         )
+        # 客户端池和所有会话共享的查询缓存都按完整凭证区分，只知道 Access Key ID 不能读到其他用户缓存的结果
+        client_identity = f"key:{aws_access_key}:{hashlib.sha256(aws_secret_key.encode('utf-8')).hexdigest()}"
+
+    st.header("本地缓存")
+    use_contact_cache = st.checkbox("缓存已解析的通话记录文件", True)
+    contact_cache_limit_mb = st.number_input("缓存容量上限 (MB)", min_value=64, value=DEFAULT_CONTACT_CACHE_MAX_BYTES // 1024 ** 2, step=256)
+    use_recording_index = st.checkbox("使用本地录音索引（增量同步）", True)
+    
+    st.header("录音播放")
+    playback_mode = st.radio("播放和下载单个录音", ["预签名链接", "服务器中转（共享缓存）"], help="预签名链接由浏览器直接从 S3 读取录音；浏览器无法访问 S3 时使用服务器中转")
+    
+    st.header("ZIP 导出")
+    zip_export_path = st.text_input(
+        "ZIP 导出 S3 路径", "", placeholder="s3://bucket/ctr-search-exports/",
+        help=f"打包下载的录音写入该路径，需要写入权限，请使用单独的存储桶或前缀。"
+             f"下载链接 {ZIP_EXPORT_URL_EXPIRES // 60} 分钟内有效，过期的导出文件在下次导出时删除，也可以为该前缀配置生命周期规则"
+    )
+    
+    st.header("S3 I/O")
+    io_backend = st.radio(
+        "I/O 后端", ["线程池", "asyncio"], horizontal=True,
+        help="两种后端都使用本地录音索引；未使用录音索引时每次查询都会重新列出整个录音前缀，asyncio 后端的录音列表也不缓存"
+    )
+    async_pool_connections = st.number_input("asyncio 连接池大小", min_value=4, max_value=512, value=ASYNC_S3_POOL_CONNECTIONS, step=4, disabled=io_backend != "asyncio")
+    
+    # 清除 Connect API 和查询结果的缓存，下次查询时重新调用 AWS
+    if st.button("刷新查询缓存"):
+        st.cache_data.clear()
+        st.session_state.pop('query_result', None)
+        st.session_state.pop('client_pool', None)
+
+# 参数名以下划线开头的客户端对象不参与缓存键，缓存按凭证标识（包含 Secret Access Key 的哈希）、区域和查询条件区分
+@st.cache_data(ttl=CONNECT_CACHE_TTL, show_spinner=False)
+def cached_get_all_phone_numbers(_connect_client, client_identity, region, instance_id):
+    """按实例缓存电话号码列表"""
+    return get_all_phone_numbers(_connect_client, instance_id)
+
+@st.cache_data(ttl=CONNECT_CACHE_TTL, show_spinner=False)
+def _cached_call_recordings_s3_bucket(_connect_client, client_identity, region, instance_id, association_id):
+    """按实例和关联 ID 缓存录音 S3 路径，出错时抛出异常，st.cache_data 不缓存异常"""
+    s3_path = get_call_recordings_s3_bucket(_connect_client, instance_id, association_id)
+    if not s3_path.startswith('s3://'):
+        raise ValueError(s3_path)
+    return s3_path
+
+def cached_get_call_recordings_s3_bucket(connect_client, client_identity, region, instance_id, association_id):
+    """返回录音 S3 路径，出错时返回错误信息，错误信息不缓存，下次运行时重新获取"""
+    try:
+        return _cached_call_recordings_s3_bucket(connect_client, client_identity, region, instance_id, association_id)
+    except ValueError as e:
+        return str(e)
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, show_spinner=False)
+def cached_get_call_recordings_list(_s3_client, client_identity, region, s3_bucket_path, phone_numbers):
+    """按录音路径和所选号码缓存直接从 S3 列出的录音列表（不使用本地索引时）"""
+    return get_call_recordings_list(_s3_client, s3_bucket_path, list(phone_numbers))
+
+def get_query_result(query_key):
+    """返回会话中与查询条件一致且未过期的查询结果"""
+    query_result = st.session_state.get('query_result')
+    if not query_result or query_result['key'] != query_key:
+        return None
+    if time.time() - query_result['fetched_at'] > QUERY_CACHE_TTL:
+        st.session_state.pop('query_result', None)
+        return None
+    return query_result
+
+def save_query_result(query_key, result):
+    """将查询结果保存到会话中，同一会话只保留最近一次查询"""
+    query_result = dict(result, key=query_key, fetched_at=time.time())
+    st.session_state.query_result = query_result
+    return query_result
+
+def render_result_table(df, table_key):
+    """
+    显示带筛选、排序和翻页的结果表格
+    
+    :param df: 查询结果 DataFrame
+    :param table_key: 表格标识，用于区分各选项卡的组件和分页状态
+    :return: 当前页的查询结果，没有符合条件的记录时返回 None
+    """
+    # 查询引擎随结果保存在会话中，结果更新后重新创建
+    engines = st.session_state.setdefault('result_engines', {})
+    source, engine = engines.get(table_key, (None, None))
+    if source is not df:
+        engine = ResultQueryEngine(df)
+        engines[table_key] = (df, engine)
+    
+    filters = {}
+    filter_columns = st.columns(4)
+    if '热线号码' in df.columns:
+        hotline_options = sorted(df['热线号码'].dropna().astype(str).unique().tolist())
+        filters['hotlines'] = filter_columns[0].multiselect("热线号码", hotline_options, key=f"{table_key}_hotlines")
+    if '客户号码' in df.columns:
+        filters['customer_prefix'] = filter_columns[1].text_input("客户号码前缀", key=f"{table_key}_customer")
+    if '有录音' in df.columns:
+        recording_filter = filter_columns[2].selectbox("是否有录音", ["全部", "有录音", "无录音"], key=f"{table_key}_has_recording")
+        filters['has_recording'] = None if recording_filter == "全部" else recording_filter == "有录音"
+    filters['contact_id_prefix'] = filter_columns[3].text_input("ContactId 前缀", key=f"{table_key}_contact_id")
+    if RECORDING_DURATION_COLUMN in df.columns:
+        duration_columns = st.columns(2)
+        filters['min_duration'] = duration_columns[0].number_input("最短时长（秒）", min_value=0.0, value=None, key=f"{table_key}_min_duration")
+        filters['max_duration'] = duration_columns[1].number_input("最长时长（秒）", min_value=0.0, value=None, key=f"{table_key}_max_duration")
+    
+    sort_columns = st.columns([3, 1])
+    sort_by = sort_columns[0].selectbox("排序", ["（默认顺序）"] + df.columns.tolist(), key=f"{table_key}_sort")
+    descending = sort_columns[1].checkbox("降序", key=f"{table_key}_descending")
+    sort_by = None if sort_by == "（默认顺序）" else sort_by
+    
+    cursor_key = f"{table_key}_cursor"
+    page = engine.page(filters, sort_by, descending, st.session_state.get(cursor_key))
+    
+    if page['total'] == 0:
+        st.info("没有符合筛选条件的记录")
+        return None
+    
+    # 显示分页结果
+    st.write(f"显示 {page['start'] + 1} 到 {page['start'] + len(page['rows'])} 条记录，共 {page['total']} 条")
+    st.dataframe(page['rows'])
+    
+    def move_to(cursor):
+        st.session_state[cursor_key] = cursor
+    
+    navigation = st.columns(2)
+    navigation[0].button("上一页", key=f"{table_key}_prev", disabled=page['prev_cursor'] is None, on_click=move_to, args=(page['prev_cursor'],))
+    navigation[1].button("下一页", key=f"{table_key}_next", disabled=page['next_cursor'] is None, on_click=move_to, args=(page['next_cursor'],))
+    return page
+
+def get_client_pool():
+    """当前浏览器会话的客户端池，重新运行脚本时复用已创建的 Connect 和 S3 客户端"""
+    if 'client_pool' not in st.session_state:
+        st.session_state.client_pool = ClientPool()
+    return st.session_state.client_pool
+
+@st.cache_resource
+def get_recording_bytes_cache():
+    """多个会话共享的录音播放缓存"""
+    return RecordingBytesCache()
+
+@st.cache_resource
+def get_recording_index():
+    """在所有会话之间共享同一个录音索引"""
+    return RecordingIndex()
+
+@st.cache_resource
+def get_contact_lookup_index():
+    """在所有会话之间共享同一个联系记录查找索引"""
+    return ContactLookupIndex()
+
+@st.cache_resource
+def get_daily_rollup_store():
+    """在所有会话之间共享同一个每日汇总"""
+    return DailyRollupStore()
+
+@st.cache_resource
+def get_recording_metadata_cache():
+    """在所有会话之间共享同一个录音元数据缓存"""
+    return RecordingMetadataCache()
+
+@st.cache_resource
+def get_contact_file_cache(max_bytes):
+    """在所有会话之间共享同一个本地缓存实例"""
+    return ContactFileCache(max_bytes=max_bytes)
 
 # 初始化客户端
-connect_client, s3_client = initialize_clients(session, aws_region)
+try:
+    connect_client, s3_client = get_client_pool().get(session, aws_region, client_identity)
+    # 客户端在多次运行之间复用，先移除上次查询注册的统计处理函数，本次运行需要统计时再重新注册
+    instrument_s3_client(s3_client, None)
+except Exception as e:
+    st.error(f"无法初始化AWS客户端: {e}")
+    st.stop()
+contact_cache = get_contact_file_cache(int(contact_cache_limit_mb) * 1024 ** 2) if use_contact_cache else None
+recording_index = get_recording_index() if use_recording_index else None
 
 # 主界面
 instance_id = st.text_input("Amazon Connect Instance ID", 'b7e4b4ed-1bdf-4b14-b624-d9328f08725a')
 association_id = st.text_input("Association ID (浏览器开发者工具搜索storage-configs?resourceType=CALL_RECORDINGS)", 'cc68693c3c2dd52d57e2afd87cd7e0c02439b45f199801d22128e1ba591d0b8a')
 ctr_bucket = st.text_input('通话记录 S3 路径', value='s3://ctrvisualization1023/ctr-base/year=2025/month=05')
+query_mode = st.radio("通话记录查询方式", ["按 S3 路径", "按日期范围"], horizontal=True)
+selected_date_range = None
+if query_mode == "按日期范围":
+    today = datetime.now(timezone.utc).date()
+    date_range = st.date_input("通话日期范围 (UTC)", value=(today - timedelta(days=2), today))
+    if len(date_range) == 2:
+        # 结束日期包含当天，转换为不包含的结束时间
+        selected_date_range = (
+            datetime.combine(date_range[0], datetime.min.time()),
+            datetime.combine(date_range[1], datetime.min.time()) + timedelta(days=1)
+        )
 fetch_button = st.button("获取实例信息", key="fetch_instance_info")
 
+# 按客户号码或 ContactId 快速查询，直接使用本地索引，不扫描存储桶
+with st.expander("快速查询（本地索引）"):
+    lookup_index = get_contact_lookup_index()
+    lookup_columns = st.columns(2)
+    lookup_customer = lookup_columns[0].text_input("客户号码（支持前缀）", key="lookup_customer")
+    lookup_contact_id = lookup_columns[1].text_input("ContactId（支持前缀）", key="lookup_contact_id")
+    
+    if lookup_customer or lookup_contact_id:
+        lookup_result = lookup_index.search(customer=lookup_customer.strip(), contact_id=lookup_contact_id.strip())
+        st.write(f"找到 {len(lookup_result)} 条联系记录")
+        st.dataframe(lookup_result)
+    
+    # 将当前通话记录路径（或日期范围）中的新文件同步到索引
+    if st.button("同步索引", key="sync_lookup_index"):
+        sync_progress = st.empty()
+        try:
+            sync_stats = lookup_index.sync(
+                s3_client, ctr_bucket, selected_date_range, cache=contact_cache,
+                progress_callback=lambda files_done, rows_done: sync_progress.write(f"已同步 {files_done} 个新文件，{rows_done} 条联系记录")
+            )
+            st.success(f"同步完成：新增 {sync_stats['files']} 个文件，{sync_stats['rows']} 条联系记录，失败 {sync_stats['failed']} 个文件")
+        except Exception as e:
+            st.error(f"同步索引时出错: {e}")
+
+# 按热线号码和日期的预汇总统计，直接读取本地汇总表，不扫描 CTR 文件
+with st.expander("每日汇总（本地汇总表）"):
+    rollup_store = get_daily_rollup_store()
+    
+    # 将当前通话记录路径（或日期范围）中的新文件同步到汇总表，已获取实例信息时先同步录音索引以统计有录音数
+    if st.button("同步汇总", key="sync_daily_rollups"):
+        rollup_progress = st.empty()
+        try:
+            rollup_recording_index = get_recording_index()
+            if st.session_state.get('show_instance_info') and st.session_state.get('instance_id'):
+                recordings_path = cached_get_call_recordings_s3_bucket(connect_client, client_identity, aws_region, st.session_state.instance_id, st.session_state.association_id)
+                if recordings_path.startswith('s3://'):
+                    with st.spinner("正在同步录音索引..."):
+                        rollup_recording_index.sync(s3_client, *parse_s3_path(recordings_path))
+                else:
+                    st.warning(recordings_path)
+            rollup_stats = rollup_store.sync(
+                s3_client, ctr_bucket, rollup_recording_index, selected_date_range, cache=contact_cache,
+                progress_callback=lambda files_done, rows_done: rollup_progress.write(f"已汇总 {files_done} 个新文件，{rows_done} 条联系记录")
+            )
+            st.success(
+                f"同步完成：新增 {rollup_stats['files']} 个文件，{rollup_stats['rows']} 条联系记录，"
+                f"补充录音 {rollup_stats['recorded']} 条，失败 {rollup_stats['failed']} 个文件"
+            )
+        except Exception as e:
+            st.error(f"同步汇总时出错: {e}")
+    
+    rollup_summary = rollup_store.summary(date_range=selected_date_range)
+    if rollup_summary.empty:
+        st.info("汇总表中没有数据，请先同步汇总")
+    else:
+        rollup_hotlines = st.multiselect("热线号码", sorted(rollup_summary['热线号码'].unique()), key="rollup_hotlines")
+        if rollup_hotlines:
+            rollup_summary = rollup_summary[rollup_summary['热线号码'].isin(rollup_hotlines)]
+        
+        total_contacts = int(rollup_summary['通话数'].sum())
+        total_recorded = int(rollup_summary['有录音数'].sum())
+        metric_columns = st.columns(3)
+        metric_columns[0].metric("通话数", total_contacts)
+        metric_columns[1].metric("有录音数", total_recorded)
+        metric_columns[2].metric("录音占比", f"{total_recorded / total_contacts:.1%}" if total_contacts else "-")
+        
+        trend_tab, detail_tab = st.tabs(["每日趋势", "明细"])
+        with trend_tab:
+            st.line_chart(rollup_summary.pivot_table(index='日期', columns='热线号码', values='通话数', aggfunc='sum'))
+        with detail_tab:
+            st.dataframe(rollup_summary, hide_index=True, column_config={
+                '录音占比': st.column_config.NumberColumn(format="percent")
+            })
+
+# 同时查询多个实例（可以在不同区域），结果合并为一个带 区域 和 实例ID 列的结果
+with st.expander("多实例查询"):
+    multi_targets = st.data_editor(
+        pd.DataFrame([{'区域': aws_region, 'Instance ID': instance_id, 'Association ID': association_id, '通话记录 S3 路径': ctr_bucket}]),
+        num_rows="dynamic", hide_index=True, key="multi_targets"
+    )
+    multi_hotlines = st.text_input("热线号码（多个用逗号分隔，留空时查询各实例的全部号码）", key="multi_hotlines")
+    
+    if st.button("查询全部实例", key="multi_search"):
+        targets = [
+            {
+                'region': str(row['区域']).strip(),
+                'instance_id': str(row['Instance ID']).strip(),
+                'association_id': str(row['Association ID'] or '').strip(),
+                'ctr_path': str(row['通话记录 S3 路径']).strip()
+            }
+            for row in multi_targets.to_dict('records')
+            if row['区域'] and row['Instance ID'] and row['通话记录 S3 路径']
+        ]
+        if targets:
+            multi_stats = QueryStats()
+            multi_progress = st.progress(0.0, text=f"正在查询 {len(targets)} 个实例...")
+            multi_results = []
+            with multi_stats.span('search_instances'):
+                for target, result, error, messages in iter_instance_searches(
+                    get_client_pool(), session, targets,
+                    [number.strip() for number in multi_hotlines.split(',') if number.strip()],
+                    selected_date_range,
+                    client_identity,
+                    cache=contact_cache,
+                    index=recording_index,
+                    stats=multi_stats
+                ):
+                    multi_results.append((target, result, error, messages))
+                    # 实例在工作线程中查询，其中输出的警告无法直接显示在页面上，在这里逐条显示
+                    for message in messages:
+                        st.warning(f"实例 {target['instance_id']}（{target['region']}）: {message}")
+                    multi_progress.progress(len(multi_results) / len(targets), text=f"已完成 {len(multi_results)}/{len(targets)} 个实例")
+            multi_progress.empty()
+            st.session_state.multi_query_result = dict(combine_instance_results(targets, multi_results), stats=multi_stats)
+        else:
+            st.warning("请至少填写一行区域、Instance ID 和通话记录 S3 路径")
+    
+    multi_result = st.session_state.get('multi_query_result')
+    if multi_result:
+        st.dataframe(multi_result['targets'], hide_index=True)
+        multi_merged = multi_result['merged_records']
+        if multi_merged.empty:
+            st.info("未找到任何合并记录")
+        else:
+            st.write(f"共找到 {len(multi_merged)} 条合并记录，S3 请求 {multi_result['stats'].counter('s3_requests')} 次")
+            multi_page = render_result_table(multi_merged, "multi_merged")
+            
+            # 播放当前页中的录音，预签名链接需要使用录音所在区域的客户端
+            if multi_page is not None:
+                multi_playable = multi_page['rows'][multi_page['rows']['有录音']]
+                if not multi_playable.empty:
+                    multi_play_contact_id = st.selectbox(
+                        "播放录音（当前页）", multi_playable['ContactId'].astype(str).tolist(), index=None, key="multi_play"
+                    )
+                    if multi_play_contact_id:
+                        multi_play_row = multi_playable[multi_playable['ContactId'].astype(str) == multi_play_contact_id].iloc[0]
+                        _, multi_play_client = get_client_pool().get(session, str(multi_play_row['区域']), client_identity)
+                        render_recording_player(
+                            multi_play_client, multi_play_row['录音S3地址'], str(multi_play_row['热线号码']).replace('+', ''), multi_play_contact_id,
+                            get_recording_bytes_cache() if playback_mode == "服务器中转（共享缓存）" else None
+                        )
+            
+            # 其他区域的存储桶由 botocore 按重定向自动切换区域，下载使用当前区域的客户端即可
+            if st.button("下载全部录音", key="multi_download"):
+                with st.spinner("正在下载录音文件..."):
+                    result = download_recordings_to_directories(s3_client, multi_merged, "multi_instance")
+                if result:
+                    st.success(f"成功下载 {result['downloaded']} 个文件到 {result['base_dir']}，跳过已存在的 {result['skipped']} 个文件，失败 {result['failed']} 个文件")
+
 # 状态变量，用于控制是否显示电话号码和录音路径
 if 'show_instance_info' not in st.session_state:
     st.session_state.show_instance_info = False
@@ -472,140 +454,271 @@ if fetch_button and instance_id:
     st.session_state.instance_id = instance_id
     st.session_state.association_id = association_id
     st.session_state.ctr_bucket = ctr_bucket
+    st.session_state.ctr_date_range = selected_date_range
 
 # 如果状态为显示，则获取并显示电话号码和录音路径
 if st.session_state.get('show_instance_info', False) and st.session_state.get('instance_id'):
     try:
-        # 获取实例信息
+        # 获取实例信息（结果按实例缓存，翻页和切换选项卡时不会重新调用 Connect API）
         with st.spinner("正在获取实例信息..."):
             # 获取该实例的所有电话号码
-            phone_numbers = get_all_phone_numbers(connect_client, st.session_state.instance_id)
+            phone_numbers = cached_get_all_phone_numbers(connect_client, client_identity, aws_region, st.session_state.instance_id)
             
             # 获取录音 S3 路径
-            s3_path = get_call_recordings_s3_bucket(connect_client, st.session_state.instance_id, st.session_state.association_id)
+            s3_path = cached_get_call_recordings_s3_bucket(connect_client, client_identity, aws_region, st.session_state.instance_id, st.session_state.association_id)
             
-            # 显示实例信息
-            st.subheader("实例信息")
+        # 显示实例信息
+        st.subheader("实例信息")
+        
+        # 显示录音 S3 路径
+        st.write("通话录音 S3 路径:")
+        st.code(s3_path)
+        
+        # 显示电话号码
+        if phone_numbers:
+            df_phone_numbers = pd.DataFrame(phone_numbers)
+            st.write("该实例的热线电话号码:")
+            st.dataframe(df_phone_numbers)
             
-            # 显示录音 S3 路径
-            st.write("通话录音 S3 路径:")
-            st.code(s3_path)
+            # 选择电话号码
+            selected_numbers = st.multiselect(
+                "选择要查询通话记录的电话号码",
+                df_phone_numbers['PhoneNumber'].tolist()
+            )
             
-            # 显示电话号码
-            if phone_numbers:
-                df_phone_numbers = pd.DataFrame(phone_numbers)
-                st.write("该实例的热线电话号码:")
-                st.dataframe(df_phone_numbers)
-                
-                # 选择电话号码
-                selected_numbers = st.multiselect(
-                    "选择要查询通话记录的电话号码",
-                    df_phone_numbers['PhoneNumber'].tolist()
+            if selected_numbers:
+                # 查询结果保存在会话中，按查询条件区分，翻页、切换选项卡和点击下载按钮时直接复用
+                query_key = (
+                    client_identity,
+                    aws_region,
+                    st.session_state.instance_id,
+                    st.session_state.association_id,
+                    st.session_state.ctr_bucket,
+                    st.session_state.get('ctr_date_range'),
+                    tuple(sorted(selected_numbers))
                 )
+                query_result = get_query_result(query_key)
+                
+                # 添加按钮，点击后获取录音列表
+                fetch_clicked = st.button("获取录音列表")
+                
+                # 本次运行中的 S3 调用（查询、下载、打包）都记录到当前查询的统计中
+                query_stats = QueryStats() if fetch_clicked else (query_result or {}).get('stats')
+                if query_stats:
+                    instrument_s3_client(s3_client, query_stats)
                 
-                if selected_numbers:
-                    # 添加按钮，点击后获取录音列表
-                    if st.button("获取录音列表"):
-                        with st.spinner("正在获取数据..."):
-                            # 获取录音列表
-                            recordings = get_call_recordings_list(s3_client, s3_path, selected_numbers)
+                if fetch_clicked:
+                    with st.spinner("正在获取数据..."):
+                        # 流式获取通话列表，边读取边显示进度和已找到的记录
+                        progress_text = st.empty()
+                        contacts_preview = st.empty()
+                        
+                        def show_contact_progress(files_done, rows_done):
+                            progress_text.write(f"已处理 {files_done} 个通话记录文件，找到 {rows_done} 条联系记录")
+                        
+                        if io_backend == "asyncio":
+                            # 通话记录和录音列表同时获取，各分区前缀和文件在同一个连接池中并发处理
+                            async def query_async():
+                                async with AsyncS3Client(session, aws_region, async_pool_connections, stats=query_stats) as client:
+                                    return await async_query_contacts_and_recordings(
+                                        client,
+                                        st.session_state.ctr_bucket,
+                                        s3_path,
+                                        selected_numbers,
+                                        date_range=st.session_state.get('ctr_date_range'),
+                                        cache=contact_cache,
+                                        progress_callback=show_contact_progress,
+                                        stats=query_stats,
+                                        index=recording_index
+                                    )
                             
-                            # 获取通话列表
-                            contact_files = get_contact_files_list(s3_client, st.session_state.ctr_bucket)
+                            try:
+                                with query_stats.span('query_async'):
+                                    contact_files, recordings = asyncio.run(query_async())
+                            except Exception as e:
+                                st.error(f"获取通话列表时出错: {str(e)}")
+                                contact_files = concat_contact_batches([])
+                                recordings = pd.DataFrame(columns=RECORDING_COLUMNS)
+                            progress_text.empty()
+                        else:
+                            contact_batches = []
+                            try:
+                                with query_stats.span('stream_contact_files'):
+                                    for batch in stream_contact_files(
+                                        s3_client,
+                                        st.session_state.ctr_bucket,
+                                        selected_numbers,
+                                        date_range=st.session_state.get('ctr_date_range'),
+                                        progress_callback=show_contact_progress,
+                                        cache=contact_cache,
+                                        stats=query_stats
+                                    ):
+                                        contact_batches.append(batch)
+                                        contacts_preview.dataframe(batch.head(100))
+                            except Exception as e:
+                                st.error(f"获取通话列表时出错: {str(e)}")
                             
-                            # 合并联系记录和录音记录
-                            merged_records = merge_contacts_and_recordings(contact_files, recordings, selected_numbers)
+                            contact_files = concat_contact_batches(contact_batches)
+                            progress_text.empty()
+                            contacts_preview.empty()
                             
-                            # 显示结果
-                            st.subheader("查询结果")
+                            # 获取录音列表，并按通话记录中 ContactId 对应的热线号码确定录音归属
+                            contact_hotlines = contact_files.set_index('ContactId')['热线号码']
+                            if recording_index is not None:
+                                # 使用本地索引时只按通话记录中的 ContactId 查找录音
+                                with query_stats.span('get_call_recordings_list'):
+                                    recordings = get_call_recordings_list(
+                                        s3_client, s3_path, selected_numbers, recording_index, contact_hotlines
+                                    )
+                            else:
+                                with query_stats.span('get_call_recordings_list'):
+                                    recordings = cached_get_call_recordings_list(
+                                        s3_client, client_identity, aws_region, s3_path, tuple(selected_numbers)
+                                    )
+                                with query_stats.span('attribute_recording_hotlines'):
+                                    recordings = attribute_recording_hotlines(recordings, selected_numbers, contact_hotlines)
+                        
+                        # 合并联系记录和录音记录
+                        with query_stats.span('merge_contacts_and_recordings'):
+                            merged_records = merge_contacts_and_recordings(contact_files, recordings, selected_numbers)
+                        
+                        query_result = save_query_result(query_key, {
+                            'recordings': recordings,
+                            'contact_files': contact_files,
+                            'merged_records': merged_records,
+                            'stats': query_stats
+                        })
+                
+                if query_result:
+                    recordings = query_result['recordings']
+                    contact_files = query_result['contact_files']
+                    merged_records = query_result['merged_records']
+                    
+                    # 显示结果
+                    render_started = time.perf_counter()
+                    st.subheader("查询结果")
+                    
+                    # 创建三个选项卡
+                    tab1, tab2, tab3 = st.tabs(["录音列表", "通话列表", "合并列表"])
+                    
+                    # 录音列表选项卡
+                    with tab1:
+                        if not recordings.empty:
+                            st.write(f"共找到 {len(recordings)} 条录音记录")
+                            render_result_table(recordings, "recordings")
+                        else:
+                            st.info("未找到任何录音记录")
+                    
+                    # 通话列表选项卡
+                    with tab2:
+                        if not contact_files.empty:
+                            st.write(f"共找到 {len(contact_files)} 条联系记录")
+                            render_result_table(contact_files, "contacts")
+                        else:
+                            st.info("未找到任何联系记录")
+                    
+                    # 合并列表选项卡
+                    with tab3:
+                        if not merged_records.empty:
+                            # 只读取每个录音开头的文件头，得到时长、采样率和声道数后可按时长筛选和排序
+                            if RECORDING_DURATION_COLUMN not in merged_records.columns and merged_records['有录音'].any():
+                                if st.button("读取录音时长", help="按范围只读取每个录音开头几 KB 的文件头，不下载音频"):
+                                    metadata_progress = st.progress(0.0, text="正在读取录音文件头...")
+                                    merged_records = enrich_recording_metadata(
+                                        s3_client, merged_records,
+                                        cache=get_recording_metadata_cache(),
+                                        index=recording_index,
+                                        progress_callback=lambda done, total: metadata_progress.progress(done / total, text=f"已读取 {done}/{total} 个录音文件头"),
+                                        stats=query_stats
+                                    )
+                                    metadata_progress.empty()
+                                    query_result['merged_records'] = merged_records
                             
-                            # 创建三个选项卡
-                            tab1, tab2, tab3 = st.tabs(["录音列表", "通话列表", "合并列表"])
+                            st.write(f"共找到 {len(merged_records)} 条合并记录")
+                            merged_page = render_result_table(merged_records, "merged")
                             
-                            # 录音列表选项卡
-                            with tab1:
-                                if recordings:
-                                    st.write(f"共找到 {len(recordings)} 条录音记录")
-                                    df_recordings = pd.DataFrame(recordings)
-                                    
-                                    # 固定每页显示100条记录
-                                    items_per_page = 100
-                                    
-                                    # 分页显示
-                                    total_pages = (len(df_recordings) + items_per_page - 1) // items_per_page
-                                    page_number = st.number_input('页码', min_value=1, max_value=total_pages if total_pages > 0 else 1, value=1, key="recordings_page")
-                                    
-                                    start_idx = (page_number - 1) * items_per_page
-                                    end_idx = min(start_idx + items_per_page, len(df_recordings))
-                                    
-                                    # 显示分页结果
-                                    st.write(f"显示 {start_idx + 1} 到 {end_idx} 条记录，共 {len(df_recordings)} 条")
-                                    
-                                    st.dataframe(df_recordings.iloc[start_idx:end_idx])
-                                else:
-                                    st.info("未找到任何录音记录")
+                            # 播放当前页中的录音
+                            if merged_page is not None:
+                                playable = merged_page['rows'][merged_page['rows']['有录音']]
+                                if not playable.empty:
+                                    play_contact_id = st.selectbox(
+                                        "播放录音（当前页）", playable['ContactId'].astype(str).tolist(), index=None, key="merged_play"
+                                    )
+                                    if play_contact_id:
+                                        play_row = playable[playable['ContactId'].astype(str) == play_contact_id].iloc[0]
+                                        render_recording_player(
+                                            s3_client, play_row['录音S3地址'], str(play_row['热线号码']).replace('+', ''), play_contact_id,
+                                            get_recording_bytes_cache() if playback_mode == "服务器中转（共享缓存）" else None
+                                        )
                             
-                            # 通话列表选项卡
-                            with tab2:
-                                if contact_files:
-                                    # 筛选出热线号码等于selected_numbers的记录
-                                    df_contacts = pd.DataFrame(contact_files)
-                                    if selected_numbers:
-                                        df_contacts = df_contacts[df_contacts['热线号码'].isin(selected_numbers)]
-                                    
-                                    st.write(f"共找到 {len(df_contacts)} 条联系记录")
-                                    
-                                    # 固定每页显示100条记录
-                                    items_per_page = 100
-                                    
-                                    # 分页显示
-                                    total_pages = (len(df_contacts) + items_per_page - 1) // items_per_page
-                                    page_number = st.number_input('页码', min_value=1, max_value=total_pages if total_pages > 0 else 1, value=1, key="contacts_page")
+                            # 添加下载全部录音按钮
+                            if st.button("下载全部录音"):
+                                download_progress = st.progress(0.0, text="正在下载录音文件...")
+                                
+                                def show_download_progress(done, total, transferred_bytes, elapsed):
+                                    elapsed = max(elapsed, 1e-6)
+                                    download_progress.progress(
+                                        done / total,
+                                        text=f"已完成 {done}/{total} 个文件，"
+                                             f"{done / elapsed:.1f} 个/秒，{transferred_bytes / 1024 ** 2 / elapsed:.1f} MB/秒"
+                                    )
+                                
+                                if io_backend == "asyncio":
+                                    async def download_async():
+                                        async with AsyncS3Client(session, aws_region, async_pool_connections, stats=query_stats) as client:
+                                            return await async_download_recordings_to_directories(
+                                                client, merged_records, extract_number_after_plus(selected_numbers),
+                                                progress_callback=show_download_progress
+                                            )
                                     
-                                    start_idx = (page_number - 1) * items_per_page
-                                    end_idx = min(start_idx + items_per_page, len(df_contacts))
-                                    
-                                    # 显示分页结果
-                                    st.write(f"显示 {start_idx + 1} 到 {end_idx} 条记录，共 {len(df_contacts)} 条")
-                                    
-                                    # 显示联系记录
-                                    st.dataframe(df_contacts.iloc[start_idx:end_idx])
+                                    try:
+                                        result = asyncio.run(download_async())
+                                    except Exception as e:
+                                        st.error(f"下载全部录音失败: {e}")
+                                        result = None
                                 else:
-                                    st.info("未找到任何联系记录")
+                                    result = download_recordings_to_directories(
+                                        s3_client, merged_records, extract_number_after_plus(selected_numbers),
+                                        progress_callback=show_download_progress
+                                    )
+                                if result:
+                                    st.success(f"成功下载 {result['downloaded']} 个文件到 {result['base_dir']}，跳过已存在的 {result['skipped']} 个文件，失败 {result['failed']} 个文件")
+                                    st.info(f"文件已按热线号码组织到 {result['phone_groups']} 个目录中")
                             
-                            # 合并列表选项卡
-                            with tab3:
-                                if merged_records:
-                                    st.write(f"共找到 {len(merged_records)} 条合并记录")
-                                    df_merged = pd.DataFrame(merged_records)
-                                    
-                                    # 固定每页显示100条记录
-                                    items_per_page = 100
-                                    
-                                    # 分页显示
-                                    total_pages = (len(df_merged) + items_per_page - 1) // items_per_page
-                                    page_number = st.number_input('页码', min_value=1, max_value=total_pages if total_pages > 0 else 1, value=1, key="merged_page")
-                                    
-                                    start_idx = (page_number - 1) * items_per_page
-                                    end_idx = min(start_idx + items_per_page, len(df_merged))
-                                    
-                                    # 显示分页结果
-                                    st.write(f"显示 {start_idx + 1} 到 {end_idx} 条记录，共 {len(df_merged)} 条")
-                                    
-                                    # 显示合并记录
-                                    st.dataframe(df_merged.iloc[start_idx:end_idx])
-                                    
-                                    # 添加下载全部录音按钮
-                                    if st.button("下载全部录音"):
-                                        with st.spinner("正在下载录音文件..."):
-                                            result = download_recordings_to_directories(s3_client, merged_records, extract_number_after_plus(selected_numbers))
-                                            if result:
-                                                st.success(f"成功下载 {result['downloaded']} 个文件到 {result['base_dir']}，失败 {result['failed']} 个文件")
-                                                st.info(f"文件已按热线号码组织到 {result['phone_groups']} 个目录中")
+                            # 打包为 ZIP 并提供单个下载链接，不占用服务器磁盘
+                            if st.button("打包下载录音 (ZIP)"):
+                                if not zip_export_path.strip():
+                                    st.warning("请先在侧边栏填写 ZIP 导出 S3 路径")
                                 else:
-                                    st.info("未找到任何合并记录")
-            else:
-                st.info("该实例未绑定任何电话号码")
-                
+                                    with st.spinner("正在打包录音文件..."):
+                                        try:
+                                            export_uri, export_url = export_recordings_zip_to_s3(
+                                                s3_client, merged_records, zip_export_path.strip(), extract_number_after_plus(selected_numbers)
+                                            )
+                                            st.success(f"已打包到 {export_uri}，下载链接 {ZIP_EXPORT_URL_EXPIRES // 60} 分钟内有效，过期后文件将被删除")
+                                            st.link_button("下载 ZIP", export_url)
+                                        except Exception as e:
+                                            st.error(f"打包录音失败: {e}")
+                        else:
+                            st.info("未找到任何合并记录")
+                    
+                    # 查询统计：各阶段耗时、S3 请求、传输字节数、缓存命中和重试次数
+                    if query_stats:
+                        query_stats.observe('render_results', time.perf_counter() - render_started)
+                        with st.expander("查询统计"):
+                            st.write(
+                                f"S3 请求 {query_stats.counter('s3_requests')} 次，"
+                                f"列出对象 {query_stats.counter('s3_objects_listed')} 个，"
+                                f"下载 {query_stats.counter('s3_bytes_downloaded') / 1024 ** 2:.1f} MB，"
+                                f"重试 {query_stats.counter('s3_retries')} 次"
+                            )
+                            st.dataframe(query_stats.spans_frame(), hide_index=True)
+                            st.dataframe(query_stats.counters_frame(), hide_index=True)
+                            json_column, metrics_column = st.columns(2)
+                            json_column.download_button("导出 JSON", query_stats.to_json(), file_name="query_stats.json", mime="application/json")
+                            metrics_column.download_button("导出 OpenMetrics", query_stats.to_openmetrics(), file_name="query_stats.txt", mime="text/plain")
+        else:
+            st.info("该实例未绑定任何电话号码")
+            
     except Exception as e:
-        st.error(f"获取实例信息时出错: {e}")
\ No newline at end of file
+        st.error(f"获取实例信息时出错: {e}")
@@ -0,0 +1,128 @@
+import asyncio
+import io
+import json
+import os
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+moto = pytest.importorskip('moto')
+
+from ctr_search import (
+    DOWNLOAD_MANIFEST_NAME, AsyncS3Client, RecordingIndex, async_download_recordings_to_directories,
+    async_query_contacts_and_recordings, concat_contact_batches, download_recordings_to_directories,
+    get_call_recordings_list, merge_contacts_and_recordings, stream_contact_files
+)
+
+HOTLINES = ['+18005550100', '+18005550101']
+CTR_PATH = 's3://ctr/ctr-base'
+RECORDINGS_PATH = 's3://rec/connect/instance/CallRecordings/'
+
+def contact(contact_id, hotline, customer, day):
+    return {
+        'contactid': contact_id,
+        'initiationtimestamp': f'2025-05-{day:02d}T10:00:00Z',
+        'systemendpoint': {'address': hotline, 'type': 'TELEPHONE_NUMBER'},
+        'customerendpoint': {'address': customer, 'type': 'TELEPHONE_NUMBER'},
+        'channel': 'VOICE',
+    }
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='ctr')
+        client.create_bucket(Bucket='rec')
+        
+        # 每天一个 Parquet 文件和一个 CSV 文件，其中一半的联系记录有录音
+        for day in (1, 2):
+            contacts = [
+                contact(f'c{day}-{i:02d}', HOTLINES[i % 3 % 2], f'+8613800{day}{i:04d}', day)
+                for i in range(30)
+            ]
+            prefix = f'ctr-base/year=2025/month=05/day={day:02d}/hour=10/'
+            buffer = io.BytesIO()
+            pq.write_table(pa.Table.from_pylist(contacts[:15]), buffer)
+            client.put_object(Bucket='ctr', Key=prefix + 'part-0.parquet', Body=buffer.getvalue())
+            csv_rows = pd.DataFrame([
+                dict(row, systemendpoint=json.dumps(row['systemendpoint']), customerendpoint=json.dumps(row['customerendpoint']))
+                for row in contacts[15:]
+            ])
+            client.put_object(Bucket='ctr', Key=prefix + 'part-1.csv', Body=csv_rows.to_csv(index=False).encode('utf-8'))
+            for row in contacts[::2]:
+                client.put_object(
+                    Bucket='rec',
+                    Key=f"connect/instance/CallRecordings/2025/05/{day:02d}/{row['contactid']}_20250501T10:00_UTC.wav",
+                    Body=row['contactid'].encode('utf-8') * 100
+                )
+        yield client
+
+def sync_query(s3, index=None):
+    contact_files = concat_contact_batches(stream_contact_files(s3, CTR_PATH, HOTLINES))
+    recordings = get_call_recordings_list(
+        s3, RECORDINGS_PATH, HOTLINES, index, contact_files.set_index('ContactId')['热线号码']
+    )
+    return contact_files, recordings
+
+def async_query(index=None):
+    async def query():
+        async with AsyncS3Client(region='us-east-1', max_pool_connections=8) as client:
+            return await async_query_contacts_and_recordings(client, CTR_PATH, RECORDINGS_PATH, HOTLINES, index=index)
+    return asyncio.run(query())
+
+def normalized(df):
+    return df.astype(object).sort_values(list(df.columns)).reset_index(drop=True)
+
+@pytest.mark.parametrize('use_index', [False, True])
+def test_async_query_matches_sync_pipeline(s3, tmp_path, use_index):
+    index = RecordingIndex(str(tmp_path / 'index')) if use_index else None
+    sync_contacts, sync_recordings = sync_query(s3, index)
+    
+    async_contacts, async_recordings = async_query(index)
+    
+    assert len(async_contacts) == 60
+    assert len(async_recordings) == 30
+    pd.testing.assert_frame_equal(normalized(async_contacts), normalized(sync_contacts))
+    pd.testing.assert_frame_equal(normalized(async_recordings), normalized(sync_recordings))
+
+def test_async_download_matches_sync_and_resumes(s3, tmp_path):
+    contact_files, recordings = async_query()
+    merged_records = merge_contacts_and_recordings(contact_files, recordings, HOTLINES)
+    
+    async def download(recording_dir):
+        async with AsyncS3Client(region='us-east-1', max_pool_connections=8) as client:
+            return await async_download_recordings_to_directories(client, merged_records, recording_dir)
+    
+    async_dir = str(tmp_path / 'async')
+    first = asyncio.run(download(async_dir))
+    assert (first['downloaded'], first['skipped'], first['failed']) == (30, 0, 0)
+    
+    # 删除一个文件后再次下载：只下载缺少的文件，其余按下载记录跳过
+    with open(os.path.join(async_dir, DOWNLOAD_MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert len(manifest) == 30
+    removed = sorted(manifest)[0]
+    os.remove(os.path.join(async_dir, removed))
+    second = asyncio.run(download(async_dir))
+    assert (second['downloaded'], second['skipped'], second['failed']) == (1, 29, 0)
+    
+    sync_dir = str(tmp_path / 'sync')
+    sync_result = download_recordings_to_directories(s3, merged_records, sync_dir)
+    assert sync_result['downloaded'] == 30
+    
+    def files(root):
+        found = {}
+        for directory, _, names in os.walk(root):
+            for name in names:
+                if name != DOWNLOAD_MANIFEST_NAME:
+                    with open(os.path.join(directory, name), 'rb') as f:
+                        found[os.path.relpath(os.path.join(directory, name), root)] = f.read()
+        return found
+    
+    assert files(async_dir) == files(sync_dir)
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from ctr_search import attribute_recording_hotlines
+
+def make_recordings():
+    return pd.DataFrame({
+        'ContactId': ['c1', 'c2', 'c3'],
+        '录音S3地址': [
+            's3://rec/2025/05/01/c1_20250501T10:00_UTC.wav',
+            's3://rec/2025/05/01/c2_20250501T10:00_UTC.wav',
+            's3://rec/18005550100/c3_20250501T10:00_UTC.wav',
+        ],
+    })
+
+def test_unmatched_recordings_are_unknown_with_one_selected_number():
+    contact_hotlines = pd.Series({'c1': '+18005550100'})
+    
+    result = attribute_recording_hotlines(make_recordings(), ['+18005550100'], contact_hotlines)
+    
+    assert result['热线号码'].astype(object).tolist() == ['+18005550100', '未知', '+18005550100']
+
+def test_unmatched_recordings_are_unknown_with_several_selected_numbers():
+    contact_hotlines = pd.Series({'c1': '+18005550101'})
+    
+    result = attribute_recording_hotlines(make_recordings(), ['+18005550100', '+18005550101'], contact_hotlines)
+    
+    assert result['热线号码'].astype(object).tolist() == ['+18005550101', '未知', '+18005550100']
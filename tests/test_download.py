@@ -0,0 +1,50 @@
+import io
+import zipfile
+
+import pandas as pd
+
+from ctr_search import iter_recordings_zip, plan_recording_files
+
+class FakeS3Client:
+    """按对象键返回固定内容的 S3 客户端"""
+    
+    def __init__(self, objects):
+        self.objects = objects
+    
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+def make_records():
+    # 重复的 ContactId 各占一行，其中 c1 有两条不同的录音
+    return pd.DataFrame({
+        'ContactId': ['c1', 'c1', 'c1', 'c2'],
+        '热线号码': ['+1800', '+1800', '+1800', '+1800'],
+        '录音S3地址': [
+            's3://rec/2025/05/01/c1_20250501T10:00_UTC.wav',
+            's3://rec/2025/05/01/c1_20250501T10:00_UTC.wav',
+            's3://rec/2025/05/01/c1_20250501T10:05_UTC.wav',
+            's3://rec/2025/05/01/c2_20250501T11:00_UTC.wav',
+        ],
+    })
+
+def test_plan_recording_files_gives_each_recording_its_own_path():
+    files, group_count = plan_recording_files(make_records())
+    
+    assert group_count == 1
+    assert [s3_uri for s3_uri, _, _ in files] == make_records()['录音S3地址'].drop_duplicates().tolist()
+    assert [relative_path for _, _, relative_path in files] == [
+        '1800/c1_20250501T10:00_UTC.wav',
+        '1800/c1_20250501T10:05_UTC.wav',
+        '1800/c2.wav',
+    ]
+
+def test_iter_recordings_zip_writes_unique_entries():
+    records = make_records()
+    client = FakeS3Client({uri.split('/', 3)[3]: uri.encode('utf-8') for uri in records['录音S3地址']})
+    
+    data = b''.join(iter_recordings_zip(client, records))
+    
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        names = archive.namelist()
+        assert len(names) == len(set(names)) == 3
+        assert archive.read('1800/c1_20250501T10:05_UTC.wav') == b's3://rec/2025/05/01/c1_20250501T10:05_UTC.wav'
@@ -0,0 +1,40 @@
+import logging
+
+import pytest
+
+import ctr_search
+from ctr_search import combine_instance_results, iter_instance_searches
+
+TARGETS = [
+    {'region': 'us-east-1', 'instance_id': 'ok', 'association_id': '', 'ctr_path': 's3://ctr/a'},
+    {'region': 'us-west-2', 'instance_id': 'broken', 'association_id': '', 'ctr_path': 's3://ctr/b'},
+]
+
+class FakePool:
+    def get(self, session, region, identity=None):
+        return None, None
+
+@pytest.fixture
+def fake_search(monkeypatch):
+    def search(connect_client, s3_client, target, *args):
+        ctr_search.logger.warning(f"{target['instance_id']} 的文件无法读取")
+        if target['instance_id'] == 'broken':
+            raise RuntimeError('AccessDenied')
+        empty = combine_instance_results([], [])
+        return {'recordings_path': None, 'phone_numbers': [], **{
+            name: empty[name] for name in ('recordings', 'contact_files', 'merged_records')
+        }}
+    monkeypatch.setattr(ctr_search, 'search_instance', search)
+
+def test_worker_warnings_are_returned_per_instance(fake_search, caplog):
+    caplog.set_level(logging.WARNING, logger='ctr_search')
+    results = list(iter_instance_searches(FakePool(), None, TARGETS))
+    
+    warnings = {target['instance_id']: messages for target, _, _, messages in results}
+    assert warnings == {'ok': ['ok 的文件无法读取'], 'broken': ['broken 的文件无法读取']}
+    # 收集警告不影响原来的日志输出
+    assert 'ok 的文件无法读取' in caplog.messages
+    
+    combined = combine_instance_results(TARGETS, results)['targets']
+    assert combined['警告'].tolist() == ['ok 的文件无法读取', 'broken 的文件无法读取']
+    assert combined['错误'].tolist() == ['', 'AccessDenied']
@@ -0,0 +1,24 @@
+import pandas as pd
+
+from ctr_search import ResultQueryEngine
+
+def make_engine(rows=250):
+    return ResultQueryEngine(pd.DataFrame({'ContactId': [f"c{i:03d}" for i in range(rows)]}), result_id='result')
+
+def test_negative_cursor_offset_returns_first_page():
+    engine = make_engine()
+    fingerprint = engine._fingerprint(None, None, False)
+    
+    page = engine.page(cursor=ResultQueryEngine.encode_cursor(fingerprint, -50))
+    
+    assert page['start'] == 0
+    assert page['prev_cursor'] is None
+    assert page['rows']['ContactId'].iloc[0] == 'c000'
+
+def test_cursor_from_another_result_set_returns_first_page():
+    first = make_engine()
+    next_cursor = first.page()['next_cursor']
+    
+    page = ResultQueryEngine(first.df, result_id='other').page(cursor=next_cursor)
+    
+    assert page['start'] == 0
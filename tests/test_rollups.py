@@ -0,0 +1,60 @@
+import io
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+moto = pytest.importorskip('moto')
+
+from ctr_search import DailyRollupStore
+
+KEY = 'ctr-base/year=2025/month=05/day=01/hour=10/part-0.parquet'
+
+def put_contacts(client, rows):
+    contacts = [
+        {
+            'contactid': contact_id,
+            'initiationtimestamp': '2025-05-01T10:00:00Z',
+            'systemendpoint': {'address': hotline, 'type': 'TELEPHONE_NUMBER'},
+            'customerendpoint': {'address': customer, 'type': 'TELEPHONE_NUMBER'},
+            'channel': 'VOICE',
+        }
+        for contact_id, hotline, customer in rows
+    ]
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pylist(contacts), buffer)
+    client.put_object(Bucket='ctr', Key=KEY, Body=buffer.getvalue())
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='ctr')
+        yield client
+
+def test_rewritten_file_replaces_its_customers(s3, tmp_path):
+    store = DailyRollupStore(str(tmp_path))
+    put_contacts(s3, [
+        ('c1', '+18005550100', 'a1'),
+        ('c2', '+18005550100', 'a2'),
+        ('c3', '+18005550100', 'a3'),
+        ('c4', '+18005550101', 'b1'),
+    ])
+    assert store.sync(s3, 's3://ctr/ctr-base')['files'] == 1
+    before = store.summary().set_index('热线号码')
+    assert before.loc['+18005550100', ['通话数', '客户数']].tolist() == [3, 3]
+    assert before.loc['+18005550101', ['通话数', '客户数']].tolist() == [1, 1]
+    
+    # 改写同一文件：客户 a2、a3 被替换为 a4，另一条热线的记录被删除
+    put_contacts(s3, [
+        ('c1', '+18005550100', 'a1'),
+        ('c5', '+18005550100', 'a4'),
+    ])
+    assert store.sync(s3, 's3://ctr/ctr-base')['files'] == 1
+    after = store.summary()
+    assert after['热线号码'].tolist() == ['+18005550100']
+    assert after.loc[0, ['通话数', '客户数']].tolist() == [2, 2]